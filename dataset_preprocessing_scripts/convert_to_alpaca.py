@@ -3,12 +3,24 @@ convert_to_alpaca.py
 Converts validated data to Alpaca format for training.
 """
 
+import argparse
 import json
+import os
 import random
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import List, Dict
+from typing import Iterable, Iterator, List, Dict, Tuple
 
-def create_single_os_examples(entry: dict) -> List[dict]:
+from utils import RecordWriter, iter_records, keyed_shuffle, list_record_files
+
+OS_PHRASES = {
+    "linux": ["on Linux", "in Linux", "using Linux", "for Linux"],
+    "windows": ["on Windows", "in Windows", "using Windows CMD", "for Windows"],
+    "mac": ["on Mac", "on macOS", "using Mac terminal", "for macOS"]
+}
+
+def create_single_os_examples(entry: dict, rng=random) -> List[dict]:
     """Create 3 examples (one per OS) from a single entry."""
     examples = []
     
@@ -27,13 +39,8 @@ def create_single_os_examples(entry: dict) -> List[dict]:
         })
         
         # Format 2: OS mentioned in instruction (50% of the time)
-        if random.random() < 0.5:
-            os_phrases = {
-                "linux": ["on Linux", "in Linux", "using Linux", "for Linux"],
-                "windows": ["on Windows", "in Windows", "using Windows CMD", "for Windows"],
-                "mac": ["on Mac", "on macOS", "using Mac terminal", "for macOS"]
-            }
-            phrase = random.choice(os_phrases[os_name])
+        if rng.random() < 0.5:
+            phrase = rng.choice(OS_PHRASES[os_name])
             examples.append({
                 "instruction": f"{entry['instruction']} {phrase}",
                 "input": "",
@@ -42,7 +49,7 @@ def create_single_os_examples(entry: dict) -> List[dict]:
     
     return examples
 
-def create_json_output_example(entry: dict) -> dict:
+def create_json_output_example(entry: dict, rng=random) -> dict:
     """Create JSON output format example."""
     json_output = {
         "description": entry["instruction"],
@@ -62,65 +69,103 @@ def create_json_output_example(entry: dict) -> dict:
     
     return {
         "instruction": entry["instruction"],
-        "input": random.choice(input_phrases),
+        "input": rng.choice(input_phrases),
         "output": json.dumps(json_output, ensure_ascii=False)
     }
 
-def convert_category_to_alpaca(entries: List[dict]) -> List[dict]:
-    """Convert all entries in a category to Alpaca format."""
-    alpaca_data = []
+def convert_entry_to_alpaca(entry: dict, rng=random) -> List[dict]:
+    """Convert a single entry to its Alpaca examples."""
+    # Add single OS examples (3 per entry)
+    examples = create_single_os_examples(entry, rng)
     
-    for entry in entries:
-        # Add single OS examples (3 per entry)
-        alpaca_data.extend(create_single_os_examples(entry))
-        
-        # Add JSON format example (1 per entry)
-        alpaca_data.append(create_json_output_example(entry))
-        
-        # Add additional JSON format example with different phrasing (50% chance)
-        if random.random() < 0.5:
-            alpaca_data.append(create_json_output_example(entry))
+    # Add JSON format example (1 per entry)
+    examples.append(create_json_output_example(entry, rng))
+    
+    # Add additional JSON format example with different phrasing (50% chance)
+    if rng.random() < 0.5:
+        examples.append(create_json_output_example(entry, rng))
     
-    return alpaca_data
+    return examples
+
+def entry_rng(entry: dict, seed: int = 42) -> random.Random:
+    """RNG for one entry's variant choices, derived from its id alone."""
+    return random.Random(f"{seed}:{entry.get('id') or entry['instruction']}")
+
+def iter_alpaca_examples(entries: Iterable[dict], seed: int = None) -> Iterator[dict]:
+    """
+    Yield Alpaca examples entry by entry. With a seed, each entry's
+    variants come from entry_rng, so they do not depend on which other
+    entries were converted before it.
+    """
+    for entry in entries:
+        rng = random if seed is None else entry_rng(entry, seed)
+        yield from convert_entry_to_alpaca(entry, rng)
 
-def main():
-    validated_dir = Path("datasets/generated/validated")
-    processed_dir = Path("datasets/generated/processed")
-    processed_dir.mkdir(parents=True, exist_ok=True)
+def convert_file(filepath: str, part_path: str, seed: int) -> Tuple[int, int]:
+    """Convert one category file into a JSONL part file. Runs inside a worker process."""
+    entry_count = 0
+    def counted(entries):
+        nonlocal entry_count
+        for entry in entries:
+            entry_count += 1
+            yield entry
+    with RecordWriter(part_path) as writer:
+        writer.write_all(iter_alpaca_examples(counted(iter_records(filepath)), seed))
+    return entry_count, writer.count
+
+def convert_category_to_alpaca(entries: List[dict]) -> List[dict]:
+    """Convert all entries in a category to Alpaca format."""
+    return list(iter_alpaca_examples(entries))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert entries to Alpaca format.")
+    parser.add_argument("--input-dir", default="datasets/generated/deduped",
+                        help="Entries to convert (output of dedup.py; "
+                             "pass datasets/generated/validated to skip deduplication)")
+    parser.add_argument("--output-dir", default="datasets/generated/merged")
+    parser.add_argument("--seed", type=int, default=42,
+                        help="Seeds each entry's variant choices (from its id) and the final shuffle")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Category files converted in parallel; 1 runs in-process")
+    args = parser.parse_args(argv)
+    
+    validated_dir = Path(args.input_dir)
     
     if not validated_dir.exists():
-        print(f"Directory not found: {validated_dir}")
+        print(f"Directory not found: {validated_dir} (run dedup.py first)")
         return
 
-    all_alpaca_data = []
+    # Each category is streamed to its own part file so the full dataset
+    # never has to fit in memory; the parts directory is removed even on a crash
+    merged_dir = Path(args.output_dir)
+    merged_dir.mkdir(parents=True, exist_ok=True)
+    filepaths = [path for path in list_record_files(validated_dir) if "_issues" not in path.name]
+    output_path = merged_dir / "full_dataset.json"
     
-    for filepath in validated_dir.glob("*.json"):
-        if "_issues" in filepath.name:
-            continue
-            
-        print(f"Converting: {filepath.name}")
+    with tempfile.TemporaryDirectory(prefix=".parts_", dir=merged_dir) as parts_dir:
+        jobs = [(str(path), str(Path(parts_dir) / f"{path.stem}.jsonl"), args.seed) for path in filepaths]
         
-        with open(filepath, 'r', encoding='utf-8') as f:
-            entries = json.load(f)
+        if args.workers == 1:
+            counts = [convert_file(*job) for job in jobs]
+        else:
+            with ProcessPoolExecutor(max_workers=args.workers) as pool:
+                counts = list(pool.map(convert_file, *zip(*jobs))) if jobs else []
         
-        alpaca_entries = convert_category_to_alpaca(entries)
-        all_alpaca_data.extend(alpaca_entries)
+        total = 0
+        for filepath, (entry_count, example_count) in zip(filepaths, counts):
+            print(f"Converting: {filepath.name}")
+            print(f"  Generated {example_count} Alpaca examples from {entry_count} entries")
+            total += example_count
         
-        print(f"  Generated {len(alpaca_entries)} Alpaca examples from {len(entries)} entries")
-    
-    print(f"\nTotal Alpaca examples: {len(all_alpaca_data)}")
-    
-    # Shuffle all data
-    random.shuffle(all_alpaca_data)
-    
-    # Save merged dataset
-    merged_dir = Path("datasets/generated/merged")
-    merged_dir.mkdir(parents=True, exist_ok=True)
-    
-    with open(merged_dir / "full_dataset.json", 'w', encoding='utf-8') as f:
-        json.dump(all_alpaca_data, f, indent=2, ensure_ascii=False)
+        print(f"\nTotal Alpaca examples: {total}")
+        
+        # Keyed hash sort: the order depends only on the examples and the seed,
+        # so the file is byte-identical for any worker count or file order
+        part_paths = [Path(job[1]) for job in jobs]
+        keyed_shuffle((record for path in part_paths for record in iter_records(path)), output_path,
+                      seed=args.seed)
     
-    print(f"Saved to: {merged_dir / 'full_dataset.json'}")
+    print(f"Saved to: {output_path}")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,224 @@
+"""
+dedup.py
+Removes exact and near-duplicate entries between validation and conversion.
+
+Exact duplicates share the same normalized (instruction, linux, windows_cmd,
+mac) content. Near-duplicates are paraphrased instructions with identical
+commands, found with a MinHash/LSH index over instruction character
+shingles. The first occurrence is kept; removals are reported by category.
+"""
+
+import argparse
+import hashlib
+import struct
+from array import array
+from collections import Counter, defaultdict
+from contextlib import ExitStack
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from utils import RecordWriter, iter_records, list_record_files, save_json
+
+MERSENNE_PRIME = (1 << 61) - 1
+
+def normalize_instruction(text: str) -> str:
+    """Lowercase, collapse whitespace and drop trailing punctuation."""
+    return " ".join(text.lower().split()).rstrip(".!?")
+
+def normalize_command(text: str) -> str:
+    """Collapse whitespace only; shell commands are case-sensitive."""
+    return " ".join(text.split())
+
+def _hash64(text: str) -> int:
+    return struct.unpack("<Q", hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest())[0]
+
+def content_key(entry: dict) -> bytes:
+    """Hash of the normalized instruction and commands."""
+    parts = (
+        normalize_instruction(entry["instruction"]),
+        normalize_command(entry["linux"]),
+        normalize_command(entry["windows_cmd"]),
+        normalize_command(entry["mac"]),
+    )
+    return hashlib.blake2b("\x1f".join(parts).encode("utf-8"), digest_size=16).digest()
+
+def commands_key(entry: dict) -> bytes:
+    """Hash of the normalized commands only."""
+    parts = (normalize_command(entry[field]) for field in ("linux", "windows_cmd", "mac"))
+    return hashlib.blake2b("\x1f".join(parts).encode("utf-8"), digest_size=16).digest()
+
+def shingles(text: str, size: int = 3) -> set:
+    """Character shingles of the normalized text (the whole text if it is shorter)."""
+    text = normalize_instruction(text)
+    if len(text) <= size:
+        return {text}
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+class MinHasher:
+    """MinHash signatures from num_perm universal hash functions."""
+
+    def __init__(self, num_perm: int = 32, seed: int = 1):
+        rng_state = hashlib.blake2b(f"minhash:{seed}".encode(), digest_size=64).digest()
+        self.num_perm = num_perm
+        self.params = []
+        for i in range(num_perm):
+            block = hashlib.blake2b(rng_state + i.to_bytes(4, "little"), digest_size=16).digest()
+            a, b = struct.unpack("<QQ", block)
+            self.params.append((a % (MERSENNE_PRIME - 1) + 1, b % MERSENNE_PRIME))
+
+    def signature(self, tokens: Iterable[str]) -> Tuple[int, ...]:
+        values = [_hash64(token) for token in tokens]
+        return tuple(
+            min((a * x + b) % MERSENNE_PRIME for x in values)
+            for a, b in self.params
+        )
+
+def estimate_jaccard(sig_a, sig_b) -> float:
+    return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / len(sig_a)
+
+class DedupIndex:
+    """
+    Online duplicate index.
+
+    `check` returns None for a new entry (and indexes it) or a
+    (kind, kept_id, similarity) tuple for a duplicate. Memory per kept entry
+    is one content hash, one signature and num_bands bucket slots.
+    """
+
+    def __init__(self, threshold: float = 0.8, num_perm: int = 32, num_bands: int = 8,
+                 near_duplicates: bool = True):
+        if num_perm % num_bands:
+            raise ValueError("num_perm must be divisible by num_bands")
+        self.threshold = threshold
+        self.near_duplicates = near_duplicates
+        self.hasher = MinHasher(num_perm)
+        self.num_bands = num_bands
+        self.rows = num_perm // num_bands
+        self.exact = {}
+        self.buckets = defaultdict(list)
+        self.signatures = array("Q")
+        self.ids = []
+
+    def _signature_at(self, slot: int) -> array:
+        width = self.hasher.num_perm
+        return self.signatures[slot * width:(slot + 1) * width]
+
+    def check(self, entry: dict) -> Optional[Tuple[str, str, float]]:
+        key = content_key(entry)
+        if key in self.exact:
+            return "exact", self.exact[key], 1.0
+
+        entry_id = entry.get("id", "unknown")
+        if not self.near_duplicates:
+            self.exact[key] = entry_id
+            return None
+
+        signature = self.hasher.signature(shingles(entry["instruction"]))
+        # Bands are keyed by the commands too, so only paraphrases of the
+        # very same commands can ever collide
+        cmd_key = commands_key(entry)
+        band_keys = [
+            (cmd_key, band, signature[band * self.rows:(band + 1) * self.rows])
+            for band in range(self.num_bands)
+        ]
+
+        best = None
+        seen = set()
+        for band_key in band_keys:
+            for slot in self.buckets.get(band_key, ()):
+                if slot in seen:
+                    continue
+                seen.add(slot)
+                similarity = estimate_jaccard(signature, self._signature_at(slot))
+                if similarity >= self.threshold and (best is None or similarity > best[1]):
+                    best = (slot, similarity)
+
+        if best is not None:
+            # Not indexed: the kept entry already represents it
+            self.exact[key] = self.ids[best[0]]
+            return "near", self.ids[best[0]], best[1]
+
+        self.exact[key] = entry_id
+        slot = len(self.ids)
+        self.ids.append(entry_id)
+        self.signatures.extend(signature)
+        for band_key in band_keys:
+            self.buckets[band_key].append(slot)
+        return None
+
+def dedup_files(filepaths: List[Path], output_dir: Path, removed_path: Optional[Path] = None,
+                index: Optional[DedupIndex] = None) -> Dict[str, Counter]:
+    """
+    Stream each file through one shared index, writing kept entries to
+    output_dir under the same name. Returns per-category counts.
+    """
+    index = index or DedupIndex()
+    report = defaultdict(Counter)
+
+    with ExitStack() as stack:
+        removed_writer = stack.enter_context(RecordWriter(removed_path)) if removed_path else None
+        for filepath in filepaths:
+            with RecordWriter(output_dir / filepath.name, only_if_changed=True) as writer:
+                for entry in iter_records(filepath):
+                    category = entry.get("category", filepath.stem)
+                    report[category]["total"] += 1
+                    duplicate = index.check(entry)
+                    if duplicate is None:
+                        writer.write(entry)
+                        report[category]["kept"] += 1
+                        continue
+
+                    kind, kept_id, similarity = duplicate
+                    report[category][kind] += 1
+                    if removed_writer:
+                        removed_writer.write({
+                            "id": entry.get("id", "unknown"),
+                            "category": category,
+                            "kind": kind,
+                            "duplicate_of": kept_id,
+                            "similarity": round(similarity, 3),
+                            "instruction": entry["instruction"]
+                        })
+
+    return report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Remove exact and near-duplicate entries.")
+    parser.add_argument("--input-dir", default="datasets/generated/validated")
+    parser.add_argument("--output-dir", default="datasets/generated/deduped")
+    parser.add_argument("--report-dir", default="datasets/generated/reports")
+    parser.add_argument("--threshold", type=float, default=0.8,
+                        help="Estimated Jaccard similarity at which instructions count as near-duplicates")
+    parser.add_argument("--exact-only", action="store_true",
+                        help="Skip the MinHash/LSH near-duplicate pass")
+    args = parser.parse_args(argv)
+
+    input_dir = Path(args.input_dir)
+    output_dir = Path(args.output_dir)
+    report_dir = Path(args.report_dir)
+
+    if not input_dir.exists():
+        print(f"Directory not found: {input_dir}")
+        return
+
+    filepaths = [path for path in list_record_files(input_dir) if "_issues" not in path.name]
+    index = DedupIndex(threshold=args.threshold, near_duplicates=not args.exact_only)
+    report = dedup_files(filepaths, output_dir, report_dir / "dedup_removed.jsonl", index)
+
+    print(f"\n{'Category':<25} {'Total':>8} {'Exact':>8} {'Near':>8} {'Kept':>8}")
+    print("-" * 61)
+    totals = Counter()
+    for category in sorted(report):
+        counts = report[category]
+        totals.update(counts)
+        print(f"{category:<25} {counts['total']:>8} {counts['exact']:>8} {counts['near']:>8} {counts['kept']:>8}")
+    print("-" * 61)
+    print(f"{'TOTAL':<25} {totals['total']:>8} {totals['exact']:>8} {totals['near']:>8} {totals['kept']:>8}")
+
+    save_json({category: dict(counts) for category, counts in sorted(report.items())},
+              report_dir / "dedup_report.json")
+    print(f"\nDeduplicated files saved to: {output_dir}")
+    print(f"Report saved to: {report_dir / 'dedup_report.json'}")
+
+if __name__ == "__main__":
+    main()
@@ -1,53 +1,239 @@
+"""
+merge_complicated.py
+Merges each *_complicated.json file into its main category file.
+
+Merging is incremental. A persistent index next to the raw files
+(raw/.merge_index/) records the ids and content hashes already in each
+main file, plus the size/mtime of every file seen, so a run only reads
+complicated files that changed and only appends their new items to the
+end of the main file; existing records are never re-read or rewritten.
+An index whose main file was modified outside this script is rebuilt
+from that file once. Categories are merged in parallel.
+"""
+
+import argparse
 import json
 import os
-import glob
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from dedup import content_key
+from utils import iter_records, load_json, save_json, stat_signature
+
+INDEX_DIRNAME = ".merge_index"
+
+class MergeIndex:
+    """
+    Ids and content hashes of one main file.
+
+    Entries live in an append-only JSONL file; a small meta file holds the
+    main file's stat signature and the signatures of merged sources.
+    """
+
+    def __init__(self, index_dir: Path, main_file: Path):
+        self.main_file = main_file
+        self.entries_path = index_dir / f"{main_file.stem}.index.jsonl"
+        self.meta_path = index_dir / f"{main_file.stem}.meta.json"
+        self.ids = set()
+        self.contents = set()
+        self.sources = {}
+        self.pending = []
+        self.rebuilt = False
+
+    def load(self, rebuild: bool = False) -> "MergeIndex":
+        meta = load_json(self.meta_path) if self.meta_path.exists() else None
+        if (rebuild or meta is None or not self.entries_path.exists()
+                or meta.get("main") != stat_signature(self.main_file)):
+            self._rebuild()
+            return self
+
+        self.sources = meta.get("sources", {})
+        for item in iter_records(self.entries_path):
+            self.ids.add(item["id"])
+            if item["content"]:
+                self.contents.add(item["content"])
+        return self
+
+    def _rebuild(self) -> None:
+        """Index the main file from scratch (first run, or it changed externally)."""
+        self.entries_path.unlink(missing_ok=True)
+        self.sources = {}
+        for entry in iter_records(self.main_file):
+            self.add(entry)
+        self.rebuilt = True
+
+    @staticmethod
+    def _content(entry: dict) -> Optional[str]:
+        try:
+            return content_key(entry).hex()
+        except (KeyError, AttributeError):
+            return None
+
+    def duplicate_kind(self, entry: dict) -> Optional[str]:
+        """"id" or "content" if the entry is already merged, else None."""
+        if entry.get("id") in self.ids:
+            return "id"
+        content = self._content(entry)
+        if content is not None and content in self.contents:
+            return "content"
+        return None
+
+    def add(self, entry: dict) -> None:
+        content = self._content(entry)
+        self.ids.add(entry.get("id"))
+        if content is not None:
+            self.contents.add(content)
+        self.pending.append({"id": entry.get("id"), "content": content})
+
+    def source_unchanged(self, source: Path) -> bool:
+        return self.sources.get(source.name) == stat_signature(source)
+
+    def save(self, merged_sources: List[Path]) -> None:
+        self.entries_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.entries_path, 'a', encoding='utf-8') as f:
+            for item in self.pending:
+                f.write(json.dumps(item, ensure_ascii=False))
+                f.write("\n")
+        self.pending = []
+        for source in merged_sources:
+            self.sources[source.name] = stat_signature(source)
+        save_json({"main": stat_signature(self.main_file), "sources": self.sources}, self.meta_path)
+
+def append_records(filepath: Path, records: List[dict], indent: int = 2) -> None:
+    """
+    Append records to a JSON array or JSONL file in place.
+
+    For an array file the closing bracket is cut off and the new records are
+    written after the last one, laid out exactly as save_json would, so the
+    result is byte-identical to re-serializing the whole list.
+    """
+    if not records:
+        return
+    if filepath.suffix == ".jsonl":
+        with open(filepath, 'a', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False))
+                f.write("\n")
+        return
+
+    pad = " " * indent
+    body = ",\n".join(
+        pad + json.dumps(record, indent=indent, ensure_ascii=False).replace("\n", "\n" + pad)
+        for record in records
+    )
+    with open(filepath, 'r+b') as f:
+        # Walk back over trailing whitespace to the closing bracket
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        closing = None
+        while pos > 0:
+            pos -= 1
+            f.seek(pos)
+            char = f.read(1)
+            if closing is None:
+                if char == b"]":
+                    closing = pos
+                elif not char.isspace():
+                    break
+            elif not char.isspace():
+                break
+        if closing is None:
+            raise ValueError(f"{filepath} is not a JSON array")
+
+        if char == b"[":
+            # Empty array: "[" then the records
+            f.seek(pos + 1)
+            text = "\n" + body + "\n]"
+        else:
+            f.seek(pos + 1)
+            text = ",\n" + body + "\n]"
+        f.truncate()
+        f.write(text.encode("utf-8"))
+
+def merge_category(main_file: Path, comp_file: Path, index_dir: Path, rebuild_index: bool = False) -> dict:
+    """Merge one complicated file into its main file. Returns counts."""
+    index = MergeIndex(index_dir, main_file).load(rebuild=rebuild_index)
+    result = {"added": 0, "duplicate_id": 0, "duplicate_content": 0,
+              "skipped_unchanged": False, "index_rebuilt": index.rebuilt}
+
+    if index.source_unchanged(comp_file):
+        result["skipped_unchanged"] = True
+        return result
+
+    new_items = []
+    for item in iter_records(comp_file):
+        kind = index.duplicate_kind(item)
+        if kind is None:
+            index.add(item)
+            new_items.append(item)
+        else:
+            result[f"duplicate_{kind}"] += 1
+
+    append_records(main_file, new_items)
+    index.save([comp_file])
+    result["added"] = len(new_items)
+    return result
+
+def _merge_job(job: Tuple[Path, Path, Path, bool]):
+    comp_file = job[1]
+    try:
+        return comp_file, merge_category(*job), None
+    except Exception as e:
+        return comp_file, None, str(e)
+
+def merge_complicated_files(raw_dir: Optional[Path] = None, workers: Optional[int] = None,
+                            rebuild_index: bool = False):
+    if raw_dir is None:
+        base_dir = Path(__file__).resolve().parent.parent
+        raw_dir = base_dir / "dataset" / "generated" / "raw"
+    raw_dir = Path(raw_dir)
+    index_dir = raw_dir / INDEX_DIRNAME
 
-def merge_complicated_files():
-    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    raw_dir = os.path.join(base_dir, "datasets", "generated", "raw")
-    
     print(f"Scanning {raw_dir} for complicated datasets...")
-    
+
     # Find all complicated files
-    complicated_files = glob.glob(os.path.join(raw_dir, "*_complicated.json"))
-    
-    for comp_file in complicated_files:
-        filename = os.path.basename(comp_file)
-        main_filename = filename.replace("_complicated.json", ".json")
-        main_file = os.path.join(raw_dir, main_filename)
-        
-        if not os.path.exists(main_file):
-            print(f"Warning: Main file {main_file} not found for {filename}. Skipping.")
+    jobs = []
+    for comp_file in sorted(raw_dir.glob("*_complicated.json")):
+        main_file = raw_dir / comp_file.name.replace("_complicated.json", ".json")
+        if not main_file.exists():
+            print(f"Warning: Main file {main_file} not found for {comp_file.name}. Skipping.")
             continue
-            
-        print(f"Merging {filename} into {main_filename}...")
-        
-        try:
-            with open(main_file, 'r', encoding='utf-8') as f:
-                main_data = json.load(f)
-                
-            with open(comp_file, 'r', encoding='utf-8') as f:
-                comp_data = json.load(f)
-                
-            # Create a set of existing IDs to prevent duplicates
-            existing_ids = {item.get('id') for item in main_data}
-            
-            added_count = 0
-            for item in comp_data:
-                if item.get('id') not in existing_ids:
-                    main_data.append(item)
-                    existing_ids.add(item.get('id'))
-                    added_count += 1
-            
-            if added_count > 0:
-                with open(main_file, 'w', encoding='utf-8') as f:
-                    json.dump(main_data, f, indent=2, ensure_ascii=False)
-                print(f"  Added {added_count} items to {main_filename}")
-            else:
-                print(f"  No new items to add (all IDs exist in target).")
-                
-        except Exception as e:
-            print(f"Error merging {filename}: {str(e)}")
+        jobs.append((main_file, comp_file, index_dir, rebuild_index))
+
+    # Each category owns its main file and index, so they merge independently
+    if workers == 1 or len(jobs) <= 1:
+        outcomes = [_merge_job(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            outcomes = list(executor.map(_merge_job, jobs))
+
+    for comp_file, result, error in outcomes:
+        main_filename = comp_file.name.replace("_complicated.json", ".json")
+        print(f"Merging {comp_file.name} into {main_filename}...")
+        if error:
+            print(f"Error merging {comp_file.name}: {error}")
+        elif result["skipped_unchanged"]:
+            print(f"  Unchanged since last merge, skipped.")
+        elif result["added"]:
+            print(f"  Added {result['added']} items to {main_filename}")
+        else:
+            print(f"  No new items to add (all IDs exist in target).")
+        if result and (result["duplicate_id"] or result["duplicate_content"]):
+            print(f"  Already present: {result['duplicate_id']} by id, {result['duplicate_content']} by content")
+        if result and result["index_rebuilt"]:
+            print(f"  Index rebuilt from {main_filename}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Merge *_complicated.json files into their main category files.")
+    parser.add_argument("--raw-dir", default=None,
+                        help="Directory with the raw category files (default: dataset/generated/raw)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Categories merged in parallel; 1 runs in-process")
+    parser.add_argument("--rebuild-index", action="store_true",
+                        help="Re-index every main file before merging")
+    args = parser.parse_args(argv)
+    merge_complicated_files(args.raw_dir, args.workers, args.rebuild_index)
 
 if __name__ == "__main__":
-    merge_complicated_files()
+    main()
@@ -0,0 +1,195 @@
+"""
+pipeline.py
+Runs the dataset build as a DAG of stages, skipping stages that are up to date.
+
+    generate -> merge -> validate -> dedup -> convert -> split -> stats
+                            |
+                            +-> index
+
+The index stage rebuilds the instruction lookup index
+(model_scripts/instruction_index.py) from the validated corpus.
+
+Each stage's fingerprint hashes its code (the stage script and the local
+modules it uses), its parameters and the content of its input files. A stage
+is skipped when its fingerprint matches the one recorded after its last
+successful run and its outputs still exist; otherwise it runs, and every
+stage downstream of it sees changed inputs and reruns too. Per-category work
+inside a stage runs in parallel (--workers). A timing report shows where
+rebuild time goes.
+
+`generate` overwrites the raw category files, so it only runs with
+--with-generate.
+"""
+
+import argparse
+import hashlib
+import importlib
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+from utils import file_sha256, list_record_files, load_json, save_json
+
+SCRIPTS_DIR = Path(__file__).resolve().parent
+MODEL_SCRIPTS_DIR = SCRIPTS_DIR.parent / "model_scripts"
+sys.path.append(str(MODEL_SCRIPTS_DIR))
+STATE_FILENAME = ".pipeline_state.json"
+
+class Stage(NamedTuple):
+    """One pipeline step: a script's main() run with explicit arguments."""
+    name: str
+    module: str
+    deps: List[str]
+    code: List[str]                      # local modules the stage depends on
+    inputs: Callable[[Path], List[Path]]
+    outputs: Callable[[Path], List[Path]]
+    argv: Callable[[Path, argparse.Namespace], List[str]]
+
+def _stages() -> List[Stage]:
+    return [
+        Stage("generate", "procedural_generate", [], ["procedural_generate", "utils"],
+              lambda d: [], lambda d: [d / "raw"],
+              lambda d, a: ["--output-dir", str(d / "raw"), "--count", str(a.count),
+                            "--seed", str(a.seed), "--workers", str(a.workers)]),
+        # Merging appends to the raw files in place, so its inputs are also its outputs
+        Stage("merge", "merge_complicated", ["generate"], ["merge_complicated", "dedup", "utils"],
+              lambda d: [d / "raw"], lambda d: [d / "raw"],
+              lambda d, a: ["--raw-dir", str(d / "raw"), "--workers", str(a.workers)]),
+        Stage("validate", "validate_data", ["merge"], ["validate_data", "utils"],
+              lambda d: [d / "raw"], lambda d: [d / "validated"],
+              lambda d, a: ["--raw-dir", str(d / "raw"), "--output-dir", str(d / "validated"),
+                            "--workers", str(a.workers)]),
+        Stage("dedup", "dedup", ["validate"], ["dedup", "utils"],
+              lambda d: [d / "validated"], lambda d: [d / "deduped", d / "reports" / "dedup_report.json"],
+              lambda d, a: ["--input-dir", str(d / "validated"), "--output-dir", str(d / "deduped"),
+                            "--report-dir", str(d / "reports")]),
+        Stage("convert", "convert_to_alpaca", ["dedup"], ["convert_to_alpaca", "utils"],
+              lambda d: [d / "deduped"], lambda d: [d / "merged" / "full_dataset.json"],
+              lambda d, a: ["--input-dir", str(d / "deduped"), "--output-dir", str(d / "merged"),
+                            "--workers", str(a.workers)]),
+        Stage("split", "split_dataset", ["convert"], ["split_dataset", "convert_to_alpaca", "dedup", "utils"],
+              lambda d: [d / "merged" / "full_dataset.json"],
+              lambda d: [d / "processed" / f"{name}.json" for name in ("train", "dev", "test")],
+              lambda d, a: ["--input", str(d / "merged" / "full_dataset.json"),
+                            "--output-dir", str(d / "processed")]),
+        Stage("index", "instruction_index", ["validate"], ["instruction_index", "prompts", "utils"],
+              lambda d: [d / "validated"], lambda d: [d / "index" / "instruction_index.json"],
+              lambda d, a: ["build", "--validated-dir", str(d / "validated"),
+                            "--output", str(d / "index" / "instruction_index.json")]),
+        Stage("stats", "stats", ["split"], ["stats", "token_profile", "prompts", "utils"],
+              lambda d: [d / "processed"],
+              lambda d: [],
+              lambda d, a: ["--processed-dir", str(d / "processed"),
+                            "--report", str(d / "reports" / "token_profile.json")]
+                           + (["--tokenizer", a.tokenizer] if a.tokenizer else [])),
+    ]
+
+def _module_path(module: str) -> Path:
+    """Source file of a stage module: this directory first, then model_scripts."""
+    path = SCRIPTS_DIR / f"{module}.py"
+    return path if path.exists() else MODEL_SCRIPTS_DIR / f"{module}.py"
+
+def _hash_paths(digest, paths: List[Path]) -> None:
+    """Feed the names and bytes of the given files (or record files in given directories)."""
+    for path in paths:
+        files = list_record_files(path) if path.is_dir() else [path] if path.exists() else []
+        digest.update(f"{path.name}:{len(files)}".encode())
+        for filepath in files:
+            digest.update(filepath.name.encode())
+            digest.update(file_sha256(filepath).encode())
+
+def stage_fingerprint(stage: Stage, data_dir: Path, argv: List[str]) -> str:
+    digest = hashlib.sha256()
+    for module in stage.code:
+        digest.update(file_sha256(_module_path(module)).encode())
+    digest.update(json.dumps(argv).encode())
+    _hash_paths(digest, stage.inputs(data_dir))
+    return digest.hexdigest()
+
+def run_pipeline(data_dir: Path, args: argparse.Namespace) -> Dict[str, dict]:
+    """
+    Run every selected stage whose fingerprint changed, in dependency
+    order. Stages whose dependencies are all finished are started
+    together, so independent branches of the DAG overlap. Returns per-stage
+    status and timing.
+    """
+    stages = {stage.name: stage for stage in _stages()}
+    selected = [name for name in stages if name != "generate" or args.with_generate]
+    if args.stages:
+        selected = [name for name in selected if name in args.stages]
+
+    state_path = data_dir / STATE_FILENAME
+    state = load_json(state_path) if state_path.exists() else {}
+    state_lock = threading.Lock()
+    report = {}
+
+    def run(name: str) -> dict:
+        stage = stages[name]
+        argv = stage.argv(data_dir, args)
+        started = time.perf_counter()
+        fingerprint = stage_fingerprint(stage, data_dir, argv)
+        up_to_date = (not args.force and state.get(name) == fingerprint
+                      and all(path.exists() for path in stage.outputs(data_dir)))
+        if up_to_date:
+            return {"status": "skipped", "seconds": time.perf_counter() - started}
+
+        print(f"\n{'=' * 20} {name} {'=' * 20}")
+        importlib.import_module(stage.module).main(argv)
+        # Recorded after the run: for in-place stages this is the state they leave behind
+        fingerprint = stage_fingerprint(stage, data_dir, argv)
+        with state_lock:
+            state[name] = fingerprint
+            save_json(state, state_path)
+        return {"status": "ran", "seconds": time.perf_counter() - started}
+
+    done = set(stages) - set(selected)
+    pending = list(selected)
+    running = {}
+    with ThreadPoolExecutor(max_workers=max(1, len(selected))) as executor:
+        while pending or running:
+            for name in [n for n in pending if all(dep in done for dep in stages[n].deps)]:
+                pending.remove(name)
+                running[executor.submit(run, name)] = name
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                report[name] = future.result()
+                done.add(name)
+
+    return {name: report[name] for name in selected}
+
+def print_timings(report: Dict[str, dict]) -> None:
+    total = sum(row["seconds"] for row in report.values()) or 1.0
+    print(f"\n{'Stage':<12} {'Status':<8} {'Seconds':>9} {'Share':>7}")
+    print("-" * 39)
+    for name, row in report.items():
+        print(f"{name:<12} {row['status']:<8} {row['seconds']:>9.2f} {100 * row['seconds'] / total:>6.1f}%")
+    print("-" * 39)
+    print(f"{'TOTAL':<21} {total:>9.2f}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the dataset, skipping up-to-date stages.")
+    parser.add_argument("--data-dir", default=str(SCRIPTS_DIR.parent / "dataset" / "generated"))
+    parser.add_argument("--stages", nargs="*", help="Only consider these stages")
+    parser.add_argument("--with-generate", action="store_true",
+                        help="Include procedural generation (overwrites the raw category files)")
+    parser.add_argument("--force", action="store_true", help="Run stages even if up to date")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Parallel per-category workers inside each stage")
+    parser.add_argument("--count", type=int, default=500, help="Entries per category for generate")
+    parser.add_argument("--seed", type=int, default=42, help="Seed for generate")
+    parser.add_argument("--tokenizer", default=None, help="Tokenizer for the stats token profile")
+    args = parser.parse_args(argv)
+
+    data_dir = Path(args.data_dir)
+    report = run_pipeline(data_dir, args)
+    print_timings(report)
+    save_json(report, data_dir / "reports" / "pipeline_timings.json")
+
+if __name__ == "__main__":
+    main()
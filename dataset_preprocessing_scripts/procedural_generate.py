@@ -2,13 +2,21 @@
 procedural_generate.py
 Procedurally generates large datasets of terminal commands using templates and combinatorics.
 Target: 500+ samples per category.
+
+Entries are either sampled with replacement (--mode sample) or enumerated
+without replacement from each category's template x slot-value space
+(--mode enumerate), which guarantees unique entries and reports coverage.
 """
 
-import json
+import argparse
+import math
+import os
 import random
-import uuid
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import List, Dict
+from typing import Callable, Dict, List, NamedTuple, Sequence, Tuple
+
+from utils import RecordWriter, iter_records
 
 # --- Data Banks ---
 
@@ -47,490 +55,479 @@ USERS = ["admin", "root", "user", "guest", "john", "jane", "deploy", "ubuntu"]
 
 VARS = ["PATH", "JAVA_HOME", "EDITOR", "USER", "HOME", "SHELL", "TERM", "LANG", "PWD", "TMPDIR"]
 
+# Derived banks: distinct extensions and ordered pairs of different names
+EXTENSIONS = sorted({fname.split('.')[-1] for fname in FILENAMES})
+
+FILENAME_PAIRS = [(a, b) for a in FILENAMES for b in FILENAMES if a != b]
+
+DIRECTORY_PAIRS = [(a, b) for a in DIRECTORIES for b in DIRECTORIES if a != b]
+
+PIDS = range(1000, 100000)
+
+PING_COUNTS = range(3, 11)
+
+SEARCH_TERMS = ["error", "warning", "success", "failed", "user", "TODO"]
+
+# System info commands are limited, so we vary instructions
+SYSTEM_COMMANDS = [
+    ("os", "Show OS version", "cat /etc/os-release", "ver", "sw_vers"),
+    ("disk", "Check disk usage", "df -h", "wmic logicaldisk get size,freespace,caption", "df -h"),
+    ("mem", "Check memory usage", "free -h", "systeminfo | findstr /C:\"Total Physical Memory\"", "vm_stat"),
+    ("uptime", "Check system uptime", "uptime", "systeminfo | find \"System Boot Time\"", "uptime"),
+    ("env", "List environment variables", "printenv", "set", "printenv"),
+    ("usb", "List USB devices", "lsusb", "wmic path Win32_USBControllerDevice get Dependent", "system_profiler SPUSBDataType")
+]
+
+SYSTEM_PHRASINGS = [
+    "Show me", "Display", "Check", "Get", "Print", "View", "What is"
+]
+
+# --- Templates ---
+
+class Template(NamedTuple):
+    """One instruction pattern: the slot banks it draws from and how to render them."""
+    action: str
+    weight: float           # probability of this template once its action is picked
+    slots: Tuple[Sequence, ...]
+    render: Callable[..., Dict]
+
+class CategorySpec(NamedTuple):
+    id_prefix: str
+    category: str
+    difficulty: str
+    tag: str
+    templates: List[Template]
+
+def _commands(instruction: str, linux: str, windows_cmd: str, mac: str, **extra) -> Dict:
+    return {"instruction": instruction, "linux": linux, "windows_cmd": windows_cmd, "mac": mac, **extra}
+
+def _system_template(sub, base_instr, lin, win, mac) -> Template:
+    words = base_instr.split(' ', 1)[1] # remove verb
+    return Template(sub, 1.0, (SYSTEM_PHRASINGS,),
+                    lambda phrase: _commands(f"{phrase} {words}", lin, win, mac))
+
+CATEGORIES = {
+    "01_file_operations.json": CategorySpec("file", "file_operations", "beginner", "file", [
+        Template("create", 1.0, (FILENAMES,), lambda f: _commands(
+            f"Create an empty file named {f}", f"touch {f}", f"type nul > {f}", f"touch {f}")),
+        Template("delete", 0.5, (FILENAMES,), lambda f: _commands(
+            f"Delete the file {f}", f"rm {f}", f"del {f}", f"rm {f}")),
+        Template("delete", 0.5, (EXTENSIONS,), lambda ext: _commands(
+            f"Delete all .{ext} files", f"rm *.{ext}", f"del *.{ext}", f"rm *.{ext}", tags=["wildcard"])),
+        Template("copy", 1.0, (FILENAMES, DIRECTORIES), lambda f, d: _commands(
+            f"Copy {f} to the {d} directory", f"cp {f} {d}/", f"copy {f} {d}\\", f"cp {f} {d}/")),
+        Template("move", 0.5, (FILENAMES, DIRECTORIES), lambda f, d: _commands(
+            f"Move {f} to {d}", f"mv {f} {d}/", f"move {f} {d}\\", f"mv {f} {d}/")),
+        Template("move", 0.5, (FILENAME_PAIRS,), lambda pair: _commands(
+            f"Rename {pair[0]} to {pair[1]}", f"mv {pair[0]} {pair[1]}", f"ren {pair[0]} {pair[1]}",
+            f"mv {pair[0]} {pair[1]}", subcategory="rename")),
+        Template("view", 1.0, (FILENAMES,), lambda f: _commands(
+            f"Display the contents of {f}", f"cat {f}", f"type {f}", f"cat {f}")),
+        Template("search", 1.0, (EXTENSIONS, DIRECTORIES), lambda ext, d: _commands(
+            f"Find all .{ext} files in {d}", f"find {d} -name '*.{ext}'",
+            f"dir /s /b {d}\\*.{ext}", f"find {d} -name '*.{ext}'")),
+    ]),
+    "02_directory_operations.json": CategorySpec("dir", "directory_operations", "beginner", "directory", [
+        Template("create", 0.7, (DIRECTORIES,), lambda d: _commands(
+            f"Create a directory named {d}", f"mkdir {d}", f"mkdir {d}", f"mkdir {d}")),
+        Template("create", 0.3, (DIRECTORY_PAIRS,), lambda pair: _commands(
+            f"Create nested directories {pair[0]}/{pair[1]}", f"mkdir -p {pair[0]}/{pair[1]}",
+            f"mkdir {pair[0]}\\{pair[1]}", f"mkdir -p {pair[0]}/{pair[1]}")),
+        Template("remove", 1.0, (DIRECTORIES,), lambda d: _commands(
+            f"Remove the directory {d} and its contents", f"rm -rf {d}", f"rmdir /s /q {d}", f"rm -rf {d}")),
+        Template("navigate", 1.0, (DIRECTORIES,), lambda d: _commands(
+            f"Change directory to {d}", f"cd {d}", f"cd {d}", f"cd {d}")),
+        Template("list", 1.0, (DIRECTORIES,), lambda d: _commands(
+            f"List files in {d}", f"ls {d}", f"dir {d}", f"ls {d}")),
+        Template("tree", 1.0, (), lambda: _commands(
+            "Display directory structure", "tree", "tree", "tree")),
+    ]),
+    "03_process_management.json": CategorySpec("proc", "process_management", "intermediate", "process", [
+        Template("list", 1.0, (), lambda: _commands(
+            "List all running processes", "ps aux", "tasklist", "ps aux")),
+        Template("kill", 0.5, (PIDS,), lambda pid: _commands(
+            f"Kill the process with PID {pid}", f"kill {pid}", f"taskkill /PID {pid} /F", f"kill {pid}")),
+        Template("kill", 0.5, (APPS,), lambda app: _commands(
+            f"Terminate all '{app}' processes", f"pkill {app}", f"taskkill /IM {app}.exe /F", f"pkill {app}")),
+        Template("find", 1.0, (APPS,), lambda app: _commands(
+            f"Find the PID of '{app}'", f"pgrep {app}", f"tasklist | findstr {app}", f"pgrep {app}")),
+    ]),
+    "04_network_operations.json": CategorySpec("net", "network_operations", "beginner", "network", [
+        Template("ping", 1.0, (DOMAINS, PING_COUNTS), lambda domain, n: _commands(
+            f"Ping {domain} {n} times", f"ping -c {n} {domain}", f"ping -n {n} {domain}", f"ping -c {n} {domain}")),
+        Template("download", 1.0, (DOMAINS, FILENAMES), lambda domain, f: _commands(
+            f"Download file from {domain}/{f}", f"curl -O https://{domain}/{f}",
+            f"curl -O https://{domain}/{f}", f"curl -O https://{domain}/{f}")),
+        Template("dns", 1.0, (DOMAINS,), lambda domain: _commands(
+            f"Get IP address of {domain}", f"nslookup {domain}", f"nslookup {domain}", f"nslookup {domain}")),
+        Template("ip", 1.0, (), lambda: _commands(
+            "Show network interface configuration", "ifconfig", "ipconfig", "ifconfig")),
+    ]),
+    "05_system_information.json": CategorySpec("sys", "system_information", "beginner", "system", [
+        _system_template(*command) for command in SYSTEM_COMMANDS
+    ]),
+    "06_package_management.json": CategorySpec("pkg", "package_management", "beginner", "package", [
+        Template("install", 1.0, (PACKAGES,), lambda pkg: _commands(
+            f"Install {pkg}", f"sudo apt install {pkg} -y", f"choco install {pkg} -y", f"brew install {pkg}")),
+        Template("remove", 1.0, (PACKAGES,), lambda pkg: _commands(
+            f"Uninstall {pkg}", f"sudo apt remove {pkg} -y", f"choco uninstall {pkg} -y", f"brew uninstall {pkg}")),
+        Template("update", 1.0, (), lambda: _commands(
+            "Update all packages", "sudo apt update && sudo apt upgrade -y",
+            "choco upgrade all -y", "brew update && brew upgrade")),
+        Template("search", 1.0, (PACKAGES,), lambda pkg: _commands(
+            f"Search for package '{pkg}'", f"apt search {pkg}", f"choco search {pkg}", f"brew search {pkg}")),
+    ]),
+    "07_text_processing.json": CategorySpec("text", "text_processing", "intermediate", "text", [
+        Template("search", 1.0, (FILENAMES, SEARCH_TERMS), lambda f, term: _commands(
+            f"Search for '{term}' in {f}", f"grep '{term}' {f}", f"findstr \"{term}\" {f}", f"grep '{term}' {f}")),
+        Template("count", 1.0, (FILENAMES,), lambda f: _commands(
+            f"Count lines in {f}", f"wc -l {f}", f"find /c /v \"\" {f}", f"wc -l {f}")),
+        Template("view", 1.0, (FILENAMES,), lambda f: _commands(
+            f"Display content of {f}", f"cat {f}", f"type {f}", f"cat {f}")),
+        Template("sort", 1.0, (FILENAMES,), lambda f: _commands(
+            f"Sort lines in {f}", f"sort {f}", f"sort {f}", f"sort {f}")),
+    ]),
+    "08_permissions.json": CategorySpec("perm", "permissions", "intermediate", "permissions", [
+        Template("chmod", 1.0, (FILENAMES,), lambda f: _commands(
+            f"Make {f} read-only", f"chmod 444 {f}", f"attrib +r {f}", f"chmod 444 {f}")),
+        Template("chown", 1.0, (FILENAMES, USERS), lambda f, user: _commands(
+            f"Change owner of {f} to {user}", f"chown {user} {f}", f"icacls {f} /setowner {user}", f"chown {user} {f}")),
+        Template("view", 1.0, (FILENAMES,), lambda f: _commands(
+            f"View permissions of {f}", f"ls -l {f}", f"icacls {f}", f"ls -l {f}")),
+    ]),
+    "09_compression.json": CategorySpec("comp", "compression", "intermediate", "compression", [
+        # Modern Windows 10+ has tar
+        Template("zip", 1.0, (DIRECTORIES,), lambda d: _commands(
+            f"Zip the {d} directory", f"zip -r {d}.zip {d}", f"tar -a -c -f {d}.zip {d}", f"zip -r {d}.zip {d}")),
+        Template("unzip", 1.0, (), lambda: _commands(
+            "Unzip archive.zip", "unzip archive.zip", "tar -xf archive.zip", "unzip archive.zip")),
+        Template("tar", 1.0, (DIRECTORIES,), lambda d: _commands(
+            f"Create tarball of {d}", f"tar -cvf {d}.tar {d}", f"tar -cvf {d}.tar {d}", f"tar -cvf {d}.tar {d}")),
+    ]),
+    "10_environment_variables.json": CategorySpec("env", "environment_variables", "intermediate", "env", [
+        Template("set", 1.0, (VARS,), lambda var: _commands(
+            f"Set {var} to some_value", f"export {var}=some_value", f"set {var}=some_value", f"export {var}=some_value")),
+        Template("get", 1.0, (VARS,), lambda var: _commands(
+            f"Show value of {var}", f"echo ${var}", f"echo %{var}%", f"echo ${var}")),
+        Template("unset", 1.0, (VARS,), lambda var: _commands(
+            f"Unset {var}", f"unset {var}", f"set {var}=", f"unset {var}")),
+    ]),
+}
+
+def _short_id(rng: random.Random) -> str:
+    """Random hex id drawn from the generator's RNG so seeded runs are reproducible."""
+    # 48 bits keeps ids unique well into multi-million entry datasets
+    return f"{rng.getrandbits(48):012x}"
+
+def build_entry(spec: CategorySpec, template: Template, values: Sequence, rng: random.Random) -> Dict:
+    """Render a template with concrete slot values into a dataset entry."""
+    fields = template.render(*values)
+    extra_tags = fields.pop("tags", [])
+    entry = {
+        "id": f"{spec.id_prefix}_{_short_id(rng)}",
+        "category": spec.category,
+        "subcategory": fields.pop("subcategory", template.action),
+        "difficulty": spec.difficulty,
+        "tags": [spec.tag, template.action] + extra_tags
+    }
+    entry.update(fields)
+    return entry
+
 # --- Generators ---
 
-def generate_file_ops(count: int) -> List[Dict]:
-    data = []
-    actions = ["create", "delete", "copy", "move", "view", "search"]
+def sample_entries(spec: CategorySpec, count: int, rng: random.Random = random) -> List[Dict]:
+    """
+    Sample entries with replacement: pick an action uniformly, a template
+    within it by weight, then each slot value uniformly.
+    """
+    by_action = {}
+    for template in spec.templates:
+        by_action.setdefault(template.action, []).append(template)
+    actions = list(by_action)
     
-    for _ in range(count):
-        action = random.choice(actions)
-        fname = random.choice(FILENAMES)
-        fname2 = random.choice(FILENAMES)
-        dirname = random.choice(DIRECTORIES)
-        
-        entry = {
-            "id": f"file_{uuid.uuid4().hex[:8]}",
-            "category": "file_operations",
-            "subcategory": action,
-            "difficulty": "beginner",
-            "tags": ["file", action]
-        }
-        
-        if action == "create":
-            entry["instruction"] = f"Create an empty file named {fname}"
-            entry["linux"] = f"touch {fname}"
-            entry["windows_cmd"] = f"type nul > {fname}"
-            entry["mac"] = f"touch {fname}"
-            
-        elif action == "delete":
-            if random.random() < 0.5:
-                entry["instruction"] = f"Delete the file {fname}"
-                entry["linux"] = f"rm {fname}"
-                entry["windows_cmd"] = f"del {fname}"
-                entry["mac"] = f"rm {fname}"
-            else:
-                ext = fname.split('.')[-1]
-                entry["instruction"] = f"Delete all .{ext} files"
-                entry["linux"] = f"rm *.{ext}"
-                entry["windows_cmd"] = f"del *.{ext}"
-                entry["mac"] = f"rm *.{ext}"
-                entry["tags"].append("wildcard")
-
-        elif action == "copy":
-            entry["instruction"] = f"Copy {fname} to the {dirname} directory"
-            entry["linux"] = f"cp {fname} {dirname}/"
-            entry["windows_cmd"] = f"copy {fname} {dirname}\\"
-            entry["mac"] = f"cp {fname} {dirname}/"
-            
-        elif action == "move":
-            if random.random() < 0.5:
-                entry["instruction"] = f"Move {fname} to {dirname}"
-                entry["linux"] = f"mv {fname} {dirname}/"
-                entry["windows_cmd"] = f"move {fname} {dirname}\\"
-                entry["mac"] = f"mv {fname} {dirname}/"
-            else:
-                entry["instruction"] = f"Rename {fname} to {fname2}"
-                entry["linux"] = f"mv {fname} {fname2}"
-                entry["windows_cmd"] = f"ren {fname} {fname2}"
-                entry["mac"] = f"mv {fname} {fname2}"
-                entry["subcategory"] = "rename"
-                
-        elif action == "view":
-            entry["instruction"] = f"Display the contents of {fname}"
-            entry["linux"] = f"cat {fname}"
-            entry["windows_cmd"] = f"type {fname}"
-            entry["mac"] = f"cat {fname}"
-            
-        elif action == "search":
-            ext = fname.split('.')[-1]
-            entry["instruction"] = f"Find all .{ext} files in {dirname}"
-            entry["linux"] = f"find {dirname} -name '*.{ext}'"
-            entry["windows_cmd"] = f"dir /s /b {dirname}\\*.{ext}"
-            entry["mac"] = f"find {dirname} -name '*.{ext}'"
-            
-        data.append(entry)
-    return data
-
-def generate_dir_ops(count: int) -> List[Dict]:
     data = []
-    actions = ["create", "remove", "navigate", "list", "tree"]
-    
     for _ in range(count):
-        action = random.choice(actions)
-        dirname = random.choice(DIRECTORIES)
-        dirname2 = random.choice(DIRECTORIES)
-        
-        entry = {
-            "id": f"dir_{uuid.uuid4().hex[:8]}",
-            "category": "directory_operations",
-            "subcategory": action,
-            "difficulty": "beginner",
-            "tags": ["directory", action]
-        }
-        
-        if action == "create":
-            if random.random() < 0.7:
-                entry["instruction"] = f"Create a directory named {dirname}"
-                entry["linux"] = f"mkdir {dirname}"
-                entry["windows_cmd"] = f"mkdir {dirname}"
-                entry["mac"] = f"mkdir {dirname}"
-            else:
-                entry["instruction"] = f"Create nested directories {dirname}/{dirname2}"
-                entry["linux"] = f"mkdir -p {dirname}/{dirname2}"
-                entry["windows_cmd"] = f"mkdir {dirname}\\{dirname2}"
-                entry["mac"] = f"mkdir -p {dirname}/{dirname2}"
-                
-        elif action == "remove":
-            entry["instruction"] = f"Remove the directory {dirname} and its contents"
-            entry["linux"] = f"rm -rf {dirname}"
-            entry["windows_cmd"] = f"rmdir /s /q {dirname}"
-            entry["mac"] = f"rm -rf {dirname}"
-            
-        elif action == "navigate":
-            entry["instruction"] = f"Change directory to {dirname}"
-            entry["linux"] = f"cd {dirname}"
-            entry["windows_cmd"] = f"cd {dirname}"
-            entry["mac"] = f"cd {dirname}"
-            
-        elif action == "list":
-            entry["instruction"] = f"List files in {dirname}"
-            entry["linux"] = f"ls {dirname}"
-            entry["windows_cmd"] = f"dir {dirname}"
-            entry["mac"] = f"ls {dirname}"
-            
-        elif action == "tree":
-            entry["instruction"] = "Display directory structure"
-            entry["linux"] = "tree"
-            entry["windows_cmd"] = "tree"
-            entry["mac"] = "tree"
-            
-        data.append(entry)
+        candidates = by_action[rng.choice(actions)]
+        template = candidates[0]
+        if len(candidates) > 1:
+            roll = rng.random()
+            for template in candidates:
+                roll -= template.weight
+                if roll < 0:
+                    break
+        values = [rng.choice(bank) for bank in template.slots]
+        data.append(build_entry(spec, template, values, rng))
     return data
 
-def generate_process_ops(count: int) -> List[Dict]:
-    data = []
-    
-    for _ in range(count):
-        app = random.choice(APPS)
-        pid = random.randint(1000, 99999)
-        
-        action = random.choice(["list", "kill", "find"])
-        
-        entry = {
-            "id": f"proc_{uuid.uuid4().hex[:8]}",
-            "category": "process_management",
-            "subcategory": action,
-            "difficulty": "intermediate",
-            "tags": ["process", action]
-        }
-        
-        if action == "list":
-            entry["instruction"] = "List all running processes"
-            entry["linux"] = "ps aux"
-            entry["windows_cmd"] = "tasklist"
-            entry["mac"] = "ps aux"
-            
-        elif action == "kill":
-            if random.random() < 0.5:
-                entry["instruction"] = f"Kill the process with PID {pid}"
-                entry["linux"] = f"kill {pid}"
-                entry["windows_cmd"] = f"taskkill /PID {pid} /F"
-                entry["mac"] = f"kill {pid}"
-            else:
-                entry["instruction"] = f"Terminate all '{app}' processes"
-                entry["linux"] = f"pkill {app}"
-                entry["windows_cmd"] = f"taskkill /IM {app}.exe /F"
-                entry["mac"] = f"pkill {app}"
-                
-        elif action == "find":
-            entry["instruction"] = f"Find the PID of '{app}'"
-            entry["linux"] = f"pgrep {app}"
-            entry["windows_cmd"] = f"tasklist | findstr {app}"
-            entry["mac"] = f"pgrep {app}"
-            
-        data.append(entry)
-    return data
+def generate_file_ops(count: int, rng: random.Random = random) -> List[Dict]:
+    return sample_entries(CATEGORIES["01_file_operations.json"], count, rng)
 
-def generate_network_ops(count: int) -> List[Dict]:
-    data = []
-    
-    for _ in range(count):
-        domain = random.choice(DOMAINS)
-        fname = random.choice(FILENAMES)
-        
-        action = random.choice(["ping", "download", "dns", "ip"])
-        
-        entry = {
-            "id": f"net_{uuid.uuid4().hex[:8]}",
-            "category": "network_operations",
-            "subcategory": action,
-            "difficulty": "beginner",
-            "tags": ["network", action]
-        }
-        
-        if action == "ping":
-            count_ping = random.randint(3, 10)
-            entry["instruction"] = f"Ping {domain} {count_ping} times"
-            entry["linux"] = f"ping -c {count_ping} {domain}"
-            entry["windows_cmd"] = f"ping -n {count_ping} {domain}"
-            entry["mac"] = f"ping -c {count_ping} {domain}"
-            
-        elif action == "download":
-            entry["instruction"] = f"Download file from {domain}/{fname}"
-            entry["linux"] = f"curl -O https://{domain}/{fname}"
-            entry["windows_cmd"] = f"curl -O https://{domain}/{fname}"
-            entry["mac"] = f"curl -O https://{domain}/{fname}"
-            
-        elif action == "dns":
-            entry["instruction"] = f"Get IP address of {domain}"
-            entry["linux"] = f"nslookup {domain}"
-            entry["windows_cmd"] = f"nslookup {domain}"
-            entry["mac"] = f"nslookup {domain}"
-            
-        elif action == "ip":
-            entry["instruction"] = "Show network interface configuration"
-            entry["linux"] = "ifconfig"
-            entry["windows_cmd"] = "ipconfig"
-            entry["mac"] = "ifconfig"
-            
-        data.append(entry)
-    return data
+def generate_dir_ops(count: int, rng: random.Random = random) -> List[Dict]:
+    return sample_entries(CATEGORIES["02_directory_operations.json"], count, rng)
 
-def generate_system_ops(count: int) -> List[Dict]:
-    data = []
-    # System info commands are limited, so we vary instructions
-    commands = [
-        ("os", "Show OS version", "cat /etc/os-release", "ver", "sw_vers"),
-        ("disk", "Check disk usage", "df -h", "wmic logicaldisk get size,freespace,caption", "df -h"),
-        ("mem", "Check memory usage", "free -h", "systeminfo | findstr /C:\"Total Physical Memory\"", "vm_stat"),
-        ("uptime", "Check system uptime", "uptime", "systeminfo | find \"System Boot Time\"", "uptime"),
-        ("env", "List environment variables", "printenv", "set", "printenv"),
-        ("usb", "List USB devices", "lsusb", "wmic path Win32_USBControllerDevice get Dependent", "system_profiler SPUSBDataType")
-    ]
+def generate_process_ops(count: int, rng: random.Random = random) -> List[Dict]:
+    return sample_entries(CATEGORIES["03_process_management.json"], count, rng)
+
+def generate_network_ops(count: int, rng: random.Random = random) -> List[Dict]:
+    return sample_entries(CATEGORIES["04_network_operations.json"], count, rng)
+
+def generate_system_ops(count: int, rng: random.Random = random) -> List[Dict]:
+    return sample_entries(CATEGORIES["05_system_information.json"], count, rng)
+
+def generate_package_ops(count: int, rng: random.Random = random) -> List[Dict]:
+    return sample_entries(CATEGORIES["06_package_management.json"], count, rng)
+
+def generate_text_ops(count: int, rng: random.Random = random) -> List[Dict]:
+    return sample_entries(CATEGORIES["07_text_processing.json"], count, rng)
+
+def generate_perm_ops(count: int, rng: random.Random = random) -> List[Dict]:
+    return sample_entries(CATEGORIES["08_permissions.json"], count, rng)
+
+def generate_compress_ops(count: int, rng: random.Random = random) -> List[Dict]:
+    return sample_entries(CATEGORIES["09_compression.json"], count, rng)
+
+def generate_env_ops(count: int, rng: random.Random = random) -> List[Dict]:
+    return sample_entries(CATEGORIES["10_environment_variables.json"], count, rng)
+
+# --- Enumeration ---
+
+class TemplateSpace:
+    """
+    Index of a category's full template x slot-value space.
     
-    phrasings = [
-        "Show me", "Display", "Check", "Get", "Print", "View", "What is"
-    ]
+    Every (template, slot values) combination maps to one integer so the
+    space can be sampled without replacement or walked completely without
+    materialising it.
+    """
     
-    for _ in range(count):
-        sub, base_instr, lin, win, mac = random.choice(commands)
-        
-        # Vary instruction
-        phrase = random.choice(phrasings)
-        words = base_instr.split(' ', 1)[1] # remove verb
-        instruction = f"{phrase} {words}"
-        
-        entry = {
-            "id": f"sys_{uuid.uuid4().hex[:8]}",
-            "category": "system_information",
-            "subcategory": sub,
-            "instruction": instruction,
-            "linux": lin,
-            "windows_cmd": win,
-            "mac": mac,
-            "difficulty": "beginner",
-            "tags": ["system", sub]
-        }
-        data.append(entry)
-    return data
-
-def generate_package_ops(count: int) -> List[Dict]:
-    data = []
+    def __init__(self, spec: CategorySpec):
+        self.spec = spec
+        self.sizes = [math.prod(len(bank) for bank in t.slots) for t in spec.templates]
+        self.size = sum(self.sizes)
     
-    for _ in range(count):
-        pkg = random.choice(PACKAGES)
-        action = random.choice(["install", "remove", "update", "search"])
-        
-        entry = {
-            "id": f"pkg_{uuid.uuid4().hex[:8]}",
-            "category": "package_management",
-            "subcategory": action,
-            "difficulty": "beginner",
-            "tags": ["package", action]
-        }
-        
-        if action == "install":
-            entry["instruction"] = f"Install {pkg}"
-            entry["linux"] = f"sudo apt install {pkg} -y"
-            entry["windows_cmd"] = f"choco install {pkg} -y"
-            entry["mac"] = f"brew install {pkg}"
-            
-        elif action == "remove":
-            entry["instruction"] = f"Uninstall {pkg}"
-            entry["linux"] = f"sudo apt remove {pkg} -y"
-            entry["windows_cmd"] = f"choco uninstall {pkg} -y"
-            entry["mac"] = f"brew uninstall {pkg}"
-            
-        elif action == "update":
-            entry["instruction"] = "Update all packages"
-            entry["linux"] = "sudo apt update && sudo apt upgrade -y"
-            entry["windows_cmd"] = "choco upgrade all -y"
-            entry["mac"] = "brew update && brew upgrade"
-            
-        elif action == "search":
-            entry["instruction"] = f"Search for package '{pkg}'"
-            entry["linux"] = f"apt search {pkg}"
-            entry["windows_cmd"] = f"choco search {pkg}"
-            entry["mac"] = f"brew search {pkg}"
-            
-        data.append(entry)
-    return data
-
-def generate_text_ops(count: int) -> List[Dict]:
-    data = []
+    def decode(self, template_index: int, index: int) -> Tuple[Template, List]:
+        """Mixed-radix decode of an index within one template into slot values."""
+        template = self.spec.templates[template_index]
+        values = []
+        for bank in reversed(template.slots):
+            index, digit = divmod(index, len(bank))
+            values.append(bank[digit])
+        values.reverse()
+        return template, values
     
-    for _ in range(count):
-        fname = random.choice(FILENAMES)
-        term = random.choice(["error", "warning", "success", "failed", "user", "TODO"])
-        
-        action = random.choice(["search", "count", "view", "sort"])
-        
-        entry = {
-            "id": f"text_{uuid.uuid4().hex[:8]}",
-            "category": "text_processing",
-            "subcategory": action,
-            "difficulty": "intermediate",
-            "tags": ["text", action]
-        }
-        
-        if action == "search":
-            entry["instruction"] = f"Search for '{term}' in {fname}"
-            entry["linux"] = f"grep '{term}' {fname}"
-            entry["windows_cmd"] = f"findstr \"{term}\" {fname}"
-            entry["mac"] = f"grep '{term}' {fname}"
-            
-        elif action == "count":
-            entry["instruction"] = f"Count lines in {fname}"
-            entry["linux"] = f"wc -l {fname}"
-            entry["windows_cmd"] = f"find /c /v \"\" {fname}"
-            entry["mac"] = f"wc -l {fname}"
-            
-        elif action == "view":
-            entry["instruction"] = f"Display content of {fname}"
-            entry["linux"] = f"cat {fname}"
-            entry["windows_cmd"] = f"type {fname}"
-            entry["mac"] = f"cat {fname}"
-            
-        elif action == "sort":
-            entry["instruction"] = f"Sort lines in {fname}"
-            entry["linux"] = f"sort {fname}"
-            entry["windows_cmd"] = f"sort {fname}"
-            entry["mac"] = f"sort {fname}"
-            
-        data.append(entry)
-    return data
-
-def generate_perm_ops(count: int) -> List[Dict]:
-    data = []
+    def probabilities(self) -> List[float]:
+        """Per-template probability under sample_entries."""
+        actions = {t.action for t in self.spec.templates}
+        return [t.weight / len(actions) for t in self.spec.templates]
     
-    for _ in range(count):
-        fname = random.choice(FILENAMES)
-        user = random.choice(USERS)
-        
-        action = random.choice(["chmod", "chown", "view"])
+    def allocate(self, count: int) -> List[int]:
+        """
+        Split count across templates in proportion to their sampling
+        probability, capped at each template's size, so enumeration keeps the
+        same action mix as sampling while never repeating an entry.
+        """
+        probs = self.probabilities()
+        quotas = [0] * len(self.sizes)
+        remaining = min(count, self.size)
+        active = [i for i, size in enumerate(self.sizes) if size > 0]
         
-        entry = {
-            "id": f"perm_{uuid.uuid4().hex[:8]}",
-            "category": "permissions",
-            "subcategory": action,
-            "difficulty": "intermediate",
-            "tags": ["permissions", action]
-        }
+        while remaining > 0:
+            total_prob = sum(probs[i] for i in active)
+            progress = 0
+            for i in active:
+                share = int(remaining * probs[i] / total_prob)
+                add = min(share, self.sizes[i] - quotas[i])
+                quotas[i] += add
+                progress += add
+            
+            if progress == 0:
+                # Shares rounded down to nothing: hand out single entries
+                for i in sorted(active, key=lambda i: -probs[i])[:remaining]:
+                    quotas[i] += 1
+                    progress += 1
+            
+            remaining -= progress
+            active = [i for i in active if quotas[i] < self.sizes[i]]
         
-        if action == "chmod":
-            entry["instruction"] = f"Make {fname} read-only"
-            entry["linux"] = f"chmod 444 {fname}"
-            entry["windows_cmd"] = f"attrib +r {fname}"
-            entry["mac"] = f"chmod 444 {fname}"
-            
-        elif action == "chown":
-            entry["instruction"] = f"Change owner of {fname} to {user}"
-            entry["linux"] = f"chown {user} {fname}"
-            entry["windows_cmd"] = f"icacls {fname} /setowner {user}"
-            entry["mac"] = f"chown {user} {fname}"
-            
-        elif action == "view":
-            entry["instruction"] = f"View permissions of {fname}"
-            entry["linux"] = f"ls -l {fname}"
-            entry["windows_cmd"] = f"icacls {fname}"
-            entry["mac"] = f"ls -l {fname}"
-            
-        data.append(entry)
-    return data
+        return quotas
 
-def generate_compress_ops(count: int) -> List[Dict]:
-    data = []
-    
-    for _ in range(count):
-        dirname = random.choice(DIRECTORIES)
-        fname = random.choice(FILENAMES)
-        
-        action = random.choice(["zip", "unzip", "tar"])
-        
-        entry = {
-            "id": f"comp_{uuid.uuid4().hex[:8]}",
-            "category": "compression",
-            "subcategory": action,
-            "difficulty": "intermediate",
-            "tags": ["compression", action]
-        }
-        
-        if action == "zip":
-            entry["instruction"] = f"Zip the {dirname} directory"
-            entry["linux"] = f"zip -r {dirname}.zip {dirname}"
-            entry["windows_cmd"] = f"tar -a -c -f {dirname}.zip {dirname}" # Modern Windows 10+ has tar
-            entry["mac"] = f"zip -r {dirname}.zip {dirname}"
-            
-        elif action == "unzip":
-            entry["instruction"] = f"Unzip archive.zip"
-            entry["linux"] = "unzip archive.zip"
-            entry["windows_cmd"] = "tar -xf archive.zip"
-            entry["mac"] = "unzip archive.zip"
-            
-        elif action == "tar":
-            entry["instruction"] = f"Create tarball of {dirname}"
-            entry["linux"] = f"tar -cvf {dirname}.tar {dirname}"
-            entry["windows_cmd"] = f"tar -cvf {dirname}.tar {dirname}"
-            entry["mac"] = f"tar -cvf {dirname}.tar {dirname}"
-            
-        data.append(entry)
-    return data
+def _permutation(size: int, rng: random.Random) -> Tuple[int, int]:
+    """Random affine permutation i -> (a * i + b) % size with gcd(a, size) == 1."""
+    if size <= 1:
+        return 1, 0
+    while True:
+        a = rng.randrange(1, size)
+        if math.gcd(a, size) == 1:
+            return a, rng.randrange(size)
 
-def generate_env_ops(count: int) -> List[Dict]:
-    data = []
+def enumerate_entries(filename: str, count: int, seed: int, start: int, stop: int,
+                      rng: random.Random) -> List[Dict]:
+    """
+    Produce positions [start, stop) of a category's without-replacement walk.
     
-    for _ in range(count):
-        var = random.choice(VARS)
-        val = "some_value"
-        
-        action = random.choice(["set", "get", "unset"])
-        
-        entry = {
-            "id": f"env_{uuid.uuid4().hex[:8]}",
-            "category": "environment_variables",
-            "subcategory": action,
-            "difficulty": "intermediate",
-            "tags": ["env", action]
-        }
-        
-        if action == "set":
-            entry["instruction"] = f"Set {var} to {val}"
-            entry["linux"] = f"export {var}={val}"
-            entry["windows_cmd"] = f"set {var}={val}"
-            entry["mac"] = f"export {var}={val}"
-            
-        elif action == "get":
-            entry["instruction"] = f"Show value of {var}"
-            entry["linux"] = f"echo ${var}"
-            entry["windows_cmd"] = f"echo %{var}%"
-            entry["mac"] = f"echo ${var}"
-            
-        elif action == "unset":
-            entry["instruction"] = f"Unset {var}"
-            entry["linux"] = f"unset {var}"
-            entry["windows_cmd"] = f"set {var}="
-            entry["mac"] = f"unset {var}"
-            
-        data.append(entry)
+    count entries are allocated over templates (see TemplateSpace.allocate)
+    and each template is walked in a seeded pseudo-random order, so any
+    shard of the walk can be computed independently and no two positions
+    yield the same entry.
+    """
+    spec = CATEGORIES[filename]
+    space = TemplateSpace(spec)
+    quotas = space.allocate(count)
+    
+    order_rng = random.Random(f"{seed}:{filename}:enumerate")
+    orders = [_permutation(size, order_rng) for size in space.sizes]
+    
+    data = []
+    offset = 0
+    for template_index, quota in enumerate(quotas):
+        lo, hi = max(start, offset), min(stop, offset + quota)
+        a, b = orders[template_index]
+        size = space.sizes[template_index]
+        for position in range(lo - offset, hi - offset):
+            template, values = space.decode(template_index, (a * position + b) % size)
+            data.append(build_entry(spec, template, values, rng))
+        offset += quota
     return data
 
 # --- Main Driver ---
 
-def main():
-    generators = {
-        "01_file_operations.json": generate_file_ops,
-        "02_directory_operations.json": generate_dir_ops,
-        "03_process_management.json": generate_process_ops,
-        "04_network_operations.json": generate_network_ops,
-        "05_system_information.json": generate_system_ops,
-        "06_package_management.json": generate_package_ops,
-        "07_text_processing.json": generate_text_ops,
-        "08_permissions.json": generate_perm_ops,
-        "09_compression.json": generate_compress_ops,
-        "10_environment_variables.json": generate_env_ops
-    }
+GENERATORS = {
+    "01_file_operations.json": generate_file_ops,
+    "02_directory_operations.json": generate_dir_ops,
+    "03_process_management.json": generate_process_ops,
+    "04_network_operations.json": generate_network_ops,
+    "05_system_information.json": generate_system_ops,
+    "06_package_management.json": generate_package_ops,
+    "07_text_processing.json": generate_text_ops,
+    "08_permissions.json": generate_perm_ops,
+    "09_compression.json": generate_compress_ops,
+    "10_environment_variables.json": generate_env_ops
+}
+
+def shard_rng(seed: int, filename: str, shard_index: int) -> random.Random:
+    """Independent RNG for one shard of one category, fixed by (seed, category, shard)."""
+    return random.Random(f"{seed}:{filename}:{shard_index}")
+
+def plan_shards(count: int, shard_size: int) -> List[int]:
+    """Split a per-category count into fixed-size shards (last one may be smaller)."""
+    return [min(shard_size, count - start) for start in range(0, count, shard_size)]
+
+def generate_shard(filename: str, shard_index: int, count: int, seed: int, part_path: str,
+                   mode: str = "sample", total: int = 0, shard_size: int = 0) -> int:
+    """Generate one shard into a JSONL part file. Runs inside a worker process."""
+    rng = shard_rng(seed, filename, shard_index)
+    if mode == "enumerate":
+        start = shard_index * shard_size
+        data = enumerate_entries(filename, total, seed, start, start + count, rng)
+    else:
+        data = GENERATORS[filename](count, rng)
+    with RecordWriter(part_path) as writer:
+        writer.write_all(data)
+    return writer.count
+
+def generate_parallel(filenames: List[str], count: int, output_dir: Path, seed: int = 42,
+                      shard_size: int = 10000, workers: int = None, suffix: str = ".json",
+                      mode: str = "sample") -> Dict[str, int]:
+    """
+    Generate categories as seeded shards spread over a process pool.
+    
+    Each (category, shard) pair gets its own RNG and shard boundaries depend
+    only on count and shard_size, so the output is identical for any number
+    of workers. Shards are written to part files and concatenated in order.
+    In "enumerate" mode count is capped at each category's space size and
+    shards cover disjoint slices of one without-replacement walk.
+    Returns the number of entries written per output file.
+    """
+    parts_dir = output_dir / ".parts"
+    parts_dir.mkdir(parents=True, exist_ok=True)
+    # Leftovers from an interrupted run would be concatenated otherwise
+    for stale_part in parts_dir.glob("*.jsonl"):
+        stale_part.unlink()
+    
+    tasks = []
+    for filename in filenames:
+        total = count
+        if mode == "enumerate":
+            total = min(count, TemplateSpace(CATEGORIES[filename]).size)
+        for shard_index, shard_count in enumerate(plan_shards(total, shard_size)):
+            part_path = parts_dir / f"{Path(filename).stem}.{shard_index:05d}.jsonl"
+            tasks.append((filename, shard_index, shard_count, seed, str(part_path),
+                          mode, total, shard_size))
     
-    output_dir = Path("datasets/generated/raw")
+    if workers == 1:
+        for task in tasks:
+            generate_shard(*task)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(generate_shard, *task) for task in tasks]
+            for future in futures:
+                future.result()
+    
+    written = {}
+    for filename in filenames:
+        output_path = output_dir / (Path(filename).stem + suffix)
+        part_paths = sorted(parts_dir.glob(f"{Path(filename).stem}.*.jsonl"))
+        with RecordWriter(output_path) as writer:
+            for part_path in part_paths:
+                writer.write_all(iter_records(part_path))
+                part_path.unlink()
+        written[output_path.name] = writer.count
+    
+    parts_dir.rmdir()
+    return written
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Procedurally generate raw command datasets.")
+    parser.add_argument("--count", type=int, default=500,
+                        help="Target number of entries per category (default: 500)")
+    parser.add_argument("--mode", choices=["sample", "enumerate"], default="sample",
+                        help="sample: draw with replacement; enumerate: unique entries "
+                             "without replacement from the template x slot-value space")
+    parser.add_argument("--exhaustive", action="store_true",
+                        help="With --mode enumerate, walk each category's whole space")
+    parser.add_argument("--categories", nargs="*",
+                        help="Only generate these categories (e.g. 01_file_operations)")
+    parser.add_argument("--seed", type=int, default=42,
+                        help="Base seed; each category shard derives its own RNG from it")
+    parser.add_argument("--shard-size", type=int, default=10000,
+                        help="Entries per shard (default: 10000)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Worker processes (default: all cores); 1 runs in-process")
+    parser.add_argument("--format", choices=["json", "jsonl"], default="json",
+                        help="Output file format (default: json)")
+    parser.add_argument("--output-dir", default="datasets/generated/raw")
+    args = parser.parse_args(argv)
+    
+    filenames = list(GENERATORS)
+    if args.categories:
+        wanted = {Path(name).stem for name in args.categories}
+        filenames = [name for name in filenames if Path(name).stem in wanted]
+        if not filenames:
+            print(f"No matching categories: {args.categories}")
+            return
+    
+    output_dir = Path(args.output_dir)
     output_dir.mkdir(parents=True, exist_ok=True)
     
-    for filename, generator in generators.items():
-        print(f"Generating 500+ samples for {filename}...")
-        data = generator(100) # Generate extra to be safe
-        
-        output_path = output_dir / filename
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
+    count = args.count
+    if args.mode == "enumerate" and args.exhaustive:
+        count = max(TemplateSpace(CATEGORIES[name]).size for name in filenames)
+    
+    print(f"Generating {'all' if args.exhaustive else count} samples for {len(filenames)} categories "
+          f"(mode={args.mode}, seed={args.seed}, shard size={args.shard_size}, workers={args.workers})...")
+    written = generate_parallel(
+        filenames, count, output_dir,
+        seed=args.seed, shard_size=args.shard_size,
+        workers=args.workers, suffix=f".{args.format}", mode=args.mode
+    )
+    
+    for filename, (name, total) in zip(filenames, written.items()):
+        if args.mode == "enumerate":
+            space_size = TemplateSpace(CATEGORIES[filename]).size
+            print(f"  {name}: {total} unique entries "
+                  f"({100 * total / space_size:.1f}% of {space_size} combinations)")
+        else:
+            print(f"  {name}: {total} entries")
             
     print("Generation complete.")
 
@@ -3,10 +3,25 @@ split_dataset.py
 Splits the full dataset into train, dev, and test sets.
 """
 
+import argparse
+import hashlib
 import json
 import random
+from contextlib import ExitStack
 from pathlib import Path
 
+from convert_to_alpaca import OS_PHRASES
+from dedup import normalize_instruction
+from utils import RecordWriter, count_records, iter_records
+
+SPLIT_NAMES = ("train", "dev", "test")
+
+# Longest first so "using Windows CMD" wins over a shorter overlapping phrase
+_OS_SUFFIXES = sorted(
+    (" " + normalize_instruction(phrase) for phrases in OS_PHRASES.values() for phrase in phrases),
+    key=len, reverse=True
+)
+
 def split_dataset(data: list, train_ratio=0.85, dev_ratio=0.10, test_ratio=0.05, seed=42):
     """Split data into train, dev, test sets."""
     random.seed(seed)
@@ -22,27 +37,116 @@ def split_dataset(data: list, train_ratio=0.85, dev_ratio=0.10, test_ratio=0.05,
         "test": data[dev_end:]
     }
 
-def main():
-    merged_path = Path("datasets/generated/merged/full_dataset.json")
-    processed_dir = Path("datasets/generated/processed")
+def stream_split(input_path, output_paths: dict, train_ratio=0.85, dev_ratio=0.10) -> dict:
+    """
+    Split a file into train, dev, test files record by record.
+    
+    The input is expected to be shuffled already (convert_to_alpaca shuffles
+    the merged dataset), so records are routed by position: one pass counts
+    them, a second pass streams each one to its split. Returns split sizes.
+    """
+    total = count_records(input_path)
+    train_end = int(total * train_ratio)
+    dev_end = train_end + int(total * dev_ratio)
+    
+    with ExitStack() as stack:
+        writers = {
+            name: stack.enter_context(RecordWriter(path))
+            for name, path in output_paths.items()
+        }
+        
+        for index, record in enumerate(iter_records(input_path)):
+            if index < train_end:
+                writers["train"].write(record)
+            elif index < dev_end:
+                writers["dev"].write(record)
+            else:
+                writers["test"].write(record)
+    
+    return {name: writer.count for name, writer in writers.items()}
+
+def group_key(record: dict) -> str:
+    """
+    Key shared by every Alpaca variant of one source entry.
+    
+    The [OS] tag, "on Linux" phrasing and JSON variants all keep the entry's
+    instruction, so the normalized instruction minus any appended OS phrase
+    identifies the entry.
+    """
+    instruction = normalize_instruction(record["instruction"])
+    for suffix in _OS_SUFFIXES:
+        if instruction.endswith(suffix):
+            return instruction[:-len(suffix)]
+    return instruction
+
+def hash_split_name(key: str, train_ratio=0.85, dev_ratio=0.10, salt: str = "split-v1") -> str:
+    """
+    Map a group key to a split through a stable hash.
+    
+    The assignment depends only on the key and salt, never on the rest of
+    the data, so adding records cannot move existing ones between splits.
+    """
+    digest = hashlib.blake2b(f"{salt}:{key}".encode("utf-8"), digest_size=8).digest()
+    point = int.from_bytes(digest, "big") / 2 ** 64
+    if point < train_ratio:
+        return "train"
+    if point < train_ratio + dev_ratio:
+        return "dev"
+    return "test"
+
+def hash_split(input_path, output_paths: dict, train_ratio=0.85, dev_ratio=0.10,
+               salt: str = "split-v1") -> dict:
+    """
+    Split a file into train, dev, test files by group key in one pass.
+    
+    All variants of an entry land in the same split, so no instruction seen
+    in training reappears in dev or test. Memory use is constant. Split sizes
+    follow the ratios in expectation rather than exactly. Returns split sizes.
+    """
+    with ExitStack() as stack:
+        writers = {
+            name: stack.enter_context(RecordWriter(path))
+            for name, path in output_paths.items()
+        }
+        
+        for record in iter_records(input_path):
+            name = hash_split_name(group_key(record), train_ratio, dev_ratio, salt)
+            writers[name].write(record)
+    
+    return {name: writer.count for name, writer in writers.items()}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Split the merged dataset into train/dev/test.")
+    parser.add_argument("--mode", choices=["hash", "position"], default="hash",
+                        help="hash: leakage-free split by group key (default); "
+                             "position: cut the shuffled file by index")
+    parser.add_argument("--salt", default="split-v1",
+                        help="Hash salt; changing it reshuffles every group")
+    parser.add_argument("--input", default="datasets/generated/merged/full_dataset.json")
+    parser.add_argument("--output-dir", default="datasets/generated/processed")
+    args = parser.parse_args(argv)
+    
+    merged_path = Path(args.input)
+    processed_dir = Path(args.output_dir)
     processed_dir.mkdir(parents=True, exist_ok=True)
     
     if not merged_path.exists():
         print(f"File not found: {merged_path}")
         return
 
-    with open(merged_path, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    
-    print(f"Total examples: {len(data)}")
+    output_paths = {
+        split_name: processed_dir / f"{split_name}.json"
+        for split_name in SPLIT_NAMES
+    }
     
-    splits = split_dataset(data)
+    if args.mode == "hash":
+        sizes = hash_split(merged_path, output_paths, salt=args.salt)
+    else:
+        sizes = stream_split(merged_path, output_paths)
     
-    for split_name, split_data in splits.items():
-        output_path = processed_dir / f"{split_name}.json"
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(split_data, f, indent=2, ensure_ascii=False)
-        print(f"{split_name}: {len(split_data)} examples -> {output_path}")
+    print(f"Total examples: {sum(sizes.values())}")
+    for split_name, size in sizes.items():
+        print(f"{split_name}: {size} examples -> {output_paths[split_name]}")
 
 if __name__ == "__main__":
     main()
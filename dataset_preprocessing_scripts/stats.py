@@ -3,20 +3,25 @@ stats.py
 Generate statistics for the final dataset.
 """
 
-import json
+import argparse
 from pathlib import Path
 from collections import Counter
 
+from utils import iter_records, save_json
+
 def get_stats(data):
+    """Compute dataset statistics in a single streaming pass."""
     stats = {
-        "total": len(data),
+        "total": 0,
         "os_distribution": Counter(),
-        "json_outputs": 0,
-        "instruction_lengths": [],
-        "output_lengths": []
+        "json_outputs": 0
     }
+    instruction_chars = 0
+    output_chars = 0
     
     for item in data:
+        stats["total"] += 1
+        
         # Check OS tag
         if "[LINUX]" in item["input"]:
             stats["os_distribution"]["linux"] += 1
@@ -29,32 +34,45 @@ def get_stats(data):
         else:
             stats["os_distribution"]["implicit"] += 1
         
-        stats["instruction_lengths"].append(len(item["instruction"]))
-        stats["output_lengths"].append(len(item["output"]))
+        instruction_chars += len(item["instruction"])
+        output_chars += len(item["output"])
     
-    if stats["instruction_lengths"]:
-        stats["avg_instruction_length"] = sum(stats["instruction_lengths"]) / len(stats["instruction_lengths"])
+    if stats["total"]:
+        stats["avg_instruction_length"] = instruction_chars / stats["total"]
+        stats["avg_output_length"] = output_chars / stats["total"]
     else:
         stats["avg_instruction_length"] = 0
-
-    if stats["output_lengths"]:
-        stats["avg_output_length"] = sum(stats["output_lengths"]) / len(stats["output_lengths"])
-    else:
         stats["avg_output_length"] = 0
     
     return stats
 
-def main():
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Dataset statistics and token-length profile.")
+    parser.add_argument("--processed-dir", default="datasets/generated/processed")
+    parser.add_argument("--tokenizer", default=None,
+                        help="Tokenizer name or path (e.g. Qwen/Qwen3-0.6B); enables the token profile")
+    parser.add_argument("--max-lengths", type=int, nargs="+", default=[128, 192, 256, 384, 512])
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--max-new-tokens", type=int, nargs="+", default=[32, 64, 100, 150])
+    parser.add_argument("--report", default="datasets/generated/reports/token_profile.json")
+    args = parser.parse_args(argv)
+
+    tokenizer = None
+    if args.tokenizer:
+        from transformers import AutoTokenizer
+        from token_profile import print_shape_report, profile_tokens, shape_report
+        tokenizer = AutoTokenizer.from_pretrained(args.tokenizer, trust_remote_code=True)
+        if tokenizer.eos_token is None:
+            tokenizer.eos_token = ""
+
+    profile = {}
     for split in ["train", "dev", "test"]:
-        path = Path(f"datasets/generated/processed/{split}.json")
+        path = Path(args.processed_dir) / f"{split}.json"
         if not path.exists():
             print(f"File not found: {path}")
             continue
 
-        with open(path) as f:
-            data = json.load(f)
-        
-        stats = get_stats(data)
+        stats = get_stats(iter_records(path))
         print(f"\n=== {split.upper()} ===")
         print(f"Total examples: {stats['total']}")
         print(f"OS distribution: {dict(stats['os_distribution'])}")
@@ -62,5 +80,14 @@ def main():
         print(f"Avg instruction length: {stats['avg_instruction_length']:.1f} chars")
         print(f"Avg output length: {stats['avg_output_length']:.1f} chars")
 
+        if tokenizer is not None:
+            histograms = profile_tokens(iter_records(path), tokenizer)
+            profile[split] = shape_report(histograms, args.max_lengths, args.batch_sizes, args.max_new_tokens)
+            print_shape_report(split, profile[split], args.max_lengths, args.batch_sizes)
+
+    if profile:
+        save_json({"tokenizer": args.tokenizer, "splits": profile}, args.report)
+        print(f"\nToken profile saved to: {args.report}")
+
 if __name__ == "__main__":
     main()
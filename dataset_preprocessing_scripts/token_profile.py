@@ -0,0 +1,177 @@
+"""
+token_profile.py
+Token-length profile of the processed splits, for stats.py --tokenizer.
+
+Lengths are kept as exact per-value histograms (LengthHistogram), per
+example group and for the prompt, the output and the full training text,
+and turned into percentiles and padding/truncation estimates for
+candidate max_seq_length / batch size / max_new_tokens settings. Kept
+apart from stats.py so the character statistics run without numpy.
+"""
+
+import sys
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, Iterable, Sequence
+
+import numpy as np
+
+# The prompt template lives with the training code
+sys.path.append(str(Path(__file__).resolve().parent.parent / "model_scripts"))
+
+OS_TAGS = {"[LINUX]": "linux", "[WINDOWS]": "windows", "[MAC]": "mac"}
+PERCENTILES = (50, 90, 95, 99, 100)
+HISTOGRAM_EDGES = (0, 16, 32, 48, 64, 96, 128, 192, 256, 384, 512)
+
+def example_group(item: dict) -> str:
+    """OS tag, "json" or "implicit" (OS named in the instruction); mirrors stats.get_stats."""
+    for tag, name in OS_TAGS.items():
+        if tag in item["input"]:
+            return name
+    return "json" if "JSON" in item["input"] else "implicit"
+
+class LengthHistogram:
+    """
+    Exact distribution of integer lengths in constant memory: a count per
+    length value, grown as needed. Percentiles, means and padding estimates
+    are computed from the counts.
+    """
+
+    def __init__(self):
+        self.counts = np.zeros(0, dtype=np.int64)
+
+    def _add_counts(self, counts: np.ndarray) -> None:
+        if len(counts) > len(self.counts):
+            self.counts = np.pad(self.counts, (0, len(counts) - len(self.counts)))
+        self.counts[:len(counts)] += counts
+
+    def add(self, lengths: np.ndarray) -> None:
+        self._add_counts(np.bincount(lengths))
+
+    def merge(self, other: "LengthHistogram") -> None:
+        self._add_counts(other.counts)
+
+    @property
+    def total(self) -> int:
+        return int(self.counts.sum())
+
+    def mean(self) -> float:
+        return float(np.arange(len(self.counts)) @ self.counts / self.total) if self.total else 0.0
+
+    def percentiles(self, qs: Sequence[float] = PERCENTILES) -> Dict[str, int]:
+        """Nearest-rank percentiles."""
+        cumulative = np.cumsum(self.counts)
+        return {f"p{q}": int(np.searchsorted(cumulative, max(1, np.ceil(q / 100 * self.total))))
+                for q in qs}
+
+    def histogram(self, edges: Sequence[int] = HISTOGRAM_EDGES) -> Dict[str, int]:
+        bounds = list(edges) + [max(len(self.counts), edges[-1] + 1)]
+        return {f"{lo}-{hi - 1}" if i < len(edges) - 1 else f"{lo}+": int(self.counts[lo:hi].sum())
+                for i, (lo, hi) in enumerate(zip(bounds, bounds[1:]))}
+
+    def truncated_fraction(self, limit: int) -> float:
+        """Share of examples longer than limit."""
+        return float(self.counts[limit + 1:].sum() / self.total) if self.total else 0.0
+
+    def pad_to_max_waste(self, max_length: int) -> float:
+        """Share of computed tokens that are padding when every example is padded to max_length."""
+        values = np.minimum(np.arange(len(self.counts)), max_length)
+        return 1 - float(values @ self.counts) / (self.total * max_length)
+
+    def dynamic_padding_waste(self, batch_size: int, max_length: int) -> float:
+        """
+        Expected padding share when random batches are padded to their
+        longest member (capped at max_length): the expected batch maximum
+        is sum over L of L * (F(L)^B - F(L-1)^B).
+        """
+        counts = self.counts[:max_length + 1].copy()
+        counts[-1] += self.counts[max_length + 1:].sum()
+        cdf = np.cumsum(counts) / self.total
+        expected_max = float(np.arange(len(cdf)) @ np.diff(cdf ** batch_size, prepend=0.0))
+        mean = float(np.arange(len(counts)) @ counts / self.total)
+        return 1 - mean / expected_max if expected_max else 0.0
+
+def profile_tokens(records: Iterable[dict], tokenizer, batch_size: int = 512) -> Dict[str, Dict[str, LengthHistogram]]:
+    """
+    Tokenize records in batches and build length histograms per group for
+    the prompt, the target output (with EOS) and the full training text.
+    Memory is one batch plus the histograms.
+    """
+    from prompts import build_prompt
+
+    histograms = defaultdict(lambda: {"prompt": LengthHistogram(), "output": LengthHistogram(),
+                                      "full": LengthHistogram()})
+
+    def flush(batch):
+        prompts = [build_prompt(item["instruction"], item.get("input", "")) for item in batch]
+        outputs = [item["output"] + tokenizer.eos_token for item in batch]
+        prompt_lengths = np.array([len(ids) for ids in tokenizer(prompts)["input_ids"]])
+        output_lengths = np.array([len(ids) for ids in
+                                   tokenizer(outputs, add_special_tokens=False)["input_ids"]])
+        groups = np.array([example_group(item) for item in batch])
+        for group in np.unique(groups):
+            selected = groups == group
+            for name, lengths in (("prompt", prompt_lengths), ("output", output_lengths),
+                                  ("full", prompt_lengths + output_lengths)):
+                histograms[group][name].add(lengths[selected])
+
+    batch = []
+    for item in records:
+        batch.append(item)
+        if len(batch) == batch_size:
+            flush(batch)
+            batch = []
+    if batch:
+        flush(batch)
+
+    # An "all" row combining every group
+    combined = {name: LengthHistogram() for name in ("prompt", "output", "full")}
+    for group_histograms in list(histograms.values()):
+        for name, histogram in group_histograms.items():
+            combined[name].merge(histogram)
+    histograms["all"] = combined
+    return dict(histograms)
+
+def shape_report(histograms: Dict[str, Dict[str, LengthHistogram]], max_lengths: Sequence[int],
+                 batch_sizes: Sequence[int], max_new_tokens: Sequence[int]) -> dict:
+    """Percentiles, histograms and padding/truncation estimates for candidate shapes."""
+    report = {}
+    for group, group_histograms in sorted(histograms.items()):
+        full = group_histograms["full"]
+        output = group_histograms["output"]
+        report[group] = {
+            "examples": full.total,
+            **{name: {"mean": round(h.mean(), 1), **h.percentiles(), "histogram": h.histogram()}
+               for name, h in group_histograms.items()},
+            "max_seq_length": {
+                str(length): {
+                    "truncated": round(full.truncated_fraction(length), 4),
+                    "pad_to_max_waste": round(full.pad_to_max_waste(length), 4),
+                    **{f"dynamic_waste_bs{bs}": round(full.dynamic_padding_waste(bs, length), 4)
+                       for bs in batch_sizes},
+                }
+                for length in max_lengths
+            },
+            "max_new_tokens": {
+                str(limit): {"cut_off": round(output.truncated_fraction(limit), 4)}
+                for limit in max_new_tokens
+            },
+        }
+    return report
+
+def print_shape_report(split: str, report: dict, max_lengths: Sequence[int], batch_sizes: Sequence[int]) -> None:
+    print(f"\n=== {split.upper()} token lengths (full prompt+output) ===")
+    print(f"{'Group':<10} {'Count':>6} {'Mean':>6} " + " ".join(f"{f'p{q}':>5}" for q in PERCENTILES)
+          + f" {'out p99':>8} {'out max':>8}")
+    for group, row in report.items():
+        full, output = row["full"], row["output"]
+        print(f"{group:<10} {row['examples']:>6} {full['mean']:>6.1f} "
+              + " ".join(f"{full[f'p{q}']:>5}" for q in PERCENTILES)
+              + f" {output['p99']:>8} {output['p100']:>8}")
+
+    shapes = report["all"]["max_seq_length"]
+    print(f"\n{'max_len':>8} {'trunc':>7} {'pad-max':>8} " + " ".join(f"{f'dyn bs{bs}':>9}" for bs in batch_sizes))
+    for length in max_lengths:
+        row = shapes[str(length)]
+        print(f"{length:>8} {100 * row['truncated']:>6.2f}% {100 * row['pad_to_max_waste']:>7.1f}% "
+              + " ".join(f"{100 * row[f'dynamic_waste_bs{bs}']:>8.1f}%" for bs in batch_sizes))
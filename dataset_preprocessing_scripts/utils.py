@@ -3,9 +3,19 @@ utils.py
 Helper functions for data processing scripts.
 """
 
+import filecmp
+import hashlib
 import json
+import os
+import re
+import tempfile
 from pathlib import Path
-from typing import Any, Union
+from typing import Any, Iterable, Iterator, List, Union
+
+RECORD_SUFFIXES = (".json", ".jsonl")
+
+_WHITESPACE = re.compile(r'\s*')
+_ARRAY_SEPARATORS = re.compile(r'[\s,]*')
 
 def load_json(filepath: Union[str, Path]) -> Any:
     """Load data from a JSON file."""
@@ -23,3 +33,216 @@ def save_json(data: Any, filepath: Union[str, Path], indent: int = 2) -> None:
 def ensure_dir(path: Union[str, Path]) -> None:
     """Ensure a directory exists."""
     Path(path).mkdir(parents=True, exist_ok=True)
+
+# --- Streaming record I/O ---
+
+def iter_records(filepath: Union[str, Path], chunk_size: int = 1 << 16) -> Iterator[Any]:
+    """
+    Yield records one at a time from a JSON array file or a JSONL file.
+
+    Files ending in `.jsonl` are always read as one record per line (a
+    record may itself be an array); other files are read as an array when
+    they start with `[`, else as concatenated records.
+
+    Only the record currently being decoded is held in memory, so the
+    existing pretty-printed JSON files and newline-delimited files can both
+    be read with flat memory use regardless of their size.
+    """
+    decoder = json.JSONDecoder()
+    jsonl = Path(filepath).suffix == ".jsonl"
+
+    with open(filepath, 'r', encoding='utf-8') as f:
+        buf = f.read(chunk_size)
+        eof = not buf
+        pos = _WHITESPACE.match(buf).end()
+
+        # Pull in more text until we know how the file starts
+        while pos == len(buf) and not eof:
+            more = f.read(chunk_size)
+            eof = not more
+            buf += more
+            pos = _WHITESPACE.match(buf, pos).end()
+
+        is_array = buf[pos:pos + 1] == '[' and not jsonl
+        if is_array:
+            pos += 1
+        separators = _ARRAY_SEPARATORS if is_array else _WHITESPACE
+
+        while True:
+            pos = separators.match(buf, pos).end()
+
+            if pos == len(buf):
+                if eof:
+                    if is_array:
+                        raise json.JSONDecodeError("Unterminated JSON array", buf, pos)
+                    return
+                buf = f.read(chunk_size)
+                eof = not buf
+                pos = 0
+                continue
+
+            if is_array and buf[pos] == ']':
+                return
+
+            try:
+                record, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                more = f.read(chunk_size)
+                eof = not more
+                buf = buf[pos:] + more
+                pos = 0
+                continue
+
+            # A scalar cut off at the chunk boundary decodes "successfully"
+            if end == len(buf) and not eof and not isinstance(record, (dict, list)):
+                more = f.read(chunk_size)
+                eof = not more
+                buf = buf[pos:] + more
+                pos = 0
+                continue
+
+            yield record
+            pos = end
+
+            # Drop consumed text so the buffer stays around one chunk
+            if pos >= chunk_size:
+                buf = buf[pos:]
+                pos = 0
+
+def count_records(filepath: Union[str, Path]) -> int:
+    """Count the records in a JSON array or JSONL file without loading it."""
+    return sum(1 for _ in iter_records(filepath))
+
+class RecordWriter:
+    """
+    Incrementally write records to a file.
+
+    Files ending in `.jsonl` get one compact record per line; any other suffix
+    gets a JSON array laid out exactly like `save_json`. Output goes to a
+    temporary file that replaces the target on success, so a stage may
+    rewrite the file it is reading from. With `only_if_changed`, a target
+    whose bytes would not change is left untouched (mtime included) and
+    `changed` reports which case happened.
+    """
+
+    def __init__(self, filepath: Union[str, Path], indent: int = 2, only_if_changed: bool = False):
+        self.filepath = Path(filepath)
+        self.jsonl = self.filepath.suffix == ".jsonl"
+        self.indent = indent
+        self.only_if_changed = only_if_changed
+        self.changed = False
+        self.count = 0
+        self._tmp_path = self.filepath.with_name(self.filepath.name + ".tmp")
+        self._file = None
+
+    def __enter__(self) -> "RecordWriter":
+        self.filepath.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self._tmp_path, 'w', encoding='utf-8')
+        if not self.jsonl:
+            self._file.write("[")
+        return self
+
+    def write(self, record: Any) -> None:
+        """Append a single record."""
+        if self.jsonl:
+            self._file.write(json.dumps(record, ensure_ascii=False))
+            self._file.write("\n")
+        elif self.indent is None:
+            self._file.write(", " if self.count else "")
+            self._file.write(json.dumps(record, ensure_ascii=False))
+        else:
+            pad = " " * self.indent
+            text = json.dumps(record, indent=self.indent, ensure_ascii=False)
+            self._file.write(",\n" if self.count else "\n")
+            self._file.write(pad + text.replace("\n", "\n" + pad))
+        self.count += 1
+
+    def write_all(self, records: Iterable[Any]) -> None:
+        """Append every record from an iterable."""
+        for record in records:
+            self.write(record)
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        if not self.jsonl:
+            self._file.write("\n]" if self.count and self.indent is not None else "]")
+        self._file.close()
+
+        if exc_type is None:
+            if (self.only_if_changed and self.filepath.exists()
+                    and filecmp.cmp(self._tmp_path, self.filepath, shallow=False)):
+                self._tmp_path.unlink()
+            else:
+                os.replace(self._tmp_path, self.filepath)
+                self.changed = True
+        else:
+            self._tmp_path.unlink(missing_ok=True)
+        return False
+
+def write_records(records: Iterable[Any], filepath: Union[str, Path], indent: int = 2) -> int:
+    """Stream records to a JSON array or JSONL file. Returns the number written."""
+    with RecordWriter(filepath, indent=indent) as writer:
+        writer.write_all(records)
+    return writer.count
+
+def file_sha256(filepath: Union[str, Path], chunk_size: int = 1 << 20) -> str:
+    """SHA-256 of a file's bytes, read in chunks."""
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def stat_signature(filepath: Union[str, Path]) -> List[int]:
+    """Cheap change detector: [size, mtime_ns]."""
+    stat = Path(filepath).stat()
+    return [stat.st_size, stat.st_mtime_ns]
+
+def list_record_files(directory: Union[str, Path], pattern: str = "*") -> List[Path]:
+    """List `.json` and `.jsonl` files in a directory, sorted by name (hidden files skipped)."""
+    directory = Path(directory)
+    return sorted(
+        path for suffix in RECORD_SUFFIXES
+        for path in directory.glob(f"{pattern}{suffix}")
+        if not path.name.startswith(".")
+    )
+
+def keyed_shuffle(records: Iterable[Any], filepath: Union[str, Path], seed: Any = 42,
+                  num_buckets: int = 64) -> int:
+    """
+    Deterministically shuffle records into a file without holding them all
+    in memory.
+
+    Every record is ordered by a keyed hash of its own content, so the
+    result depends only on the set of records and the seed, never on the
+    order they arrive in. Records are range-partitioned by the top bits of
+    the key into `num_buckets` spill files; each bucket is sorted in memory
+    and the buckets are written in key order. Returns the number written.
+    """
+    key = str(seed).encode("utf-8")
+    with tempfile.TemporaryDirectory(prefix="shuffle_") as tmp_dir:
+        bucket_paths = [Path(tmp_dir) / f"bucket_{i:04d}.jsonl" for i in range(num_buckets)]
+        buckets = [open(path, 'w', encoding='utf-8') for path in bucket_paths]
+        try:
+            for record in records:
+                line = json.dumps(record, ensure_ascii=False)
+                digest = hashlib.blake2b(line.encode("utf-8"), key=key, digest_size=8).digest()
+                bucket = buckets[int.from_bytes(digest, "big") * num_buckets >> 64]
+                bucket.write(digest.hex())
+                bucket.write("\t")
+                bucket.write(line)
+                bucket.write("\n")
+        finally:
+            for bucket in buckets:
+                bucket.close()
+
+        with RecordWriter(filepath) as writer:
+            for path in bucket_paths:
+                with open(path, 'r', encoding='utf-8') as f:
+                    # Ties (identical records) sort by content, which is the same text
+                    rows = sorted(f)
+                for row in rows:
+                    writer.write(json.loads(row.split("\t", 1)[1]))
+
+    return writer.count
@@ -3,13 +3,24 @@ validate_data.py
 Validates and cleans generated command data.
 """
 
+import argparse
+import hashlib
+import inspect
 import json
 import re
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
 from pathlib import Path
 
+from utils import (RecordWriter, file_sha256, iter_records, list_record_files,
+                   load_json, save_json, stat_signature)
+
+CACHE_FILENAME = ".validation_cache.json"
+
 # Known Windows CMD commands (NOT PowerShell)
-VALID_CMD_COMMANDS = {
+VALID_CMD_COMMANDS = frozenset({
     'dir', 'cd', 'copy', 'move', 'del', 'rd', 'rmdir', 'md', 'mkdir',
     'type', 'echo', 'set', 'setx', 'find', 'findstr', 'sort', 'more',
     'ping', 'ipconfig', 'netstat', 'nslookup', 'tracert', 'curl',
@@ -20,7 +31,7 @@ VALID_CMD_COMMANDS = {
     'mklink', 'ren', 'rename', 'tree', 'assoc', 'ftype', 'path',
     'pushd', 'popd', 'subst', 'vol', 'label', 'format', 'chkdsk',
     'sfc', 'dism', 'wmic', 'reg', 'sc', 'net', 'shutdown', 'runas'
-}
+})
 
 # PowerShell cmdlets to reject
 POWERSHELL_PATTERNS = [
@@ -32,19 +43,31 @@ POWERSHELL_PATTERNS = [
     r'-ne\s', r'-gt\s', r'-lt\s', r'-like\s', r'-match\s', r'\|%\{',
 ]
 
+# All patterns as one compiled alternation, scanned in a single pass
+POWERSHELL_RE = re.compile("|".join(f"(?:{p})" for p in POWERSHELL_PATTERNS), re.IGNORECASE)
+
+# Every pattern needs one of these characters, so most commands skip the regex
+POWERSHELL_HINTS = ('-', '$', '%')
+
 def is_powershell_command(cmd: str) -> bool:
     """Check if command looks like PowerShell instead of CMD."""
+    if not any(hint in cmd for hint in POWERSHELL_HINTS):
+        return False
+    return POWERSHELL_RE.search(cmd) is not None
+
+def is_powershell_command_per_pattern(cmd: str) -> bool:
+    """Reference implementation: try each pattern in turn (used by the benchmark)."""
     for pattern in POWERSHELL_PATTERNS:
         if re.search(pattern, cmd, re.IGNORECASE):
             return True
     return False
 
-def validate_windows_cmd(cmd: str) -> dict:
+def validate_windows_cmd(cmd: str, powershell_check=is_powershell_command) -> dict:
     """Validate Windows CMD command."""
     result = {"valid": True, "warnings": [], "errors": []}
     
     # Check for PowerShell
-    if is_powershell_command(cmd):
+    if powershell_check(cmd):
         result["valid"] = False
         result["errors"].append("Contains PowerShell syntax, not CMD")
         return result
@@ -69,7 +92,7 @@ def validate_linux_command(cmd: str) -> dict:
     
     return result
 
-def validate_entry(entry: dict) -> dict:
+def validate_entry(entry: dict, powershell_check=is_powershell_command) -> dict:
     """Validate a single data entry."""
     issues = {
         "id": entry.get("id", "unknown"),
@@ -89,7 +112,7 @@ def validate_entry(entry: dict) -> dict:
         return issues
     
     # Validate Windows CMD
-    cmd_result = validate_windows_cmd(entry["windows_cmd"])
+    cmd_result = validate_windows_cmd(entry["windows_cmd"], powershell_check)
     if not cmd_result["valid"]:
         issues["valid"] = False
         issues["errors"].extend(cmd_result["errors"])
@@ -107,66 +130,293 @@ def validate_entry(entry: dict) -> dict:
     
     return issues
 
-def validate_category_file(filepath: str) -> dict:
-    """Validate an entire category file."""
-    with open(filepath, 'r', encoding='utf-8') as f:
-        data = json.load(f)
+def check_entry(entry: dict):
+    """
+    Fast validity check for one entry.
+    
+    Returns (issue, has_warnings). issue is None for valid entries; only
+    invalid entries, which are rare, pay for the full validate_entry report,
+    so the issues produced are identical to validate_entry's.
+    """
+    instruction = entry.get("instruction")
+    linux = entry.get("linux")
+    windows_cmd = entry.get("windows_cmd")
     
+    if not (instruction and linux and windows_cmd and entry.get("mac")) \
+            or is_powershell_command(windows_cmd) or not linux.strip():
+        return validate_entry(entry), False
+    
+    words = windows_cmd.split()
+    first_word = words[0].lower().split('\\')[-1].split('/')[-1] if words else ""
+    has_warnings = (
+        (first_word not in VALID_CMD_COMMANDS and not first_word.endswith('.exe'))
+        or len(instruction) < 10
+    )
+    return None, has_warnings
+
+def validate_batch(entries) -> tuple:
+    """Validate many entries at once. Returns the same (results, valid_entries) as validate_category_file."""
     results = {
-        "total": len(data),
+        "total": 0,
         "valid": 0,
         "invalid": 0,
         "entries_with_warnings": 0,
         "issues": []
     }
-    
     valid_entries = []
     
-    for entry in data:
-        validation = validate_entry(entry)
-        
-        if validation["valid"]:
-            results["valid"] += 1
+    for entry in entries:
+        issue, has_warnings = check_entry(entry)
+        if issue is None:
             valid_entries.append(entry)
-            if validation["warnings"]:
-                results["entries_with_warnings"] += 1
+            results["entries_with_warnings"] += has_warnings
         else:
-            results["invalid"] += 1
-            results["issues"].append(validation)
+            results["issues"].append(issue)
     
+    results["total"] = len(valid_entries) + len(results["issues"])
+    results["valid"] = len(valid_entries)
+    results["invalid"] = len(results["issues"])
     return results, valid_entries
 
-def main():
-    # Adjusted paths to match the user's workspace structure if needed
-    # Assuming the script runs from Module1_dataset root
-    raw_dir = Path("datasets/generated/raw")
-    validated_dir = Path("datasets/generated/validated")
+def validate_category_file(filepath: str) -> dict:
+    """Validate an entire category file."""
+    return validate_batch(iter_records(filepath))
+
+def validate_category_stream(filepath, output_path, issues_path) -> dict:
+    """
+    Validate a category file record by record.
+    
+    Valid entries are streamed to output_path and issue reports to
+    issues_path (only created when there are issues), so memory use stays
+    flat regardless of file size. Returns the summary counts.
+    """
+    results = {
+        "total": 0,
+        "valid": 0,
+        "invalid": 0,
+        "entries_with_warnings": 0
+    }
+    
+    # Outputs whose bytes come out the same are left untouched
+    with ExitStack() as stack:
+        valid_writer = stack.enter_context(RecordWriter(output_path, only_if_changed=True))
+        issues_writer = None
+        
+        for entry in iter_records(filepath):
+            results["total"] += 1
+            issue, has_warnings = check_entry(entry)
+            
+            if issue is None:
+                results["valid"] += 1
+                valid_writer.write(entry)
+                results["entries_with_warnings"] += has_warnings
+            else:
+                results["invalid"] += 1
+                if issues_writer is None:
+                    issues_writer = stack.enter_context(RecordWriter(issues_path, only_if_changed=True))
+                issues_writer.write(issue)
+    
+    rewritten = [writer.filepath.name for writer in (valid_writer, issues_writer)
+                 if writer is not None and writer.changed]
+    
+    # A file that no longer has issues must not keep a stale report
+    issues_path = Path(issues_path)
+    if issues_writer is None and issues_path.exists():
+        issues_path.unlink()
+        rewritten.append(issues_path.name)
+    
+    results["rewritten"] = rewritten
+    return results
+
+def _validate_job(job) -> tuple:
+    filepath, output_path, issues_path = job
+    # Fingerprint the source before reading it so a concurrent edit is not missed
+    source = {"stat": stat_signature(filepath), "sha256": file_sha256(filepath)}
+    results = validate_category_stream(filepath, output_path, issues_path)
+    return filepath, results, source
+
+# --- Incremental cache ---
+
+def compute_rules_hash() -> str:
+    """Hash of everything that decides a verdict: rule tables and validator code."""
+    digest = hashlib.sha256()
+    digest.update(json.dumps([sorted(VALID_CMD_COMMANDS), POWERSHELL_PATTERNS]).encode())
+    for func in (is_powershell_command, validate_windows_cmd, validate_linux_command,
+                 validate_entry, check_entry):
+        digest.update(inspect.getsource(func).encode())
+    return digest.hexdigest()
+
+def _output_signatures(output_path, issues_path) -> dict:
+    return {
+        str(Path(path).name): stat_signature(path) if Path(path).exists() else None
+        for path in (output_path, issues_path)
+    }
+
+class ValidationCache:
+    """
+    Persistent record of validated raw files.
+    
+    Each raw file is keyed by the hash of its content (with its size and
+    mtime as a shortcut) together with the rules hash; a file is skipped
+    when both match and its outputs are exactly as this cache left them.
+    Changing any validator rule invalidates every record.
+    """
+    
+    def __init__(self, path, rules_hash: str):
+        self.path = Path(path)
+        self.rules_hash = rules_hash
+        self.files = {}
+        if self.path.exists():
+            data = load_json(self.path)
+            if data.get("rules_hash") == rules_hash:
+                self.files = data.get("files", {})
+    
+    def lookup(self, filepath, output_path, issues_path):
+        """Return the cached results if the file and its outputs are unchanged, else None."""
+        record = self.files.get(Path(filepath).name)
+        if record is None or record["outputs"] != _output_signatures(output_path, issues_path):
+            return None
+        
+        if record["source"]["stat"] != stat_signature(filepath):
+            # Touched but maybe not edited: fall back to the content hash
+            if record["source"]["sha256"] != file_sha256(filepath):
+                return None
+            record["source"]["stat"] = stat_signature(filepath)
+        return record["results"]
+    
+    def store(self, filepath, output_path, issues_path, results, source) -> None:
+        self.files[Path(filepath).name] = {
+            "source": source,
+            "outputs": _output_signatures(output_path, issues_path),
+            "results": {key: value for key, value in results.items() if key != "rewritten"}
+        }
+    
+    def save(self) -> None:
+        save_json({"rules_hash": self.rules_hash, "files": self.files}, self.path)
+
+def validate_files_parallel(jobs, workers: int = None):
+    """
+    Validate (filepath, output_path, issues_path) jobs across a process pool.
+    
+    Yields (filepath, results, source) in job order, where source is the
+    input's stat signature and sha256 taken before it was read.
+    """
+    if workers == 1:
+        yield from map(_validate_job, jobs)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        yield from pool.map(_validate_job, jobs)
+
+def benchmark(filepaths, repeat: int = 3) -> dict:
+    """
+    Time the per-entry reference path (validate_entry with the per-pattern
+    PowerShell check) against the batch engine on the same entries, and
+    confirm both report identical issues.
+    """
+    entries = [entry for filepath in filepaths for entry in iter_records(filepath)]
+    
+    def reference():
+        results = {"valid": 0, "entries_with_warnings": 0, "issues": []}
+        for entry in entries:
+            validation = validate_entry(entry, is_powershell_command_per_pattern)
+            if validation["valid"]:
+                results["valid"] += 1
+                if validation["warnings"]:
+                    results["entries_with_warnings"] += 1
+            else:
+                results["issues"].append(validation)
+        return results
+    
+    timings = {}
+    outputs = {}
+    for name, run in [("reference", reference), ("batch", lambda: validate_batch(entries)[0])]:
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            outputs[name] = run()
+            best = min(best, time.perf_counter() - start)
+        timings[name] = best
+    
+    for key in ("valid", "entries_with_warnings", "issues"):
+        if outputs["reference"][key] != outputs["batch"][key]:
+            raise AssertionError(f"Batch validation disagrees with reference on {key}")
+    
+    count = max(len(entries), 1)
+    return {
+        "entries": len(entries),
+        "reference_us_per_entry": 1e6 * timings["reference"] / count,
+        "batch_us_per_entry": 1e6 * timings["batch"] / count,
+        "speedup": timings["reference"] / timings["batch"] if timings["batch"] else float("inf")
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Validate raw command datasets.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Files validated in parallel (default: all cores); 1 runs in-process")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Revalidate every file instead of skipping unchanged ones")
+    parser.add_argument("--benchmark", action="store_true",
+                        help="Compare per-entry cost of the reference and batch validators")
+    parser.add_argument("--raw-dir", default="datasets/generated/raw")
+    parser.add_argument("--output-dir", default="datasets/generated/validated")
+    args = parser.parse_args(argv)
+    
+    # Paths are relative to the directory the script runs from unless given
+    raw_dir = Path(args.raw_dir)
+    validated_dir = Path(args.output_dir)
     validated_dir.mkdir(parents=True, exist_ok=True)
     
     if not raw_dir.exists():
         print(f"Directory not found: {raw_dir}")
         return
 
-    for filepath in raw_dir.glob("*.json"):
+    filepaths = list_record_files(raw_dir)
+    
+    if args.benchmark:
+        stats = benchmark(filepaths)
+        print(f"Entries: {stats['entries']}")
+        print(f"  Reference: {stats['reference_us_per_entry']:.2f} us/entry")
+        print(f"  Batch:     {stats['batch_us_per_entry']:.2f} us/entry")
+        print(f"  Speedup:   {stats['speedup']:.1f}x")
+        return
+
+    # Valid entries and issues are streamed straight to disk
+    jobs = [
+        (filepath,
+         validated_dir / filepath.name,
+         validated_dir / f"{filepath.stem}_issues{filepath.suffix}")
+        for filepath in filepaths
+    ]
+    
+    cache = None
+    if not args.no_cache:
+        cache = ValidationCache(validated_dir / CACHE_FILENAME, compute_rules_hash())
+    
+    pending = []
+    for job in jobs:
+        results = cache.lookup(*job) if cache else None
+        if results is None:
+            pending.append(job)
+        else:
+            print(f"\nUnchanged: {job[0].name} (cached: {results['valid']} valid, {results['invalid']} invalid)")
+    
+    for (filepath, output_path, issues_path), (_, results, source) in zip(
+            pending, validate_files_parallel(pending, args.workers)):
         print(f"\nValidating: {filepath.name}")
-        results, valid_entries = validate_category_file(filepath)
-        
         print(f"  Total: {results['total']}")
         print(f"  Valid: {results['valid']}")
         print(f"  Invalid: {results['invalid']}")
         print(f"  With warnings: {results['entries_with_warnings']}")
+        print(f"  Rewritten: {', '.join(results['rewritten']) or 'nothing (outputs unchanged)'}")
         
-        # Save valid entries
-        output_path = validated_dir / filepath.name
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(valid_entries, f, indent=2, ensure_ascii=False)
-        
-        # Save issues report
-        if results["issues"]:
-            issues_path = validated_dir / f"{filepath.stem}_issues.json"
-            with open(issues_path, 'w', encoding='utf-8') as f:
-                json.dump(results["issues"], f, indent=2)
+        if results["invalid"]:
             print(f"  Issues saved to: {issues_path}")
+        
+        if cache:
+            cache.store(filepath, output_path, issues_path, results, source)
+    
+    if cache:
+        cache.save()
 
 if __name__ == "__main__":
     main()
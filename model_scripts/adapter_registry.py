@@ -0,0 +1,205 @@
+"""
+adapter_registry.py
+One base model with several LoRA adapters resident.
+
+Loading a source used to mean deleting the model and loading the base
+weights again, so comparing adapters cost one full model load each.
+AdapterRegistry loads the base model once and attaches every registered
+adapter to the same PeftModel (load_adapter), so each one only adds its
+LoRA weights to memory:
+- use(name) switches the active adapter (set_adapter), which only flips
+  which LoRA layers run
+- generate(pairs, adapter) answers pairs with one adapter, through the
+  response cache if given
+- generate_mixed() answers pairs for different adapters in shared
+  batches (PEFT mixed-adapter inference, see generation.generate_batch)
+- compare() runs one prompt through several adapters in one batch
+
+Registering a source that is already resident under another name makes
+an alias instead of a second copy.
+
+Usage (from a notebook):
+    sys.path.append("../model_scripts")
+    from adapter_registry import AdapterRegistry
+    registry = AdapterRegistry("Qwen/Qwen3-0.6B", quantization_config=bnb_config)
+    registry.register("local", "../outputs/lora_adapters")
+    registry.register("hub", "Eng-Elias/qwen3-0.6b-terminal-instruct-lora")
+    print(registry.compare("List all files", "[LINUX]"))
+"""
+
+import gc
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import torch
+
+from generation import generate_batch
+
+DEFAULT_BASE_MODEL = "Qwen/Qwen3-0.6B"
+BASE_ADAPTER = "__base__"  # PEFT's name for running without any adapter
+
+class AdapterRegistry:
+    """
+    The base model, loaded once, plus named LoRA adapters. `model` is the
+    bare base model until the first register() and a PeftModel holding
+    every registered adapter afterwards; `tokenizer` comes from the first
+    registered source (adapters of one base share the vocabulary).
+    """
+
+    def __init__(self, base_model: str = DEFAULT_BASE_MODEL, quantization_config=None,
+                 torch_dtype: torch.dtype = torch.float16, device_map: Optional[str] = "auto"):
+        from transformers import AutoModelForCausalLM
+
+        start = time.perf_counter()
+        self.base_model = base_model
+        self.model = AutoModelForCausalLM.from_pretrained(
+            base_model,
+            quantization_config=quantization_config,
+            device_map=device_map,
+            trust_remote_code=True,
+            torch_dtype=torch_dtype
+        )
+        self.model.eval()
+        self.tokenizer = None
+        self.sources: Dict[str, str] = {}
+        self.aliases: Dict[str, str] = {}
+        self.active: Optional[str] = None
+        self.timings = {"base_load_seconds": time.perf_counter() - start}
+
+    def _load_tokenizer(self, source: str) -> None:
+        from transformers import AutoTokenizer
+
+        self.tokenizer = AutoTokenizer.from_pretrained(source, trust_remote_code=True)
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+
+    def _forget_fingerprints(self) -> None:
+        # response_cache memoizes per adapter config; a reloaded name may hold new weights
+        self.model.__dict__.pop("_response_cache_fingerprints", None)
+
+    def resolve(self, name: str) -> str:
+        """The resident adapter behind `name` (itself unless it is an alias)."""
+        if name == BASE_ADAPTER:
+            return name
+        if name not in self.sources:
+            raise KeyError(f"Unknown adapter {name!r}; registered: {self.names()}")
+        return self.aliases.get(name, name)
+
+    def names(self) -> List[str]:
+        return list(self.sources)
+
+    def register(self, name: str, source: str) -> float:
+        """
+        Attach the adapter at `source` (local directory or hub repo) as
+        `name`; returns the seconds it took. Re-registering a name with a
+        new source replaces that adapter.
+        """
+        from peft import PeftModel
+
+        if name == BASE_ADAPTER:
+            raise ValueError(f"{BASE_ADAPTER!r} is reserved for the bare base model")
+        if self.sources.get(name) == source:
+            return 0.0
+        if name in self.sources:
+            self.unregister(name)
+
+        start = time.perf_counter()
+        resident = next((other for other, other_source in self.sources.items()
+                         if other_source == source and other not in self.aliases), None)
+        if resident is not None:
+            self.aliases[name] = resident
+        elif not isinstance(self.model, PeftModel):
+            self.model = PeftModel.from_pretrained(self.model, source, adapter_name=name)
+            self.model.eval()
+        else:
+            self.model.load_adapter(source, adapter_name=name)
+        if self.tokenizer is None:
+            self._load_tokenizer(source)
+        self.sources[name] = source
+        if self.active is None:
+            self.use(name)
+        self._forget_fingerprints()
+        seconds = time.perf_counter() - start
+        self.timings[f"register_{name}_seconds"] = seconds
+        return seconds
+
+    def unregister(self, name: str) -> None:
+        """Remove an adapter, or just the alias; removing an adapter also removes its aliases."""
+        target = self.resolve(name)
+        if name in self.aliases:
+            del self.aliases[name]
+            del self.sources[name]
+            if self.active == name:
+                self.active = target
+            return
+        if self.active is not None and self.aliases.get(self.active, self.active) == target:
+            self.active = None
+        for alias in [alias for alias, resident in self.aliases.items() if resident == target]:
+            del self.aliases[alias]
+            del self.sources[alias]
+        del self.sources[target]
+        if len(self.model.peft_config) > 1:
+            if self.active is None:
+                self.use(next(iter(self.sources)))
+            self.model.delete_adapter(target)
+        else:
+            # Last adapter: back to the bare base model
+            self.model = self.model.unload()
+        self._forget_fingerprints()
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def use(self, name: str):
+        """Make `name` the active adapter; returns (model, tokenizer)."""
+        start = time.perf_counter()
+        target = self.resolve(name)
+        if target == BASE_ADAPTER:
+            raise ValueError(f"{BASE_ADAPTER!r} cannot be made active; pass it to generate_mixed or compare")
+        self.model.set_adapter(target)
+        self.active = name
+        self.timings["last_switch_seconds"] = time.perf_counter() - start
+        return self.model, self.tokenizer
+
+    def generate(self, pairs: Sequence[Tuple[str, str]], adapter: Optional[str] = None, cache=None,
+                 **generation_kwargs) -> List[str]:
+        """generate_batch with one adapter (default: the active one), through `cache` if given."""
+        if adapter is not None and adapter != self.active:
+            self.use(adapter)
+        if cache is not None:
+            return cache.generate(self.model, self.tokenizer, pairs, **generation_kwargs)
+        return generate_batch(self.model, self.tokenizer, pairs, **generation_kwargs)
+
+    def generate_mixed(self, requests: Sequence[Tuple[str, str, str]], **generation_kwargs) -> List[str]:
+        """
+        Responses for (adapter, instruction, input) triples in input order;
+        pairs for different adapters are decoded in the same batches.
+        BASE_ADAPTER runs the bare base model.
+        """
+        adapters = [self.resolve(adapter) for adapter, _, _ in requests]
+        pairs = [(instruction, input_text) for _, instruction, input_text in requests]
+        return generate_batch(self.model, self.tokenizer, pairs, adapters=adapters, **generation_kwargs)
+
+    def compare(self, instruction: str, input_text: str = "", names: Optional[Sequence[str]] = None,
+                **generation_kwargs) -> Dict[str, str]:
+        """One prompt through several adapters (default: all registered) in one batch, as {name: response}."""
+        names = list(self.names() if names is None else names)
+        responses = self.generate_mixed([(name, instruction, input_text) for name in names], **generation_kwargs)
+        return dict(zip(names, responses))
+
+    def adapter_bytes(self, name: str) -> int:
+        """Memory held by one adapter's LoRA weights."""
+        target = self.resolve(name)
+        return sum(param.numel() * param.element_size() for param_name, param in self.model.named_parameters()
+                   if "lora_" in param_name and f".{target}." in param_name)
+
+    def memory_report(self) -> Dict[str, float]:
+        """Base model and per-adapter weight memory in MB (aliases share their adapter's entry)."""
+        lora = sum(param.numel() * param.element_size() for param_name, param in self.model.named_parameters()
+                   if "lora_" in param_name)
+        total = sum(param.numel() * param.element_size() for param in self.model.parameters())
+        report = {"base_mb": round((total - lora) / 1024**2, 2)}
+        for name in self.names():
+            if name not in self.aliases:
+                report[f"{name}_mb"] = round(self.adapter_bytes(name) / 1024**2, 2)
+        return report
@@ -0,0 +1,202 @@
+"""
+cpu_inference.py
+CPU inference without bitsandbytes.
+
+The notebooks load the base model in 4-bit NF4 through bitsandbytes,
+which targets CUDA; on CPU nodes that path is slow or unsupported. Here
+the adapters are merged into a full-precision copy of the base model and
+the result is run in one of three precisions:
+- "fp32": reference
+- "int8": torch dynamic quantization of every nn.Linear (int8 weights,
+  activations quantized per batch at run time)
+- "bf16": bfloat16 weights, only worthwhile where the CPU has native
+  bf16 (AVX512-BF16 / AMX); "auto" picks bf16 there and int8 elsewhere
+
+configure_threads() sets the intra-op thread count to the physical cores
+available to the process and pins the process to one logical CPU per
+core, so hyper-threads do not fight over the same units.
+
+compare_precisions() evaluates each precision on the test split and
+reports latency, exact match and agreement with the fp32 predictions.
+
+Usage:
+    python cpu_inference.py --model ../outputs/lora_adapters --precisions fp32 int8 bf16
+"""
+
+import argparse
+import json
+import os
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import torch
+
+from generation import generate_batch
+from merged_export import EXPORT_INFO, load_mmap_model
+
+PRECISIONS = ("fp32", "int8", "bf16", "auto")
+DEFAULT_BASE_MODEL = "Qwen/Qwen3-0.6B"
+
+def cpu_supports_bf16() -> bool:
+    """True when the CPU has native bf16 matmul (AVX512-BF16 or AMX)."""
+    try:
+        with open("/proc/cpuinfo", 'r') as f:
+            flags = f.read()
+    except OSError:
+        return False
+    return "avx512_bf16" in flags or "amx_bf16" in flags
+
+def physical_cores() -> List[int]:
+    """One logical CPU per physical core, among the CPUs this process may use."""
+    allowed = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count() or 1))
+    chosen, seen = [], set()
+    for cpu in allowed:
+        try:
+            with open(f"/sys/devices/system/cpu/cpu{cpu}/topology/thread_siblings_list", 'r') as f:
+                siblings = f.read().strip()
+        except OSError:
+            siblings = str(cpu)
+        if siblings not in seen:
+            seen.add(siblings)
+            chosen.append(cpu)
+    return chosen
+
+def configure_threads(threads: Optional[int] = None, pin: bool = True) -> int:
+    """
+    Use `threads` intra-op threads (default: one per physical core) and one
+    inter-op thread, and pin the process to those cores. Call before the
+    first forward pass; returns the thread count.
+    """
+    cores = physical_cores()
+    threads = threads or len(cores)
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass  # Only settable before the first parallel op
+    if pin and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores[:threads] if threads <= len(cores) else cores)
+    return threads
+
+def _is_adapter(model_id: str) -> bool:
+    if Path(model_id).is_dir():
+        return (Path(model_id) / "adapter_config.json").exists()
+    try:
+        from peft import PeftConfig
+        PeftConfig.from_pretrained(model_id)
+        return True
+    except Exception:
+        return False
+
+def load_cpu_model(model_id: str, base_model: Optional[str] = None, precision: str = "auto"):
+    """
+    Model and tokenizer on CPU in the given precision. `model_id` is a
+    local directory or hub repo holding either full weights or LoRA
+    adapters; adapters are merged into the fp32 base (`base_model` or the
+    one in the adapter config) first, so no adapter code runs per token.
+    A merged export (merged_export.py) is loaded memory-mapped.
+    """
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    if precision not in PRECISIONS:
+        raise ValueError(f"precision must be one of {PRECISIONS}, got {precision!r}")
+    if precision == "auto":
+        precision = "bf16" if cpu_supports_bf16() else "int8"
+
+    tokenizer = AutoTokenizer.from_pretrained(model_id, trust_remote_code=True)
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+
+    if _is_adapter(model_id):
+        from peft import PeftConfig, PeftModel
+        base = base_model or PeftConfig.from_pretrained(model_id).base_model_name_or_path or DEFAULT_BASE_MODEL
+        model = AutoModelForCausalLM.from_pretrained(base, torch_dtype=torch.float32, trust_remote_code=True)
+        model = PeftModel.from_pretrained(model, model_id).merge_and_unload()
+    elif (Path(model_id) / EXPORT_INFO).exists():
+        # A merged export: weights memory-mapped straight from the shards
+        model, _ = load_mmap_model(model_id)
+        model = model.float()
+    else:
+        model = AutoModelForCausalLM.from_pretrained(model_id, torch_dtype=torch.float32, trust_remote_code=True)
+    model.eval()
+
+    if precision == "int8":
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    elif precision == "bf16":
+        model = model.to(torch.bfloat16)
+    # Merging leaves no adapter config behind; response_cache fingerprints these instead
+    model.cpu_source = model_id
+    model.cpu_precision = precision
+    return model, tokenizer
+
+def exact_match(pred: str, gold: str) -> bool:
+    return pred.strip() == gold.strip()
+
+def compare_precisions(model_id: str, test_data: str, precisions: Sequence[str] = ("fp32", "int8", "bf16"),
+                       base_model: Optional[str] = None, limit: Optional[int] = None,
+                       batch_size: int = 16, threads: Optional[int] = None) -> Dict[str, dict]:
+    """
+    Generate the test split once per precision and report wall time,
+    ms per sample and per decoded token, exact match, and agreement with
+    the fp32 predictions (when fp32 is among `precisions`).
+    """
+    configure_threads(threads)
+    with open(test_data, 'r', encoding='utf-8') as f:
+        samples = json.load(f)[:limit]
+    pairs = [(sample["instruction"], sample["input"]) for sample in samples]
+
+    report, reference = {}, None
+    for precision in precisions:
+        if precision == "bf16" and not cpu_supports_bf16():
+            print("⚠️ No native bf16 on this CPU; bf16 runs emulated and will be slow")
+        load_start = time.perf_counter()
+        model, tokenizer = load_cpu_model(model_id, base_model, precision)
+        load_seconds = time.perf_counter() - load_start
+
+        stats = {}
+        start = time.perf_counter()
+        preds = generate_batch(model, tokenizer, pairs, batch_size=batch_size, stats=stats, progress=True)
+        seconds = time.perf_counter() - start
+        if precision == "fp32":
+            reference = preds
+
+        matches = sum(exact_match(pred, sample["output"]) for pred, sample in zip(preds, samples))
+        report[precision] = {
+            "resolved_precision": model.cpu_precision,
+            "samples": len(samples),
+            "load_seconds": round(load_seconds, 2),
+            "seconds": round(seconds, 2),
+            "ms_per_sample": round(1000 * seconds / max(len(samples), 1), 1),
+            "ms_per_forward": round(1000 * seconds / max(stats.get("forward_passes", 1), 1), 2),
+            "exact_match": round(matches / max(len(samples), 1), 4),
+            "agreement_with_fp32": (round(sum(a == b for a, b in zip(preds, reference)) / len(preds), 4)
+                                    if reference is not None else None),
+        }
+        print(f"{precision:>5}: {report[precision]}")
+        del model
+    return report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare CPU inference precisions on the test split.")
+    parser.add_argument("--model", default="../outputs/lora_adapters", help="Adapter or model directory / repo")
+    parser.add_argument("--base-model", default=None)
+    parser.add_argument("--test-data", default="../dataset/generated/processed/test.json")
+    parser.add_argument("--precisions", nargs="+", default=["fp32", "int8", "bf16"], choices=PRECISIONS)
+    parser.add_argument("--limit", type=int, default=None, help="Evaluate only the first N samples")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--output", default="../outputs/eval_results")
+    args = parser.parse_args(argv)
+
+    report = compare_precisions(args.model, args.test_data, args.precisions, args.base_model,
+                                args.limit, args.batch_size, args.threads)
+    output = Path(args.output) / f"cpu_precision_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump({"model": args.model, "threads": torch.get_num_threads(), "results": report}, f, indent=2)
+    print(f"\n✅ Comparison saved to: {output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,654 @@
+"""
+generation.py
+Batched greedy generation for evaluation and inference.
+
+Prompts are tokenized once, sorted by length so each batch holds similar
+lengths, left-padded, and decoded in batches by a greedy loop over the
+model's KV cache. Results come back in the caller's order and match
+one-at-a-time greedy generation.
+
+Decoding stops per row as soon as the response is complete rather than at
+max_new_tokens:
+- "###" (the model starting the next template section) in every mode
+- a newline outside quotes for single-command modes (backslash escapes
+  only count for POSIX shells; in cmd a trailing "\\" ends a path)
+- the closing brace of the top-level object in JSON mode
+Finished rows are dropped from the batch (and its KV cache), so the
+remaining steps only run the rows still decoding. Each mode also gets its
+own output budget (MAX_NEW_TOKENS, or budgets_from_profile() from the
+stats.py token profile).
+
+structured_json=True decodes all-OS prompts inside the fixed JSON
+scaffold (JsonRow): keys, punctuation and the copied description are
+forced tokens and the model only produces the three command strings.
+
+generate_fanout() answers one instruction for several OS tags with a
+single prefill of the shared prompt prefix and one batched decode.
+
+With a PEFT model holding several LoRA adapters, `adapters` runs each
+prompt through its own adapter in the same batch (PEFT mixed-adapter
+inference); see adapter_registry.py.
+
+draft_tokens > 0 turns on prompt-lookup speculative decoding: each row
+appends up to that many draft tokens, copied from where its last n-gram
+occurred earlier in the prompt or response (filenames, paths, package
+names), and one forward pass checks them all. Drafts are kept only while
+they equal the greedy prediction, so responses are unchanged; rejected
+drafts stay in the KV cache but are masked out.
+
+With a pruned output head (pruned_head.py) the logits cover a subset of
+the vocabulary and predictions are mapped back to full token ids.
+
+Usage (from a notebook):
+    sys.path.append("../model_scripts")
+    from generation import generate_batch
+    preds = generate_batch(model, tokenizer, [(s["instruction"], s["input"]) for s in samples])
+"""
+
+import json
+import math
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import torch
+
+from prompts import OS_TAGS, build_prompt, extract_response, prompt_mode, windows_prompt
+
+# Output budgets in tokens per prompt mode. Longest dataset outputs are
+# 112 chars for single commands and 407 for JSON; these allow ~2 chars per
+# token. budgets_from_profile() derives tighter ones from measured lengths.
+MAX_NEW_TOKENS = {"single": 64, "implicit": 64, "json": 200}
+SECTION_STOP = "###"
+# Part of the response cache key; bump when stop_index() changes where responses end
+STOP_RULES_VERSION = 2
+PROMPT_LOOKUP_NGRAM = 3
+
+_json_decoder = json.JSONDecoder()
+
+def budgets_from_profile(report_path: Union[str, Path], split: str = "train",
+                         margin: float = 1.25) -> Dict[str, int]:
+    """
+    Per-mode max_new_tokens from a stats.py token profile: the longest
+    output (with EOS) of each group times `margin`. The OS-tag groups
+    (linux, windows, mac) share the "single" budget.
+    """
+    with open(report_path, 'r', encoding='utf-8') as f:
+        groups = json.load(f)["splits"][split]
+    longest = {mode: 0 for mode in MAX_NEW_TOKENS}
+    for group, row in groups.items():
+        if group == "all":
+            continue
+        mode = group if group in longest else "single"
+        longest[mode] = max(longest[mode], row["output"]["p100"])
+    return {mode: math.ceil(length * margin) if length else MAX_NEW_TOKENS[mode]
+            for mode, length in longest.items()}
+
+def _unquoted_newline(text: str, posix: bool = True, final: bool = False) -> int:
+    """
+    Index of the first newline outside shell quotes, or -1. Backslash
+    escapes and single quotes only count in POSIX shells (cmd quotes with
+    " alone), and an apostrophe inside a word ("doesn't") never opens a
+    quote. With `final` (nothing more will be generated) a quote that is
+    still open was a stray one, and the first newline ends the response.
+    """
+    quotes = "'\"" if posix else '"'
+    quote = None
+    escaped = False
+    for i, char in enumerate(text):
+        if escaped:
+            escaped = False
+        elif char == "\\" and posix and quote != "'":
+            escaped = True
+        elif quote:
+            if char == quote:
+                quote = None
+        elif char in quotes and not (char == "'" and text[i - 1:i].isalpha() and text[i + 1:i + 2].isalpha()):
+            quote = char
+        elif char == "\n":
+            return i
+    return text.find("\n") if quote and final else -1
+
+def stop_index(text: str, mode: str, posix: bool = True, final: bool = False) -> Optional[int]:
+    """
+    Where a generated response ends, or None while it is still incomplete.
+    The response is text[:index]; `posix` is False for Windows commands and
+    `final` is set once decoding has stopped (EOS or the budget).
+    """
+    cut = text.find(SECTION_STOP)
+    final = final or cut != -1
+    cut = len(text) if cut == -1 else cut
+    head = text[:cut]
+    # Leading whitespace is not the end of a response
+    start = len(head) - len(head.lstrip())
+    if mode == "json":
+        if head[start:start + 1] == "{" and "}" in head:
+            try:
+                _, end = _json_decoder.raw_decode(head, start)
+                return end
+            except ValueError:
+                pass
+    else:
+        newline = _unquoted_newline(head[start:], posix, final)
+        if newline != -1:
+            return start + newline
+    return cut if cut < len(text) else None
+
+def tokenize_prompts(tokenizer, pairs: Sequence[Tuple[str, str]], max_prompt_length: int = 200) -> List[List[int]]:
+    """Token ids of each (instruction, input) prompt, truncated like the single-sample path."""
+    prompts = [build_prompt(instruction, input_text) for instruction, input_text in pairs]
+    return tokenizer(prompts, truncation=True, max_length=max_prompt_length)["input_ids"]
+
+def length_sorted_batches(lengths: Sequence[int], batch_size: int) -> List[List[int]]:
+    """Indices grouped into batches, longest prompts first (a too-large batch fails early)."""
+    order = sorted(range(len(lengths)), key=lambda i: (-lengths[i], i))
+    return [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+
+def left_pad(sequences: Sequence[Sequence[int]], pad_token_id: int, device=None):
+    """Left-pad id lists into input_ids and attention_mask tensors."""
+    width = max(len(ids) for ids in sequences)
+    input_ids = torch.full((len(sequences), width), pad_token_id, dtype=torch.long)
+    attention_mask = torch.zeros((len(sequences), width), dtype=torch.long)
+    for row, ids in enumerate(sequences):
+        if ids:
+            input_ids[row, width - len(ids):] = torch.tensor(ids, dtype=torch.long)
+            attention_mask[row, width - len(ids):] = 1
+    return input_ids.to(device), attention_mask.to(device)
+
+def select_cache_rows(past_key_values, index: torch.Tensor):
+    """Keep only the batch rows in `index` of a KV cache (Cache object or legacy tuples)."""
+    if hasattr(past_key_values, "batch_select_indices"):
+        past_key_values.batch_select_indices(index)
+        return past_key_values
+    return tuple(tuple(tensor[index] for tensor in layer) for layer in past_key_values)
+
+def repeat_cache_rows(past_key_values, repeats: int):
+    """Repeat every batch row of a KV cache `repeats` times (Cache object or legacy tuples)."""
+    if hasattr(past_key_values, "batch_repeat_interleave"):
+        past_key_values.batch_repeat_interleave(repeats)
+        return past_key_values
+    return tuple(tuple(tensor.repeat_interleave(repeats, dim=0) for tensor in layer)
+                 for layer in past_key_values)
+
+def prompt_lookup_draft(tokens: Sequence[int], ngram_size: int, draft_tokens: int) -> List[int]:
+    """
+    Up to `draft_tokens` ids that followed the most recent earlier
+    occurrence of the trailing n-gram of `tokens`, trying n = ngram_size
+    down to 1; [] when nothing matches.
+    """
+    length = len(tokens)
+    for n in range(min(ngram_size, length - 1), 0, -1):
+        tail = list(tokens[length - n:])
+        last = tail[-1]
+        for start in range(length - n - 1, -1, -1):
+            if tokens[start + n - 1] == last and list(tokens[start:start + n]) == tail:
+                return list(tokens[start + n:start + n + draft_tokens])
+    return []
+
+def output_token_map(model) -> Optional[torch.Tensor]:
+    """
+    Full-vocabulary ids of the logit columns when the model's output head
+    is restricted to a subset (pruned_head.PrunedHead), else None.
+    """
+    get_head = getattr(model, "get_output_embeddings", None)
+    return getattr(get_head(), "token_ids", None) if get_head is not None else None
+
+def eos_token_ids(tokenizer) -> set:
+    eos = tokenizer.eos_token_id
+    return set(eos) if isinstance(eos, (list, tuple)) else {eos}
+
+def _encode(tokenizer, text: str) -> List[int]:
+    return tokenizer(text, add_special_tokens=False)["input_ids"]
+
+class TextRow:
+    """
+    Free greedy decoding of one response: every token comes from the
+    model, and the row ends at EOS, a stop string for its mode (see
+    stop_index) or its token budget.
+    """
+
+    def __init__(self, tokenizer, mode: str, budget: int, eos_ids: set, posix: bool = True):
+        self.tokenizer = tokenizer
+        self.mode = mode
+        self.posix = posix
+        self.budget = budget
+        self.eos_ids = eos_ids
+        self.generated: List[int] = []
+        self.text = ""
+
+    def prefix(self) -> List[int]:
+        """Tokens forced after the prompt before the first model step."""
+        return []
+
+    def step(self, token: int) -> Optional[List[int]]:
+        """Take the model's next token; return the ids to feed next, or None when done."""
+        if token in self.eos_ids:
+            return self._finish()
+        self.generated.append(token)
+        self.text = self.tokenizer.decode(self.generated, skip_special_tokens=True)
+        cut = stop_index(self.text, self.mode, self.posix)
+        if cut is not None:
+            self.text = self.text[:cut]
+            return None
+        return [token] if len(self.generated) < self.budget else self._finish()
+
+    def _finish(self) -> None:
+        # Decoding is over: a quote still open was stray, so cut at its newline
+        cut = stop_index(self.text, self.mode, self.posix, final=True)
+        if cut is not None:
+            self.text = self.text[:cut]
+
+    def response(self) -> str:
+        return extract_response(self.text)
+
+def _string_end(text: str) -> int:
+    """Index of the first unescaped quote or raw newline in a JSON string body, or -1."""
+    escaped = False
+    for i, char in enumerate(text):
+        if escaped:
+            escaped = False
+        elif char == "\\":
+            escaped = True
+        elif char in "\"\n":
+            return i
+    return -1
+
+class JsonRow:
+    """
+    Structured all-OS decoding. The output is always
+    {"description": <instruction>, "linux": ..., "windows": ..., "mac": ...}
+    (convert_to_alpaca.create_json_output_example), so the keys, the
+    punctuation and the copied description are fed to the model as forced
+    tokens and only the three command strings are decoded. Each command
+    ends at its closing quote (or its budget); the token holding the quote
+    is replaced by the forced text that follows it, which is also how the
+    training data tokenizes there. The response is rebuilt with json.dumps,
+    so it always parses.
+    """
+
+    FIELDS = ("linux", "windows", "mac")
+
+    def __init__(self, tokenizer, instruction: str, budget: int, eos_ids: set):
+        self.tokenizer = tokenizer
+        self.instruction = instruction
+        self.budget = budget
+        self.eos_ids = eos_ids
+        self.values: List[str] = []
+        self.generated: List[int] = []
+
+    def prefix(self) -> List[int]:
+        head = '{"description": ' + json.dumps(self.instruction, ensure_ascii=False) + ', "linux": "'
+        return _encode(self.tokenizer, head)
+
+    def step(self, token: int) -> Optional[List[int]]:
+        done = token in self.eos_ids
+        if not done:
+            self.generated.append(token)
+        text = self.tokenizer.decode(self.generated, skip_special_tokens=True)
+        end = _string_end(text)
+        if end == -1 and not done and len(self.generated) < self.budget:
+            return [token]
+
+        value = text if end == -1 else text[:end]
+        self.values.append(value)
+        # Whatever of the value the last token carried, then the next key
+        fed = self.tokenizer.decode(self.generated[:-1], skip_special_tokens=True) if not done else text
+        tail = value[len(fed):] if value.startswith(fed) else ""
+        self.generated = []
+        if len(self.values) == len(self.FIELDS):
+            return None
+        return _encode(self.tokenizer, tail + '", "' + self.FIELDS[len(self.values)] + '": "')
+
+    def response(self) -> str:
+        commands = {}
+        for field, value in zip(self.FIELDS, self.values):
+            try:
+                commands[field] = json.loads('"' + value + '"')
+            except ValueError:
+                commands[field] = value
+        return json.dumps({"description": self.instruction, **commands}, ensure_ascii=False)
+
+def make_row(tokenizer, instruction: str, input_text: str, budgets: Dict[str, int],
+             max_new_tokens: Optional[int], structured_json: bool, eos_ids: set):
+    """TextRow, or JsonRow for JSON prompts when `structured_json` is set."""
+    mode = prompt_mode(input_text)
+    if structured_json and mode == "json":
+        return JsonRow(tokenizer, instruction, max_new_tokens or budgets["single"], eos_ids)
+    return TextRow(tokenizer, mode, max_new_tokens or budgets[mode], eos_ids,
+                   posix=not windows_prompt(instruction, input_text))
+
+def cache_tensors(past_key_values) -> List[Tuple[torch.Tensor, torch.Tensor]]:
+    """(key, value) tensors per layer, shaped (batch, heads, seq, dim); no copies."""
+    if hasattr(past_key_values, "layers"):
+        return [(layer.keys, layer.values) for layer in past_key_values.layers]
+    if hasattr(past_key_values, "key_cache"):
+        return list(zip(past_key_values.key_cache, past_key_values.value_cache))
+    return [tuple(layer) for layer in past_key_values]
+
+def _replace_cache_tensors(past_key_values, layers: Sequence[Tuple[torch.Tensor, torch.Tensor]]):
+    """
+    Swap in new per-layer (key, value) tensors. A Cache object is updated
+    in place rather than rebuilt through the legacy tuple format, which
+    would copy every tensor again.
+    """
+    if hasattr(past_key_values, "layers"):
+        for layer, (keys, values) in zip(past_key_values.layers, layers):
+            layer.keys, layer.values = keys, values
+        return past_key_values
+    if hasattr(past_key_values, "key_cache"):
+        past_key_values.key_cache[:] = [keys for keys, _ in layers]
+        past_key_values.value_cache[:] = [values for _, values in layers]
+        return past_key_values
+    return tuple(tuple(layer) for layer in layers)
+
+def _pad_columns(tensor: torch.Tensor, width: int, dim: int) -> torch.Tensor:
+    """Left-pad `tensor` with zeros along `dim` up to `width`."""
+    missing = width - tensor.shape[dim]
+    if missing <= 0:
+        return tensor
+    shape = list(tensor.shape)
+    shape[dim] = missing
+    return torch.cat([tensor.new_zeros(shape), tensor], dim=dim)
+
+def _stack_rows(past_a, mask_a: torch.Tensor, past_b, mask_b: torch.Tensor):
+    """
+    Batch rows of two cache/mask pairs into one. The narrower side is
+    left-padded with masked zero columns; a side without a cache gets
+    zero rows.
+    """
+    width = max(mask_a.shape[1], mask_b.shape[1])
+    mask = torch.cat([_pad_columns(mask_a, width, 1), _pad_columns(mask_b, width, 1)])
+    if past_a is None and past_b is None:
+        return None, mask
+    like = past_a if past_a is not None else past_b
+    layers_a = cache_tensors(past_a) if past_a is not None else None
+    layers_b = cache_tensors(past_b) if past_b is not None else None
+    reference = cache_tensors(like)
+
+    def part(layers, layer, which, rows):
+        if layers is None:
+            ref = reference[layer][which]
+            return ref.new_zeros((rows, ref.shape[1], width, ref.shape[3]))
+        return _pad_columns(layers[layer][which], width, 2)
+
+    merged = [
+        tuple(torch.cat([part(layers_a, layer, which, mask_a.shape[0]),
+                         part(layers_b, layer, which, mask_b.shape[0])]) for which in range(2))
+        for layer in range(len(reference))
+    ]
+    return _replace_cache_tensors(like, merged), mask
+
+class DecodeBatch:
+    """
+    The running state of a batched greedy decode: row objects (TextRow/
+    JsonRow), the KV cache, and each row's attention mask and next position.
+
+    Each step a row feeds back either its predicted token or a chunk of
+    forced tokens; chunks are left-padded within the step, with the pads
+    masked out and skipped by the position ids. Rows can join between steps
+    (continuous batching: a new row's prompt is prefilled in the same
+    forward pass that decodes the running rows) and leave as soon as they
+    finish or are dropped; cache columns no remaining row attends to are
+    trimmed.
+
+    `stats`, if given, accumulates "forward_passes", "decode_tokens" (row
+    steps whose token came from the model) and "forced_tokens".
+
+    A row with an `adapter` attribute is run through that LoRA adapter of
+    a PEFT model (mixed-adapter batch); rows without one use the active
+    adapter.
+
+    With `draft_tokens`, each feed is followed by prompt-lookup drafts
+    (prompt_lookup_draft over the row's tokens so far) and a step can
+    yield several tokens per row; stats then also count "draft_tokens"
+    and "accepted_tokens".
+    """
+
+    def __init__(self, model, pad_token_id: int, stats: Optional[dict] = None, draft_tokens: int = 0,
+                 ngram_size: int = PROMPT_LOOKUP_NGRAM):
+        self.model = model
+        self.pad_token_id = pad_token_id
+        self.stats = stats
+        self.draft_tokens = draft_tokens
+        self.ngram_size = ngram_size
+        self.device = next(model.parameters()).device
+        self._reset()
+
+    def _reset(self) -> None:
+        self.rows: List = []
+        self.feeds: List[List[int]] = []
+        self.history: List[List[int]] = []
+        self.past_key_values = None
+        self.attention_mask = torch.zeros((0, 0), dtype=torch.long, device=self.device)
+        self.next_position = torch.zeros(0, dtype=torch.long, device=self.device)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def _count(self, name: str, amount: int) -> None:
+        if self.stats is not None:
+            self.stats[name] = self.stats.get(name, 0) + amount
+
+    def _adapter_names(self, rows: Sequence) -> Optional[List[str]]:
+        names = [getattr(row, "adapter", None) for row in rows]
+        if not any(names):
+            return None
+        active = getattr(self.model, "active_adapter", None)
+        return [name or active for name in names]
+
+    @torch.no_grad()
+    def add(self, rows: Sequence, prompt_ids: Sequence[Sequence[int]],
+            shared_prefix: Optional[Sequence[int]] = None) -> None:
+        """
+        Add rows; their prompts are prefilled by the next step. With
+        `shared_prefix`, each prompt is the suffix that follows those
+        tokens: the prefix is prefilled now, once at batch size 1, and its
+        cache is repeated for every new row.
+        """
+        count = len(rows)
+        past_key_values = None
+        width = len(shared_prefix) if shared_prefix else 0
+        if width:
+            adapter_kwargs = {}
+            adapter_names = self._adapter_names(rows)
+            if adapter_names:
+                if len(set(adapter_names)) > 1:
+                    raise ValueError("Rows sharing a prefill must use the same adapter")
+                adapter_kwargs["adapter_names"] = adapter_names[:1]
+            prefill = self.model(input_ids=torch.tensor([list(shared_prefix)], device=self.device), use_cache=True,
+                                 **adapter_kwargs)
+            past_key_values = repeat_cache_rows(prefill.past_key_values, count)
+            self._count("forward_passes", 1)
+        mask = torch.ones((count, width), dtype=torch.long, device=self.device)
+        for row, ids in zip(rows, prompt_ids):
+            prefix = row.prefix()
+            self.feeds.append(list(ids) + prefix)
+            self.history.append(list(shared_prefix or []))
+            self._count("forced_tokens", len(prefix))
+
+        self.past_key_values, self.attention_mask = _stack_rows(self.past_key_values, self.attention_mask,
+                                                                past_key_values, mask)
+        self.next_position = torch.cat([self.next_position,
+                                        torch.full((count,), width, dtype=torch.long, device=self.device)])
+        self.rows.extend(rows)
+
+    def _drafts(self) -> List[List[int]]:
+        if not self.draft_tokens:
+            return [[] for _ in self.rows]
+        return [prompt_lookup_draft(history + feed, self.ngram_size, self.draft_tokens)
+                for history, feed in zip(self.history, self.feeds)]
+
+    @torch.no_grad()
+    def step(self) -> List:
+        """Run one forward pass over every row; returns the rows that finished."""
+        drafts = self._drafts()
+        step_ids, step_mask = left_pad([feed + draft for feed, draft in zip(self.feeds, drafts)],
+                                       self.pad_token_id, self.device)
+        position_ids = self.next_position[:, None] + step_mask.cumsum(-1) - 1
+        position_ids.masked_fill_(step_mask == 0, 1)
+        self.attention_mask = torch.cat([self.attention_mask, step_mask], dim=-1)
+
+        adapter_names = self._adapter_names(self.rows)
+        adapter_kwargs = {"adapter_names": adapter_names} if adapter_names else {}
+        outputs = self.model(input_ids=step_ids, attention_mask=self.attention_mask, position_ids=position_ids,
+                             past_key_values=self.past_key_values, use_cache=True, **adapter_kwargs)
+        self.past_key_values = outputs.past_key_values
+        # Greedy predictions after the feed and after each draft token
+        longest = max(len(draft) for draft in drafts)
+        predictions = outputs.logits[:, -(longest + 1):, :].argmax(dim=-1)
+        token_map = output_token_map(self.model)
+        if token_map is not None:
+            predictions = token_map[predictions]
+        predictions = predictions.tolist()
+        self._count("forward_passes", 1)
+
+        keep, finished, advanced = [], [], []
+        for position, (row, draft) in enumerate(zip(self.rows, drafts)):
+            # Walk the predictions while each one is the next draft token, which is then already cached
+            accepted = 0
+            for token in predictions[position][len(predictions[position]) - len(draft) - 1:]:
+                feed = row.step(token)
+                if feed != [token] or accepted == len(draft) or draft[accepted] != token:
+                    break
+                accepted += 1
+            self._count("decode_tokens", accepted + 1)
+            self._count("draft_tokens", len(draft))
+            self._count("accepted_tokens", accepted)
+
+            rejected = len(draft) - accepted
+            if rejected:
+                self.attention_mask[position, -rejected:] = 0
+            self.history[position] += self.feeds[position] + draft[:accepted]
+            advanced.append(len(self.feeds[position]) + accepted)
+            self.feeds[position] = feed
+            if feed:
+                keep.append(position)
+                self._count("forced_tokens", len(feed) - 1)
+            else:
+                finished.append(row)
+        self.next_position = self.next_position + torch.tensor(advanced, dtype=torch.long, device=self.device)
+        self._keep(keep)
+        return finished
+
+    def drop(self, rows: Sequence) -> None:
+        """Remove rows before they finish (e.g. cancelled requests)."""
+        dropped = {id(row) for row in rows}
+        self._keep([i for i, row in enumerate(self.rows) if id(row) not in dropped])
+
+    def _keep(self, keep: List[int]) -> None:
+        if len(keep) == len(self.rows):
+            return
+        if not keep:
+            self._reset()
+            return
+        index = torch.tensor(keep, device=self.device)
+        if self.past_key_values is not None:
+            self.past_key_values = select_cache_rows(self.past_key_values, index)
+        self.attention_mask = self.attention_mask[index]
+        self.next_position = self.next_position[index]
+        self.rows = [self.rows[i] for i in keep]
+        self.feeds = [self.feeds[i] for i in keep]
+        self.history = [self.history[i] for i in keep]
+
+        # Leading columns that no remaining row attends to
+        unused = int((self.attention_mask.sum(0) == 0).long().cumprod(0).sum())
+        if unused and self.past_key_values is not None:
+            # Slices are views; the next step's cache update makes the copy it needs anyway
+            layers = [tuple(tensor[:, :, unused:] for tensor in layer)
+                      for layer in cache_tensors(self.past_key_values)]
+            self.past_key_values = _replace_cache_tensors(self.past_key_values, layers)
+            self.attention_mask = self.attention_mask[:, unused:]
+
+def greedy_decode(model, rows: Sequence, prompt_ids: Sequence[Sequence[int]], pad_token_id: int,
+                  stats: Optional[dict] = None, shared_prefix: Optional[Sequence[int]] = None,
+                  draft_tokens: int = 0) -> List[str]:
+    """
+    Greedy-decode a fixed set of rows to completion with a DecodeBatch and
+    return each row's response. `shared_prefix` is as in DecodeBatch.add.
+    """
+    batch = DecodeBatch(model, pad_token_id, stats, draft_tokens)
+    batch.add(rows, prompt_ids, shared_prefix)
+    while batch:
+        batch.step()
+    return [row.response() for row in rows]
+
+@torch.no_grad()
+def generate_batch(model, tokenizer, pairs: Sequence[Tuple[str, str]], batch_size: int = 16,
+                   max_new_tokens: Optional[int] = None, max_prompt_length: int = 200,
+                   prompt_ids: Optional[List[List[int]]] = None, progress: bool = False,
+                   budgets: Optional[Dict[str, int]] = None, structured_json: bool = False,
+                   stats: Optional[dict] = None, adapters: Optional[Sequence[str]] = None,
+                   draft_tokens: int = 0) -> List[str]:
+    """
+    Greedy responses for (instruction, input) pairs, in input order.
+
+    Each prompt's mode (see prompts.prompt_mode) picks its stop strings and
+    its token budget from `budgets` (default MAX_NEW_TOKENS); a
+    `max_new_tokens` value overrides the budget for every mode.
+    With `structured_json`, JSON prompts decode only the three commands
+    inside a forced scaffold (JsonRow), each within the "single" budget.
+    `prompt_ids` may carry pre-tokenized prompts (e.g. a TokenizedCache in
+    "prompt" mode) to skip tokenization. Free responses go through the
+    same extract_response post-processing as the single-sample path.
+    `adapters` names the LoRA adapter of a PEFT model for each pair, so
+    pairs for different adapters share batches. `draft_tokens` turns on
+    prompt-lookup speculative decoding (same responses, fewer steps).
+    """
+    if prompt_ids is None:
+        prompt_ids = tokenize_prompts(tokenizer, pairs, max_prompt_length)
+    budgets = {**MAX_NEW_TOKENS, **(budgets or {})}
+    eos_ids = eos_token_ids(tokenizer)
+    pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+
+    batches = length_sorted_batches([len(ids) for ids in prompt_ids], batch_size)
+    if progress:
+        from tqdm import tqdm
+        batches = tqdm(batches, desc="Generating", unit="batch")
+
+    responses: List[Optional[str]] = [None] * len(prompt_ids)
+    for batch in batches:
+        rows = [make_row(tokenizer, *pairs[i], budgets, max_new_tokens, structured_json, eos_ids)
+                for i in batch]
+        if adapters is not None:
+            for i, row in zip(batch, rows):
+                row.adapter = adapters[i]
+        texts = greedy_decode(model, rows, [prompt_ids[i] for i in batch], pad_token_id, stats,
+                              draft_tokens=draft_tokens)
+        for index, text in zip(batch, texts):
+            responses[index] = text
+    return responses
+
+def common_prefix_length(sequences: Sequence[Sequence[int]]) -> int:
+    """Length of the token prefix shared by all sequences, leaving each at least one token."""
+    shortest = min(len(ids) for ids in sequences)
+    length = 0
+    while length < shortest - 1 and all(ids[length] == sequences[0][length] for ids in sequences):
+        length += 1
+    return length
+
+@torch.no_grad()
+def generate_fanout(model, tokenizer, instruction: str, inputs: Sequence[str] = OS_TAGS,
+                    max_new_tokens: Optional[int] = None, max_prompt_length: int = 200,
+                    budgets: Optional[Dict[str, int]] = None, structured_json: bool = False,
+                    stats: Optional[dict] = None, draft_tokens: int = 0) -> Dict[str, str]:
+    """
+    Responses for one instruction under several inputs (by default the
+    three OS tags), as {input: response}.
+
+    The prompts differ only after "### Input:", so the shared token prefix
+    (found on the tokenized prompts, so the ids match the one-prompt path)
+    is prefilled once, its KV cache is branched per input, and the suffixes
+    and all decoding run as one batch: about one prefill plus one batched
+    decode instead of one full generate per OS.
+    """
+    pairs = [(instruction, input_text) for input_text in inputs]
+    prompt_ids = tokenize_prompts(tokenizer, pairs, max_prompt_length)
+    shared = common_prefix_length(prompt_ids)
+    budgets = {**MAX_NEW_TOKENS, **(budgets or {})}
+    eos_ids = eos_token_ids(tokenizer)
+    pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+
+    rows = [make_row(tokenizer, instruction, input_text, budgets, max_new_tokens, structured_json, eos_ids)
+            for input_text in inputs]
+    responses = greedy_decode(model, rows, [ids[shared:] for ids in prompt_ids], pad_token_id,
+                              stats, shared_prefix=prompt_ids[0][:shared], draft_tokens=draft_tokens)
+    return dict(zip(inputs, responses))
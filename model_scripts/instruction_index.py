@@ -0,0 +1,256 @@
+"""
+instruction_index.py
+Exact lookup of known instructions, answered without the model.
+
+Much of the traffic repeats instructions from the validated corpus
+(dataset/generated/validated/*.json). build_index() maps each normalized
+instruction to its Linux, Windows and Mac commands, and InstructionIndex
+answers (instruction, input) pairs in any prompt mode:
+- an OS tag ("[LINUX]") returns that OS's command
+- no input and an instruction ending in an OS phrase ("... on macOS")
+  returns that OS's command
+- a JSON request returns the JSON object the model is trained to produce
+Anything else is a miss and goes to the model (answer(), or the caller's
+own fallback).
+
+Normalization collapses whitespace, drops trailing punctuation and
+lowercases only the first letter: commands copy names from the
+instruction verbatim, so "named Projects" and "named projects" stay
+different keys. When corpus entries for one instruction disagree, the
+most common commands are kept with a confidence below 1 (the share of
+entries agreeing), and lookups only serve entries at or above
+`min_confidence`. With verification on, a hit is confirmed against the
+model in one teacher-forced forward pass (the stored response must be the
+model's greedy output), which is still far cheaper than decoding it.
+
+The dataset pipeline rebuilds the index in its "index" stage.
+
+Usage:
+    python instruction_index.py build --validated-dir ../dataset/generated/validated
+    python instruction_index.py lookup "Show disk usage" --input "[MAC]"
+    python instruction_index.py coverage --data ../dataset/generated/processed/test.json
+"""
+
+import argparse
+import json
+import re
+import sys
+import time
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+from prompts import OS_TAGS, prompt_mode, windows_prompt
+
+PREPROCESSING_SCRIPTS_DIR = Path(__file__).resolve().parent.parent / "dataset_preprocessing_scripts"
+sys.path.append(str(PREPROCESSING_SCRIPTS_DIR))
+from utils import iter_records, list_record_files
+
+DEFAULT_VALIDATED_DIR = "../dataset/generated/validated"
+DEFAULT_INDEX_PATH = "../dataset/generated/index/instruction_index.json"
+
+# Index field -> field of a validated entry
+FIELDS = {"linux": "linux", "windows": "windows_cmd", "mac": "mac"}
+TAG_FIELDS = {tag: tag.strip("[]").lower() for tag in OS_TAGS}
+
+# The OS phrasings convert_to_alpaca appends for instructions without an OS tag
+_OS_SUFFIX = re.compile(r"\s+(?:on|in|using|for)\s+(linux|windows(?:\s+cmd)?|mac(?:os)?(?:\s+terminal)?)$",
+                        re.IGNORECASE)
+
+def normalize_instruction(text: str) -> str:
+    """Collapse whitespace, drop trailing punctuation, lowercase the first letter only."""
+    text = " ".join(text.split()).rstrip(".!?").rstrip()
+    return text[:1].lower() + text[1:]
+
+def _iter_entries(validated_dir: Union[str, Path]) -> Iterator[dict]:
+    # list_record_files skips hidden files such as validate_data's .validation_cache.json
+    for path in list_record_files(validated_dir):
+        if "_issues" not in path.name:
+            yield from iter_records(path)
+
+def build_index(validated_dir: Union[str, Path] = DEFAULT_VALIDATED_DIR) -> Dict[str, dict]:
+    """{normalized instruction: {"linux", "windows", "mac", "count", "confidence"}} from the validated corpus."""
+    votes: Dict[str, Counter] = defaultdict(Counter)
+    for entry in _iter_entries(validated_dir):
+        if not entry.get("instruction") or any(not entry.get(field) for field in FIELDS.values()):
+            continue
+        votes[normalize_instruction(entry["instruction"])][tuple(entry[field] for field in FIELDS.values())] += 1
+
+    entries = {}
+    for key, counter in votes.items():
+        commands, agreeing = counter.most_common(1)[0]
+        total = sum(counter.values())
+        entries[key] = {**dict(zip(FIELDS, commands)), "count": total, "confidence": round(agreeing / total, 4)}
+    return entries
+
+def verify_response(model, tokenizer, instruction: str, input_text: str, response: str) -> bool:
+    """
+    True when `response` is the model's greedy output for the prompt: one
+    forward pass over prompt + response checks every next-token
+    prediction and that the model stops right after. Tokenizing the
+    response on its own can split it differently from decoding, so this
+    can reject a response the model would produce, never the reverse.
+    """
+    import torch
+    from generation import eos_token_ids, output_token_map, stop_index, tokenize_prompts
+
+    prompt_ids = tokenize_prompts(tokenizer, [(instruction, input_text)])[0]
+    response_ids = tokenizer(response, add_special_tokens=False)["input_ids"]
+    ids = torch.tensor([prompt_ids + response_ids], device=next(model.parameters()).device)
+    with torch.no_grad():
+        predicted = model(input_ids=ids).logits[0, len(prompt_ids) - 1:].argmax(dim=-1)
+    token_map = output_token_map(model)
+    predicted = (token_map[predicted] if token_map is not None else predicted).tolist()
+    if predicted[:-1] != response_ids:
+        return False
+    last = predicted[-1]
+    return (last in eos_token_ids(tokenizer)
+            or stop_index(response + tokenizer.decode([last]), prompt_mode(input_text),
+                          not windows_prompt(instruction, input_text)) is not None)
+
+class InstructionIndex:
+    """
+    Lookup over a build_index() mapping. Counters: lookups, hits, misses,
+    low_confidence (found but below `min_confidence`, also counted as
+    misses), verified and verify_rejected.
+    """
+
+    def __init__(self, entries: Dict[str, dict], min_confidence: float = 1.0):
+        self.entries = entries
+        self.min_confidence = min_confidence
+        self.counters = {"lookups": 0, "hits": 0, "misses": 0, "low_confidence": 0,
+                         "verified": 0, "verify_rejected": 0}
+        self.lookup_ns = 0
+
+    @classmethod
+    def build(cls, validated_dir: Union[str, Path] = DEFAULT_VALIDATED_DIR,
+              min_confidence: float = 1.0) -> "InstructionIndex":
+        return cls(build_index(validated_dir), min_confidence)
+
+    @classmethod
+    def load(cls, path: Union[str, Path] = DEFAULT_INDEX_PATH, min_confidence: float = 1.0) -> "InstructionIndex":
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls(json.load(f)["entries"], min_confidence)
+
+    def save(self, path: Union[str, Path] = DEFAULT_INDEX_PATH) -> Path:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({"entries": self.entries}, f, indent=2, ensure_ascii=False)
+        return path
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def _resolve(self, instruction: str, input_text: str) -> Tuple[Optional[dict], Optional[str]]:
+        """The entry and the field to answer with (None for the JSON object)."""
+        mode = prompt_mode(input_text)
+        key = normalize_instruction(instruction)
+        if mode == "single":
+            return self.entries.get(key), next(TAG_FIELDS[tag] for tag in OS_TAGS if tag in input_text)
+        if mode == "json":
+            return self.entries.get(key), None
+        match = _OS_SUFFIX.search(key)
+        if input_text.strip() or match is None:
+            return None, None
+        os_name = match.group(1).lower()
+        field = "linux" if os_name.startswith("linux") else "windows" if os_name.startswith("windows") else "mac"
+        return self.entries.get(key[:match.start()]), field
+
+    def lookup(self, instruction: str, input_text: str = "") -> Optional[str]:
+        """The known response for the pair, or None on a miss."""
+        start = time.perf_counter_ns()
+        self.counters["lookups"] += 1
+        entry, field = self._resolve(instruction, input_text)
+        response = None
+        if entry is not None and entry["confidence"] < self.min_confidence:
+            self.counters["low_confidence"] += 1
+        elif entry is not None:
+            response = entry[field] if field else json.dumps(
+                {"description": instruction, **{name: entry[name] for name in FIELDS}}, ensure_ascii=False)
+        self.counters["hits" if response is not None else "misses"] += 1
+        self.lookup_ns += time.perf_counter_ns() - start
+        return response
+
+    def verify(self, model, tokenizer, instruction: str, input_text: str, response: str) -> bool:
+        """verify_response, counted in the verified / verify_rejected counters."""
+        ok = verify_response(model, tokenizer, instruction, input_text, response)
+        self.counters["verified" if ok else "verify_rejected"] += 1
+        return ok
+
+    def answer(self, model, tokenizer, pairs: Sequence[Tuple[str, str]], verify: bool = False,
+               generate=None, **generation_kwargs) -> List[str]:
+        """
+        Responses for (instruction, input) pairs: index hits (confirmed by
+        the model when `verify`) directly, the rest through `generate`
+        (default generation.generate_batch; e.g. ResponseCache.generate)
+        in one call with `generation_kwargs`.
+        """
+        responses = [self.lookup(instruction, input_text) for instruction, input_text in pairs]
+        if verify:
+            responses = [response if response is None or self.verify(model, tokenizer, *pair, response) else None
+                         for pair, response in zip(pairs, responses)]
+        missing = [i for i, response in enumerate(responses) if response is None]
+        if missing:
+            if generate is None:
+                from generation import generate_batch as generate
+            generated = generate(model, tokenizer, [pairs[i] for i in missing], **generation_kwargs)
+            for i, response in zip(missing, generated):
+                responses[i] = response
+        return responses
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.counters["lookups"]
+        return {
+            **self.counters,
+            "entries": len(self.entries),
+            "hit_rate": self.counters["hits"] / lookups if lookups else 0.0,
+            "mean_lookup_us": self.lookup_ns / lookups / 1000 if lookups else 0.0,
+        }
+
+def coverage(index: InstructionIndex, samples: Sequence[dict]) -> dict:
+    """Hit rate of the index on Alpaca samples and how many hits equal the reference output."""
+    correct = 0
+    for sample in samples:
+        response = index.lookup(sample["instruction"], sample["input"])
+        correct += response is not None and response.strip() == sample["output"].strip()
+    return {**index.stats(), "hits_matching_output": correct,
+            "hit_accuracy": correct / index.counters["hits"] if index.counters["hits"] else 0.0}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build and query the instruction lookup index.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = commands.add_parser("build", help="Rebuild the index from the validated corpus")
+    build_parser.add_argument("--validated-dir", default=DEFAULT_VALIDATED_DIR)
+    build_parser.add_argument("--output", default=DEFAULT_INDEX_PATH)
+
+    lookup_parser = commands.add_parser("lookup", help="Answer one instruction from the index")
+    lookup_parser.add_argument("instruction")
+    lookup_parser.add_argument("--input", default="")
+    lookup_parser.add_argument("--index", default=DEFAULT_INDEX_PATH)
+    lookup_parser.add_argument("--min-confidence", type=float, default=1.0)
+
+    coverage_parser = commands.add_parser("coverage", help="Hit rate and accuracy on an Alpaca split")
+    coverage_parser.add_argument("--data", default="../dataset/generated/processed/test.json")
+    coverage_parser.add_argument("--index", default=DEFAULT_INDEX_PATH)
+    coverage_parser.add_argument("--min-confidence", type=float, default=1.0)
+
+    args = parser.parse_args(argv)
+    if args.command == "build":
+        index = InstructionIndex.build(args.validated_dir)
+        path = index.save(args.output)
+        uncertain = sum(entry["confidence"] < 1 for entry in index.entries.values())
+        print(f"✅ Indexed {len(index)} instructions ({uncertain} with conflicting commands) to: {path}")
+    elif args.command == "lookup":
+        index = InstructionIndex.load(args.index, args.min_confidence)
+        response = index.lookup(args.instruction, args.input)
+        print(response if response is not None else "❌ Not in the index")
+    else:
+        index = InstructionIndex.load(args.index, args.min_confidence)
+        with open(args.data, 'r', encoding='utf-8') as f:
+            samples = json.load(f)
+        print(json.dumps(coverage(index, samples), indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+"""
+merged_export.py
+Export LoRA adapters folded into the base weights, and load the export
+memory-mapped.
+
+The "merged" model saved by the training notebook and published to the
+merged repo actually holds LoRA adapters, so loading it means building the
+base model, attaching PEFT and paying the adapter matmuls on every forward
+pass. export_merged() loads the base in full precision, folds the adapters
+in with merge_and_unload() and writes plain safetensors shards plus the
+tokenizer and an export_info.json.
+
+load_mmap_model() builds the model skeleton without allocating weights
+(accelerate.init_empty_weights) and assigns tensors that are views of
+private mmaps of the shards, so start-up does no weight copies and pages
+are read on first use (and shared through the page cache between
+processes).
+
+Subcommands:
+    python merged_export.py export --adapters ../outputs/lora_adapters --output ../outputs/merged_model
+    python merged_export.py verify --adapters ../outputs/lora_adapters --merged ../outputs/merged_model
+    python merged_export.py bench  --adapters ../outputs/lora_adapters --merged ../outputs/merged_model
+"""
+
+import argparse
+import json
+import mmap
+import resource
+import struct
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, Optional, Union
+
+import torch
+
+from generation import generate_batch
+
+DEFAULT_BASE_MODEL = "Qwen/Qwen3-0.6B"
+EXPORT_INFO = "export_info.json"
+
+SAFETENSORS_DTYPES = {
+    "F64": torch.float64, "F32": torch.float32, "F16": torch.float16, "BF16": torch.bfloat16,
+    "I64": torch.int64, "I32": torch.int32, "I16": torch.int16, "I8": torch.int8,
+    "U8": torch.uint8, "BOOL": torch.bool,
+}
+
+def _adapter_base(adapter_path: Union[str, Path], base_model: Optional[str]) -> str:
+    from peft import PeftConfig
+    return base_model or PeftConfig.from_pretrained(str(adapter_path)).base_model_name_or_path or DEFAULT_BASE_MODEL
+
+def load_adapter_model(adapter_path: Union[str, Path], base_model: Optional[str] = None,
+                       dtype: torch.dtype = torch.float32):
+    """The current path: full-precision base model with the PEFT adapters attached."""
+    from peft import PeftModel
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(adapter_path, trust_remote_code=True)
+    base = AutoModelForCausalLM.from_pretrained(_adapter_base(adapter_path, base_model), torch_dtype=dtype,
+                                                trust_remote_code=True)
+    model = PeftModel.from_pretrained(base, str(adapter_path))
+    model.eval()
+    return model, tokenizer
+
+def export_merged(adapter_path: Union[str, Path], output_dir: Union[str, Path], base_model: Optional[str] = None,
+                  dtype: str = "float32", max_shard_size: str = "500MB") -> Path:
+    """
+    Fold the adapters into the base weights and save safetensors shards,
+    the tokenizer and export_info.json to `output_dir`. Merging happens in
+    `dtype`; float32 keeps outputs identical to the float32 adapter path.
+    """
+    model, tokenizer = load_adapter_model(adapter_path, base_model, getattr(torch, dtype))
+    merged = model.merge_and_unload()
+
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    for stale in output_dir.glob("*.safetensors"):
+        stale.unlink()
+    merged.save_pretrained(output_dir, safe_serialization=True, max_shard_size=max_shard_size)
+    tokenizer.save_pretrained(output_dir)
+    with open(output_dir / EXPORT_INFO, 'w', encoding='utf-8') as f:
+        json.dump({
+            "adapters": str(adapter_path),
+            "base_model": _adapter_base(adapter_path, base_model),
+            "dtype": dtype,
+            "shards": sorted(p.name for p in output_dir.glob("*.safetensors")),
+        }, f, indent=2)
+    return output_dir
+
+def mmap_safetensors(path: Union[str, Path]) -> Dict[str, torch.Tensor]:
+    """
+    Tensors of a safetensors file as views of a private (copy-on-write)
+    mmap: nothing is read until a tensor is touched. Tensors whose offset
+    is not aligned to their element size are copied.
+    """
+    with open(path, 'rb') as f:
+        header_length = struct.unpack("<Q", f.read(8))[0]
+        header = json.loads(f.read(header_length))
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    data = torch.frombuffer(mapped, dtype=torch.uint8)
+    start_of_data = 8 + header_length
+
+    tensors = {}
+    for name, info in header.items():
+        if name == "__metadata__":
+            continue
+        begin, end = info["data_offsets"]
+        chunk = data[start_of_data + begin:start_of_data + end]
+        dtype = SAFETENSORS_DTYPES[info["dtype"]]
+        try:
+            tensor = chunk.view(dtype)
+        except RuntimeError:
+            tensor = chunk.clone().view(dtype)
+        tensors[name] = tensor.view(info["shape"])
+    return tensors
+
+def load_mmap_model(model_dir: Union[str, Path]):
+    """Model and tokenizer from an export, with weights memory-mapped from its shards."""
+    from accelerate import init_empty_weights
+    from transformers import AutoConfig, AutoModelForCausalLM, AutoTokenizer
+
+    model_dir = Path(model_dir)
+    config = AutoConfig.from_pretrained(model_dir, trust_remote_code=True)
+    with init_empty_weights():
+        model = AutoModelForCausalLM.from_config(config, trust_remote_code=True)
+
+    state = {}
+    for shard in sorted(model_dir.glob("*.safetensors")):
+        state.update(mmap_safetensors(shard))
+    model.load_state_dict(state, strict=False, assign=True)
+    model.tie_weights()
+    missing = [name for name, param in model.named_parameters() if param.is_meta]
+    if missing:
+        raise ValueError(f"{model_dir} is missing weights: {missing[:5]}")
+
+    model.eval()
+    tokenizer = AutoTokenizer.from_pretrained(model_dir, trust_remote_code=True)
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    return model, tokenizer
+
+def verify_export(adapter_path: Union[str, Path], merged_dir: Union[str, Path], test_data: str,
+                  base_model: Optional[str] = None, limit: Optional[int] = 200, batch_size: int = 16) -> dict:
+    """Greedy outputs of the export against the float32 adapter path on the test split."""
+    with open(test_data, 'r', encoding='utf-8') as f:
+        samples = json.load(f)[:limit]
+    pairs = [(sample["instruction"], sample["input"]) for sample in samples]
+
+    model, tokenizer = load_adapter_model(adapter_path, base_model)
+    reference = generate_batch(model, tokenizer, pairs, batch_size=batch_size)
+    del model
+    model, tokenizer = load_mmap_model(merged_dir)
+    exported = generate_batch(model, tokenizer, pairs, batch_size=batch_size)
+
+    mismatches = [{"instruction": pair[0], "input": pair[1], "adapter": a, "merged": b}
+                  for pair, a, b in zip(pairs, reference, exported) if a != b]
+    return {"samples": len(pairs), "identical": len(pairs) - len(mismatches), "mismatches": mismatches}
+
+def _probe(kind: str, path: str, base_model: Optional[str]) -> dict:
+    """Runs in a fresh process: load time, time to the first response, decode speed, peak RSS."""
+    start = time.perf_counter()
+    if kind == "merged":
+        model, tokenizer = load_mmap_model(path)
+    else:
+        model, tokenizer = load_adapter_model(path, base_model)
+    loaded = time.perf_counter()
+    generate_batch(model, tokenizer, [("List all files including hidden ones", "[LINUX]")])
+    first = time.perf_counter()
+
+    stats = {}
+    pairs = [("Show disk usage", "[MAC]"), ("Create a new folder named projects", "[WINDOWS]")] * 8
+    decode_start = time.perf_counter()
+    generate_batch(model, tokenizer, pairs, batch_size=len(pairs), max_new_tokens=32, stats=stats)
+    decode_seconds = time.perf_counter() - decode_start
+    return {
+        "load_seconds": round(loaded - start, 3),
+        "first_response_seconds": round(first - start, 3),
+        "ms_per_forward": round(1000 * decode_seconds / max(stats.get("forward_passes", 1), 1), 2),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+def benchmark(adapter_path: str, merged_dir: str, base_model: Optional[str] = None) -> dict:
+    """Cold start and peak RSS of both loaders, each measured in its own process."""
+    report = {}
+    for kind, path in (("adapter", adapter_path), ("merged", merged_dir)):
+        command = [sys.executable, __file__, "_probe", "--kind", kind, "--path", path]
+        if base_model:
+            command += ["--base-model", base_model]
+        output = subprocess.run(command, check=True, capture_output=True, text=True,
+                                cwd=Path(__file__).resolve().parent).stdout
+        report[kind] = json.loads(output.strip().splitlines()[-1])
+        print(f"{kind:>8}: {report[kind]}")
+    return report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export merged weights and load them memory-mapped.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = commands.add_parser("export", help="Fold adapters into the base weights")
+    export_parser.add_argument("--adapters", default="../outputs/lora_adapters")
+    export_parser.add_argument("--output", default="../outputs/merged_model")
+    export_parser.add_argument("--base-model", default=None)
+    export_parser.add_argument("--dtype", default="float32", choices=["float32", "bfloat16", "float16"])
+    export_parser.add_argument("--max-shard-size", default="500MB")
+
+    for name, help_text in (("verify", "Compare export and adapter outputs on the test split"),
+                            ("bench", "Cold start and peak RSS of both loaders")):
+        sub = commands.add_parser(name, help=help_text)
+        sub.add_argument("--adapters", default="../outputs/lora_adapters")
+        sub.add_argument("--merged", default="../outputs/merged_model")
+        sub.add_argument("--base-model", default=None)
+        if name == "verify":
+            sub.add_argument("--test-data", default="../dataset/generated/processed/test.json")
+            sub.add_argument("--limit", type=int, default=200)
+
+    probe_parser = commands.add_parser("_probe")
+    probe_parser.add_argument("--kind", choices=["adapter", "merged"], required=True)
+    probe_parser.add_argument("--path", required=True)
+    probe_parser.add_argument("--base-model", default=None)
+
+    args = parser.parse_args(argv)
+    if args.command == "export":
+        output = export_merged(args.adapters, args.output, args.base_model, args.dtype, args.max_shard_size)
+        print(f"✅ Merged weights exported to: {output}")
+    elif args.command == "verify":
+        result = verify_export(args.adapters, args.merged, args.test_data, args.base_model, args.limit)
+        print(f"Identical outputs: {result['identical']}/{result['samples']}")
+        for mismatch in result["mismatches"][:10]:
+            print(f"   ✗ {mismatch}")
+        sys.exit(0 if not result["mismatches"] else 1)
+    elif args.command == "bench":
+        print(json.dumps(benchmark(args.adapters, args.merged, args.base_model), indent=2))
+    else:
+        print(json.dumps(_probe(args.kind, args.path, args.base_model)))
+
+if __name__ == "__main__":
+    main()
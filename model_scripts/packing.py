@@ -0,0 +1,275 @@
+"""
+packing.py
+Sequence packing and length-grouped batching for training.
+
+Most examples are a few dozen tokens, so padding every one to
+max_seq_length spends most of each step on pad tokens. Two alternatives,
+both built on a TokenizedCache (see token_cache.py):
+
+- Packing: PackedDataset concatenates whole examples into rows of up to
+  max_length tokens. position_ids restart at 0 for every example, so the
+  model keeps attention inside example boundaries. transformers derives
+  the per-example mask from the position_ids when no attention_mask is
+  passed (sdpa/eager since 4.53; flash_attention_2 uses them directly).
+  Labels are -100 on prompt and pad tokens.
+- Length grouping (fallback for older transformers, see
+  packing_supported()): LengthGroupedTrainer batches examples of similar
+  length, and DataCollatorForSeq2Seq pads each batch only to its longest
+  member.
+
+compare_throughput() times the same number of training steps under the
+original max-length padding and both alternatives.
+"""
+
+import random
+import time
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import torch
+from torch.utils.data import Sampler
+from transformers import DataCollatorForSeq2Seq, Trainer
+
+IGNORE_INDEX = -100
+# First transformers release that derives per-example masks from position_ids
+PACKING_MIN_TRANSFORMERS = "4.53.0"
+
+def packing_supported() -> bool:
+    """
+    True when the installed transformers keeps packed examples apart.
+    Older releases build a plain causal mask over the whole row, so
+    examples in one pack would silently attend to each other.
+    """
+    import transformers
+    from packaging import version
+    return version.parse(transformers.__version__) >= version.parse(PACKING_MIN_TRANSFORMERS)
+
+def pack_bins(lengths: Sequence[int], max_length: int) -> List[List[int]]:
+    """
+    Group example indices into bins of at most max_length tokens with
+    first-fit decreasing. Deterministic for a given lengths array.
+
+    A max segment tree over the free space of every possible bin (at most
+    one per example, unopened bins hold max_length) finds the leftmost bin
+    with room in O(log n), so packing is O(n log n) rather than a scan of
+    the open bins per example.
+    """
+    order = sorted(range(len(lengths)), key=lambda i: (-lengths[i], i))
+    size = 1
+    while size < max(len(order), 1):
+        size *= 2
+    free = [max_length] * (2 * size)
+    bins: List[List[int]] = []
+    for index in order:
+        length = min(int(lengths[index]), max_length)
+        node = 1
+        while node < size:
+            node = 2 * node if free[2 * node] >= length else 2 * node + 1
+        b = node - size
+        if b == len(bins):
+            bins.append([])
+        bins[b].append(index)
+        free[node] -= length
+        node //= 2
+        while node:
+            free[node] = max(free[2 * node], free[2 * node + 1])
+            node //= 2
+    return bins
+
+class PackedDataset:
+    """Rows of several whole examples each, with restarting position_ids."""
+
+    def __init__(self, cache, max_length: int):
+        self.cache = cache
+        self.max_length = max_length
+        self.bins = pack_bins(cache.lengths, max_length)
+
+    def __len__(self) -> int:
+        return len(self.bins)
+
+    def __getitem__(self, index: int) -> Dict[str, List[int]]:
+        input_ids, labels, position_ids = [], [], []
+        for example in self.bins[index]:
+            views = self.cache.views(example)
+            ids = views["input_ids"][:self.max_length]
+            mask = views["label_mask"][:self.max_length]
+            input_ids.extend(ids.tolist())
+            labels.extend(np.where(mask == 1, ids, IGNORE_INDEX).tolist())
+            position_ids.extend(range(len(ids)))
+        return {"input_ids": input_ids, "labels": labels, "position_ids": position_ids}
+
+    @property
+    def efficiency(self) -> float:
+        """Share of packed row capacity holding real tokens."""
+        return float(self.cache.lengths.sum()) / (len(self.bins) * self.max_length)
+
+class PackedCollator:
+    """
+    Pad packed rows to the longest row in the batch.
+
+    The padding is given its own restarting position_ids so it forms a
+    separate segment that no real token attends to. No attention_mask is
+    returned and use_cache is off: transformers only reads the segments
+    from position_ids when there is neither a mask nor a KV cache.
+    """
+
+    def __init__(self, pad_token_id: int, pad_to_multiple_of: Optional[int] = None):
+        self.pad_token_id = pad_token_id
+        self.pad_to_multiple_of = pad_to_multiple_of
+
+    def __call__(self, features: List[dict]) -> Dict[str, torch.Tensor]:
+        width = max(len(f["input_ids"]) for f in features)
+        if self.pad_to_multiple_of:
+            width = -(-width // self.pad_to_multiple_of) * self.pad_to_multiple_of
+        batch = {"input_ids": [], "labels": [], "position_ids": []}
+        for f in features:
+            pad = width - len(f["input_ids"])
+            batch["input_ids"].append(f["input_ids"] + [self.pad_token_id] * pad)
+            batch["labels"].append(f["labels"] + [IGNORE_INDEX] * pad)
+            batch["position_ids"].append(f["position_ids"] + list(range(pad)))
+        batch = {name: torch.tensor(rows, dtype=torch.long) for name, rows in batch.items()}
+        batch["use_cache"] = False
+        return batch
+
+def length_grouped_indices(lengths: Sequence[int], batch_size: int, seed: int = 42,
+                           megabatch_mult: int = 50) -> List[int]:
+    """
+    Shuffle, cut into megabatches of batch_size * megabatch_mult, sort each
+    megabatch by length, then shuffle the resulting batches. Batches hold
+    similar lengths while the epoch order stays random.
+    """
+    rng = random.Random(seed)
+    indices = list(range(len(lengths)))
+    rng.shuffle(indices)
+    megabatch = batch_size * megabatch_mult
+    batches = []
+    for start in range(0, len(indices), megabatch):
+        chunk = sorted(indices[start:start + megabatch], key=lambda i: -lengths[i])
+        batches.extend(chunk[i:i + batch_size] for i in range(0, len(chunk), batch_size))
+    rng.shuffle(batches)
+    return [i for batch in batches for i in batch]
+
+class LengthGroupedSampler(Sampler):
+    """Sampler over length_grouped_indices, reshuffled every epoch."""
+
+    def __init__(self, lengths: Sequence[int], batch_size: int, seed: int = 42):
+        self.lengths = lengths
+        self.batch_size = batch_size
+        self.seed = seed
+        self.epoch = 0
+
+    def __len__(self) -> int:
+        return len(self.lengths)
+
+    def __iter__(self):
+        indices = length_grouped_indices(self.lengths, self.batch_size, self.seed + self.epoch)
+        self.epoch += 1
+        return iter(indices)
+
+class LengthGroupedTrainer(Trainer):
+    """
+    Trainer that batches by length using the cache's precomputed lengths
+    (the built-in group_by_length would tokenize-scan the dataset instead).
+    """
+
+    def _get_train_sampler(self, *args, **kwargs):
+        return LengthGroupedSampler(self.train_dataset.lengths, self.args.per_device_train_batch_size,
+                                    seed=self.args.seed)
+
+class MaxLengthCollator:
+    """The original pipeline's batches: pad to max_length, labels copy input_ids (pads included)."""
+
+    def __init__(self, pad_token_id: int, max_length: int):
+        self.pad_token_id = pad_token_id
+        self.max_length = max_length
+
+    def __call__(self, features: List[dict]) -> Dict[str, torch.Tensor]:
+        input_ids, attention_mask = [], []
+        for f in features:
+            ids = f["input_ids"][:self.max_length]
+            pad = self.max_length - len(ids)
+            input_ids.append(ids + [self.pad_token_id] * pad)
+            attention_mask.append([1] * len(ids) + [0] * pad)
+        input_ids = torch.tensor(input_ids, dtype=torch.long)
+        return {"input_ids": input_ids, "attention_mask": torch.tensor(attention_mask),
+                "labels": input_ids.clone()}
+
+def _batches(dataset, order: Sequence[int], batch_size: int, collator, max_length: int):
+    """Yield (collated batch, real token count) pairs."""
+    for start in range(0, len(order), batch_size):
+        features = [dataset[i] for i in order[start:start + batch_size]]
+        real_tokens = sum(min(len(f["input_ids"]), max_length) for f in features)
+        yield collator(features), real_tokens
+
+def compare_throughput(model, tokenizer, cache, max_length: int = 256, batch_size: int = 2,
+                       steps: int = 20, warmup: int = 3, seed: int = 42) -> Dict[str, dict]:
+    """
+    Time forward+backward passes under each batching strategy and report
+    real (non-pad) tokens per second. The optimizer is not stepped, so the
+    model is left unchanged apart from its gradients, which are cleared.
+
+    Strategies:
+      max_length  - pad every example to max_length (the original collator)
+      grouped     - length-grouped batches with dynamic padding, masked labels
+      packed      - packed rows with per-example position_ids, masked labels
+                    (skipped when packing_supported() is False)
+    """
+    mask_prompt, cache.mask_prompt = cache.mask_prompt, True
+    pad_id = tokenizer.pad_token_id
+    rng = random.Random(seed)
+    packed = PackedDataset(cache, max_length)
+
+    random_order = list(range(len(cache)))
+    rng.shuffle(random_order)
+    packed_order = list(range(len(packed)))
+    rng.shuffle(packed_order)
+
+    strategies = {
+        "max_length": (cache, random_order, MaxLengthCollator(pad_id, max_length)),
+        "grouped": (cache, length_grouped_indices(cache.lengths, batch_size, seed),
+                    DataCollatorForSeq2Seq(tokenizer=tokenizer, padding=True, return_tensors="pt")),
+    }
+    if packing_supported():
+        strategies["packed"] = (packed, packed_order, PackedCollator(pad_id))
+
+    device = next(model.parameters()).device
+    was_training = model.training
+    model.train()
+    report = {}
+
+    for name, (dataset, order, collator) in strategies.items():
+        real_tokens = computed_tokens = 0
+        elapsed = 0.0
+        for step, (batch, batch_tokens) in enumerate(_batches(dataset, order, batch_size, collator, max_length)):
+            if step == warmup + steps:
+                break
+            batch = {k: v.to(device) if torch.is_tensor(v) else v for k, v in batch.items()}
+            if device.type == "cuda":
+                torch.cuda.synchronize()
+            started = time.perf_counter()
+            loss = model(**batch).loss
+            loss.backward()
+            if device.type == "cuda":
+                torch.cuda.synchronize()
+            model.zero_grad(set_to_none=True)
+            if step < warmup:
+                continue
+            elapsed += time.perf_counter() - started
+            real_tokens += batch_tokens
+            computed_tokens += batch["input_ids"].numel()
+
+        report[name] = {
+            "tokens_per_sec": real_tokens / elapsed if elapsed else 0.0,
+            "padding_fraction": 1 - real_tokens / computed_tokens if computed_tokens else 0.0,
+            "seconds": elapsed,
+        }
+
+    baseline = report["max_length"]["tokens_per_sec"] or 1.0
+    for name, row in report.items():
+        row["speedup"] = row["tokens_per_sec"] / baseline
+        print(f"{name:<12} {row['tokens_per_sec']:>10.0f} real tok/s  "
+              f"padding {100 * row['padding_fraction']:5.1f}%  x{row['speedup']:.2f}")
+
+    model.train(was_training)
+    cache.mask_prompt = mask_prompt
+    return report
@@ -0,0 +1,50 @@
+"""
+prompts.py
+The Alpaca-style prompt template shared by training, evaluation and inference.
+"""
+
+import hashlib
+import inspect
+import re
+
+RESPONSE_MARKER = "### Response:"
+OS_TAGS = ("[LINUX]", "[WINDOWS]", "[MAC]")
+_OS_NAMES = re.compile(r"\b(linux|windows|mac(?:os)?)\b", re.IGNORECASE)
+
+def build_prompt(instruction: str, input_text: str = "") -> str:
+    """Prompt up to and including the response header (what generation sees)."""
+    if input_text:
+        return f"### Instruction:\n{instruction}\n\n### Input:\n{input_text}\n\n### Response:\n"
+    return f"### Instruction:\n{instruction}\n\n### Response:\n"
+
+def format_instruction(sample: dict, eos_token: str) -> str:
+    """Full training text: prompt, target output and EOS token."""
+    return build_prompt(sample["instruction"], sample.get("input", "")) + sample["output"] + eos_token
+
+def prompt_mode(input_text: str = "") -> str:
+    """"json" for all-OS requests, "single" for an OS tag, else "implicit" (OS named in the instruction)."""
+    if any(tag in input_text for tag in OS_TAGS):
+        return "single"
+    return "json" if "JSON" in input_text else "implicit"
+
+def windows_prompt(instruction: str, input_text: str = "") -> bool:
+    """
+    True when the response is a Windows command: the [WINDOWS] tag, or no
+    tag and Windows is the last OS the instruction names.
+    """
+    mode = prompt_mode(input_text)
+    if mode == "single":
+        return "[WINDOWS]" in input_text
+    names = _OS_NAMES.findall(instruction) if mode == "implicit" else []
+    return bool(names) and names[-1].lower() == "windows"
+
+def extract_response(text: str) -> str:
+    """Cut a decoded generation down to the first response."""
+    if RESPONSE_MARKER in text:
+        text = text.split(RESPONSE_MARKER)[-1].strip()
+    return text.split("### ")[0].strip()
+
+def template_fingerprint() -> str:
+    """Hash of the template source, so caches notice template edits."""
+    source = inspect.getsource(build_prompt) + inspect.getsource(format_instruction)
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()[:16]
@@ -0,0 +1,233 @@
+"""
+pruned_head.py
+Output head restricted to the tokens commands are made of.
+
+Qwen3-0.6B projects every hidden state onto ~151k vocabulary rows, a large
+share of a CPU decode step, while the responses (commands, flags, paths,
+JSON punctuation) use a small fraction of the vocabulary. build_token_set()
+collects the tokens of the training outputs plus a safety margin:
+- the tokens of the training instructions (names copied into commands)
+- every single-character printable ASCII token, so any string can still
+  be spelled out
+- EOS and the stop strings ("\\n", "###")
+
+enable_pruned_head() swaps the model's lm_head for a PrunedHead holding
+only those rows; the model then returns logits over the subset and
+DecodeBatch maps the argmax back to full token ids through the head's
+`token_ids`. disable_pruned_head() (or leaving the pruned_head() context)
+restores the full head. Greedy output changes only where the full-vocab
+argmax falls outside the subset; compare_heads() measures how often, and
+the speedup per decode step.
+
+Usage:
+    python pruned_head.py build --train-data ../dataset/generated/processed/train.json
+    python pruned_head.py bench --model ../outputs/lora_adapters --precision int8
+"""
+
+import argparse
+import hashlib
+import json
+import string
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, List, Sequence, Union
+
+import torch
+
+from cpu_inference import PRECISIONS, configure_threads, exact_match, load_cpu_model
+from generation import SECTION_STOP, eos_token_ids, generate_batch
+from token_cache import tokenizer_fingerprint
+
+DEFAULT_TOKEN_SET_PATH = "../outputs/pruned_vocab.json"
+
+def _encode(tokenizer, text: str) -> List[int]:
+    return tokenizer(text, add_special_tokens=False)["input_ids"]
+
+def build_token_set(tokenizer, samples: Iterable[dict], include_instructions: bool = True) -> List[int]:
+    """Sorted token ids of the sample outputs plus the safety margin described above."""
+    token_ids = set(eos_token_ids(tokenizer))
+    for text in ("\n", "\n\n", SECTION_STOP, "\n" + SECTION_STOP):
+        token_ids.update(_encode(tokenizer, text))
+    for char in string.printable:
+        token_ids.update(_encode(tokenizer, char))
+    for sample in samples:
+        token_ids.update(_encode(tokenizer, sample["output"]))
+        if include_instructions:
+            token_ids.update(_encode(tokenizer, sample["instruction"]))
+    return sorted(token_ids)
+
+def save_token_set(token_ids: Sequence[int], tokenizer, path: Union[str, Path] = DEFAULT_TOKEN_SET_PATH) -> Path:
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({"tokenizer": tokenizer_fingerprint(tokenizer), "vocab_size": len(tokenizer),
+                   "token_ids": list(token_ids)}, f)
+    return path
+
+def load_token_set(tokenizer, path: Union[str, Path] = DEFAULT_TOKEN_SET_PATH) -> List[int]:
+    """Token ids saved by save_token_set; refuses a set built for another tokenizer."""
+    with open(path, 'r', encoding='utf-8') as f:
+        saved = json.load(f)
+    if saved["tokenizer"] != tokenizer_fingerprint(tokenizer):
+        raise ValueError(f"{path} was built for a different tokenizer; rebuild it")
+    return saved["token_ids"]
+
+class PrunedHead(torch.nn.Module):
+    """
+    lm_head restricted to `token_ids`: output column i is the logit of
+    token_ids[i]. A dynamically quantized (int8) head is dequantized,
+    sliced and quantized again. The full head is kept, unregistered, for
+    disable_pruned_head().
+    """
+
+    def __init__(self, full_head: torch.nn.Module, token_ids: Sequence[int]):
+        super().__init__()
+        weight = full_head.weight() if callable(full_head.weight) else full_head.weight
+        quantized = weight.is_quantized
+        if quantized:
+            weight = weight.dequantize()
+        bias = full_head.bias() if callable(getattr(full_head, "bias", None)) else getattr(full_head, "bias", None)
+
+        ids = torch.tensor(list(token_ids), dtype=torch.long, device=weight.device)
+        self.register_buffer("token_ids", ids, persistent=False)
+        self.linear = torch.nn.Linear(weight.shape[1], len(ids), bias=bias is not None,
+                                      dtype=weight.dtype, device=weight.device)
+        with torch.no_grad():
+            self.linear.weight.copy_(weight[ids])
+            if bias is not None:
+                self.linear.bias.copy_(bias[ids])
+        if quantized:
+            torch.ao.quantization.quantize_dynamic(self, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+        self.vocab_digest = hashlib.sha256(json.dumps(list(token_ids)).encode()).hexdigest()[:16]
+        object.__setattr__(self, "full_head", full_head)  # not a submodule: no double registration
+
+    def forward(self, hidden_states: torch.Tensor) -> torch.Tensor:
+        return self.linear(hidden_states)
+
+def enable_pruned_head(model, token_ids: Sequence[int]) -> PrunedHead:
+    """Swap the model's output head for a PrunedHead over `token_ids` (replacing any earlier one)."""
+    head = model.get_output_embeddings()
+    if isinstance(head, PrunedHead):
+        head = head.full_head
+    pruned = PrunedHead(head, token_ids)
+    model.set_output_embeddings(pruned)
+    return pruned
+
+def disable_pruned_head(model) -> None:
+    """Restore the full output head."""
+    head = model.get_output_embeddings()
+    if isinstance(head, PrunedHead):
+        model.set_output_embeddings(head.full_head)
+
+@contextmanager
+def pruned_head(model, token_ids: Sequence[int]):
+    enable_pruned_head(model, token_ids)
+    try:
+        yield model
+    finally:
+        disable_pruned_head(model)
+
+@torch.no_grad()
+def time_heads(model, token_ids: Sequence[int], batch_sizes: Sequence[int] = (1, 16), repeats: int = 50) -> Dict[str, dict]:
+    """ms per call of the full and the pruned head on one decode step's hidden states."""
+    full = model.get_output_embeddings()
+    pruned = PrunedHead(full, token_ids)
+    weight = pruned.linear.weight() if callable(pruned.linear.weight) else pruned.linear.weight
+    report = {}
+    for batch_size in batch_sizes:
+        hidden = torch.randn(batch_size, 1, weight.shape[1], device=weight.device,
+                             dtype=torch.float32 if weight.is_quantized else weight.dtype)
+        timings = {}
+        for name, head in (("full", full), ("pruned", pruned)):
+            head(hidden)
+            start = time.perf_counter()
+            for _ in range(repeats):
+                head(hidden)
+            timings[name] = 1000 * (time.perf_counter() - start) / repeats
+        report[f"batch_{batch_size}"] = {"full_ms": round(timings["full"], 3), "pruned_ms": round(timings["pruned"], 3),
+                                         "speedup": round(timings["full"] / max(timings["pruned"], 1e-9), 2)}
+    return report
+
+def compare_heads(model, tokenizer, samples: Sequence[dict], token_ids: Sequence[int], batch_size: int = 16,
+                  structured_json: bool = False) -> dict:
+    """
+    Generate `samples` with the full and the pruned head and report ms
+    per forward pass, exact match, how many responses changed, and the
+    isolated head timings.
+    """
+    pairs = [(sample["instruction"], sample["input"]) for sample in samples]
+    report, outputs = {"vocab_size": len(tokenizer), "pruned_size": len(token_ids)}, {}
+    for name in ("full", "pruned"):
+        if name == "pruned":
+            enable_pruned_head(model, token_ids)
+        try:
+            stats = {}
+            start = time.perf_counter()
+            outputs[name] = generate_batch(model, tokenizer, pairs, batch_size=batch_size, stats=stats,
+                                           structured_json=structured_json, progress=True)
+            seconds = time.perf_counter() - start
+        finally:
+            disable_pruned_head(model)
+        matches = sum(exact_match(pred, sample["output"]) for pred, sample in zip(outputs[name], samples))
+        report[name] = {
+            "seconds": round(seconds, 2),
+            "ms_per_forward": round(1000 * seconds / max(stats.get("forward_passes", 1), 1), 2),
+            "exact_match": round(matches / max(len(samples), 1), 4),
+        }
+        print(f"{name:>6}: {report[name]}")
+    report["forward_speedup"] = round(report["full"]["ms_per_forward"] / max(report["pruned"]["ms_per_forward"], 1e-9), 3)
+    report["exact_match_change"] = round(report["pruned"]["exact_match"] - report["full"]["exact_match"], 4)
+    report["changed_responses"] = sum(a != b for a, b in zip(outputs["full"], outputs["pruned"]))
+    report["head_only"] = time_heads(model, token_ids, (1, batch_size))
+    return report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build and benchmark the pruned output head.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = commands.add_parser("build", help="Token set from the training split")
+    build_parser.add_argument("--tokenizer", default="Qwen/Qwen3-0.6B")
+    build_parser.add_argument("--train-data", default="../dataset/generated/processed/train.json")
+    build_parser.add_argument("--no-instructions", action="store_true",
+                              help="Leave instruction tokens out of the safety margin")
+    build_parser.add_argument("--output", default=DEFAULT_TOKEN_SET_PATH)
+
+    bench_parser = commands.add_parser("bench", help="Full vs pruned head on the test split")
+    bench_parser.add_argument("--model", default="../outputs/lora_adapters", help="Adapter or model directory / repo")
+    bench_parser.add_argument("--base-model", default=None)
+    bench_parser.add_argument("--precision", default="auto", choices=PRECISIONS)
+    bench_parser.add_argument("--token-set", default=DEFAULT_TOKEN_SET_PATH)
+    bench_parser.add_argument("--test-data", default="../dataset/generated/processed/test.json")
+    bench_parser.add_argument("--limit", type=int, default=None, help="Evaluate only the first N samples")
+    bench_parser.add_argument("--batch-size", type=int, default=16)
+    bench_parser.add_argument("--threads", type=int, default=None)
+    bench_parser.add_argument("--output", default="../outputs/eval_results")
+
+    args = parser.parse_args(argv)
+    if args.command == "build":
+        from transformers import AutoTokenizer
+        tokenizer = AutoTokenizer.from_pretrained(args.tokenizer, trust_remote_code=True)
+        with open(args.train_data, 'r', encoding='utf-8') as f:
+            samples = json.load(f)
+        token_ids = build_token_set(tokenizer, samples, include_instructions=not args.no_instructions)
+        path = save_token_set(token_ids, tokenizer, args.output)
+        print(f"✅ {len(token_ids)} of {len(tokenizer)} tokens ({100 * len(token_ids) / len(tokenizer):.1f}%) "
+              f"saved to: {path}")
+        return
+
+    configure_threads(args.threads)
+    model, tokenizer = load_cpu_model(args.model, args.base_model, args.precision)
+    token_ids = load_token_set(tokenizer, args.token_set)
+    with open(args.test_data, 'r', encoding='utf-8') as f:
+        samples = json.load(f)[:args.limit]
+    report = compare_heads(model, tokenizer, samples, token_ids, args.batch_size)
+    output = Path(args.output) / f"pruned_head_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump({"model": args.model, "precision": model.cpu_precision, **report}, f, indent=2)
+    print(f"\n✅ Comparison saved to: {output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+"""
+response_cache.py
+Persistent cache of generated responses.
+
+Greedy decoding is deterministic, so a response only depends on the model
+weights, the tokenizer, the prompt template, the (instruction, input) pair
+and the generation settings. Entries are keyed by all of these:
+- model_fingerprint(): base model, quantization, active adapters and a
+  hash of their weights (or of the weight files of a local model
+  directory), so loading a different adapter or retraining one misses
+  instead of returning stale responses; models from
+  cpu_inference.load_cpu_model add the source they were loaded from and
+  their precision, since merged adapters leave no adapter config behind
+- tokenizer and template fingerprints
+- the normalized instruction (surrounding and repeated whitespace
+  collapsed) and input; misses are generated from the same normalized
+  pair, so every spelling that shares an entry gets the response its
+  prompt would produce
+- the generate_batch settings
+
+Lookups go through an in-memory LRU layer in front of a sqlite file; the
+sqlite table keeps the most recently used `max_entries` rows.
+
+Usage (from a notebook):
+    sys.path.append("../model_scripts")
+    from response_cache import ResponseCache
+    cache = ResponseCache("../outputs/response_cache.sqlite")
+    preds = cache.generate(model, tokenizer, [(instruction, "[LINUX]")])
+    print(cache.stats())
+"""
+
+import hashlib
+import json
+import sqlite3
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+from generation import STOP_RULES_VERSION, generate_batch
+from prompts import template_fingerprint
+from token_cache import tokenizer_fingerprint
+
+DEFAULT_CACHE_PATH = "../outputs/response_cache.sqlite"
+WEIGHT_SUFFIXES = (".safetensors", ".bin", ".pt")
+
+def normalize_instruction(instruction: str) -> str:
+    """Collapse whitespace runs; case is kept since commands copy names verbatim."""
+    return " ".join(instruction.split())
+
+def normalize_pair(instruction: str, input_text: str) -> Tuple[str, str]:
+    """The (instruction, input) pair that is both keyed and prompted."""
+    return normalize_instruction(instruction), input_text.strip()
+
+def _model_identity(model) -> dict:
+    """Cheap description of what is loaded; a change means the weights hash is recomputed."""
+    config = getattr(model, "config", None)
+    identity = {
+        "class": type(model).__name__,
+        "base": getattr(config, "_name_or_path", None),
+        "dtype": str(getattr(model, "dtype", None)),
+        "quantization": str(getattr(config, "quantization_config", None)),
+    }
+    source = getattr(model, "cpu_source", None)
+    if source is not None:
+        identity["source"] = str(source)
+        identity["precision"] = getattr(model, "cpu_precision", None)
+    get_head = getattr(model, "get_output_embeddings", None)
+    pruned = getattr(get_head(), "vocab_digest", None) if get_head is not None else None
+    if pruned:
+        identity["pruned_head"] = pruned
+    peft_config = getattr(model, "peft_config", None)
+    if peft_config:
+        # Only the active adapters decide responses; others may be resident (adapter_registry.py)
+        active = sorted(getattr(model, "active_adapters", None) or [])
+        identity["active_adapters"] = active
+        identity["adapters"] = {name: str(peft_config[name]) for name in active if name in peft_config}
+    return identity
+
+def _weights_digest(model, identity: dict) -> str:
+    digest = hashlib.sha256()
+    directory = identity.get("source") or identity["base"]
+    if "adapters" in identity:
+        # LoRA weights are small; hash the actual tensors of the active adapters
+        for name, tensor in sorted(model.state_dict().items()):
+            if "lora_" in name and any(f".{adapter}." in name for adapter in identity["adapters"]):
+                digest.update(name.encode())
+                digest.update(tensor.detach().float().cpu().numpy().tobytes())
+    elif directory and Path(directory).is_dir():
+        # A local model or adapter directory: its weight files' names, sizes and mtimes
+        for path in sorted(Path(directory).iterdir()):
+            if path.suffix in WEIGHT_SUFFIXES:
+                stat = path.stat()
+                digest.update(f"{path.name}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    return digest.hexdigest()[:16]
+
+def model_fingerprint(model) -> str:
+    """
+    Hash of the loaded model: its identity plus a weights digest. Digests
+    are memoized on the model object per identity, so switching between
+    resident adapters (set_adapter) hashes each adapter's weights once.
+    """
+    identity = _model_identity(model)
+    memo_key = json.dumps(identity, sort_keys=True)
+    memo = getattr(model, "_response_cache_fingerprints", None)
+    if memo is not None and memo_key in memo:
+        return memo[memo_key]
+    payload = json.dumps({**identity, "weights": _weights_digest(model, identity)}, sort_keys=True)
+    fingerprint = hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+    try:
+        if memo is None:
+            memo = model._response_cache_fingerprints = {}
+        memo[memo_key] = fingerprint
+    except AttributeError:
+        pass
+    return fingerprint
+
+class ResponseCache:
+    """
+    Two-level response cache: an OrderedDict LRU of `memory_entries`
+    responses over a sqlite table of at most `max_entries` rows (least
+    recently used rows are evicted). Counters: memory_hits, disk_hits,
+    misses, evictions.
+    """
+
+    def __init__(self, path: Union[str, Path] = DEFAULT_CACHE_PATH, memory_entries: int = 4096,
+                 max_entries: int = 100_000):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.memory_entries = memory_entries
+        self.max_entries = max_entries
+        self.memory: "OrderedDict[str, str]" = OrderedDict()
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+        self.db = sqlite3.connect(str(self.path))
+        self.db.execute("CREATE TABLE IF NOT EXISTS responses "
+                        "(key TEXT PRIMARY KEY, response TEXT NOT NULL, last_used REAL NOT NULL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        self.db.commit()
+
+    @staticmethod
+    def key(context: str, instruction: str, input_text: str) -> str:
+        """Key of a normalize_pair() pair, taken verbatim."""
+        payload = json.dumps([context, instruction, input_text], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def context(model, tokenizer, settings: dict) -> str:
+        """Everything besides the prompt that decides a response."""
+        return json.dumps({
+            "model": model_fingerprint(model),
+            "tokenizer": tokenizer_fingerprint(tokenizer),
+            "template": template_fingerprint(),
+            "settings": settings,
+            "stop_rules": STOP_RULES_VERSION,
+        }, sort_keys=True, default=str)
+
+    def _remember(self, key: str, response: str) -> None:
+        self.memory[key] = response
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+
+    def get(self, key: str) -> Optional[str]:
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            self.counters["memory_hits"] += 1
+            return self.memory[key]
+        row = self.db.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.counters["misses"] += 1
+            return None
+        self.db.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+        self.db.commit()
+        self.counters["disk_hits"] += 1
+        self._remember(key, row[0])
+        return row[0]
+
+    def put_many(self, items: Sequence[Tuple[str, str]]) -> None:
+        now = time.time()
+        self.db.executemany("INSERT OR REPLACE INTO responses (key, response, last_used) VALUES (?, ?, ?)",
+                            [(key, response, now) for key, response in items])
+        for key, response in items:
+            self._remember(key, response)
+        self._evict()
+        self.db.commit()
+
+    def _evict(self) -> None:
+        excess = self.db.execute("SELECT COUNT(*) FROM responses").fetchone()[0] - self.max_entries
+        if excess > 0:
+            self.db.execute("DELETE FROM responses WHERE key IN "
+                            "(SELECT key FROM responses ORDER BY last_used LIMIT ?)", (excess,))
+            self.counters["evictions"] += excess
+
+    def generate(self, model, tokenizer, pairs: Sequence[Tuple[str, str]], **generation_kwargs) -> List[str]:
+        """
+        generate_batch with caching: pairs are normalized (normalize_pair),
+        cached ones are answered directly and the distinct misses are
+        generated together in one generate_batch call.
+        Keyword arguments are passed on to generate_batch and are part of
+        the key (except `progress`, `stats` and `draft_tokens`, which do
+        not change responses).
+        """
+        settings = {name: value for name, value in generation_kwargs.items()
+                    if name not in ("progress", "stats", "draft_tokens")}
+        context = self.context(model, tokenizer, settings)
+        pairs = [normalize_pair(instruction, input_text) for instruction, input_text in pairs]
+        keys = [self.key(context, *pair) for pair in pairs]
+        responses = [self.get(key) for key in keys]
+
+        # One generation per distinct missing key; repeats in the request share it
+        missing = {keys[i]: pairs[i] for i, response in enumerate(responses) if response is None}
+        if missing:
+            generated = dict(zip(missing, generate_batch(model, tokenizer, list(missing.values()),
+                                                         **generation_kwargs)))
+            responses = [generated.get(key, response) for key, response in zip(keys, responses)]
+            self.put_many(list(generated.items()))
+        return responses
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.counters["memory_hits"] + self.counters["disk_hits"] + self.counters["misses"]
+        hits = lookups - self.counters["misses"]
+        return {
+            **self.counters,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "memory_entries": len(self.memory),
+            "disk_entries": self.db.execute("SELECT COUNT(*) FROM responses").fetchone()[0],
+        }
+
+    def clear(self) -> None:
+        self.memory.clear()
+        self.db.execute("DELETE FROM responses")
+        self.db.commit()
+
+    def close(self) -> None:
+        self.db.close()
@@ -0,0 +1,374 @@
+"""
+server.py
+Local HTTP inference server with continuous batching.
+
+An asyncio front end (stdlib only) accepts requests and hands them to a
+Scheduler thread that owns the model. The scheduler keeps one running
+DecodeBatch: at every decode step it admits queued requests into the batch
+(their prompts are prefilled in the same forward pass that decodes the
+running rows), and finished or timed-out requests leave it at once, so a
+short command never waits for a long JSON answer.
+
+- Backpressure: the queue holds at most --max-queue requests; beyond
+  that requests get 503 with Retry-After instead of piling up.
+- Timeouts: each request waits at most --timeout seconds (or its own
+  "timeout" field); on expiry it gets 504 and its row is dropped.
+- With --index, instructions found in the instruction index
+  (instruction_index.py) are answered on the event loop without queueing.
+- With --pruned-head, logits are computed only over the token set built
+  by pruned_head.py.
+
+Endpoints (JSON in, JSON out):
+    POST /v1/command  {"instruction": "...", "os": "linux"}   (or "input": "[LINUX]")
+    POST /v1/all      {"instruction": "..."}                  -> commands for every OS
+    POST /v1/batch    {"requests": [{"instruction": "...", "input": "[MAC]"}, ...]}
+    GET  /health      queue depth, batch size, counters and scheduler liveness
+                      (503 once the scheduler thread has died)
+
+Usage:
+    python server.py serve --model ../outputs/lora_adapters --precision int8 --port 8000
+    python server.py loadtest --url http://127.0.0.1:8000 --data ../dataset/generated/processed/test.json
+"""
+
+import argparse
+import asyncio
+import json
+import queue
+import threading
+import time
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+from cpu_inference import PRECISIONS, configure_threads, load_cpu_model
+from generation import DecodeBatch, MAX_NEW_TOKENS, eos_token_ids, make_row, tokenize_prompts
+from instruction_index import InstructionIndex
+from prompts import OS_TAGS
+from pruned_head import enable_pruned_head, load_token_set
+
+OS_INPUTS = {tag.strip("[]").lower(): tag for tag in OS_TAGS}
+JSON_INPUT = "Return the command for all operating systems as JSON"
+MAX_BODY_BYTES = 1 << 20
+
+class Request:
+    """One pending generation, resolved on the event loop that submitted it."""
+
+    def __init__(self, instruction: str, input_text: str, loop: asyncio.AbstractEventLoop):
+        self.instruction = instruction
+        self.input_text = input_text
+        self.loop = loop
+        self.future = loop.create_future()
+        self.cancelled = False
+        self.submitted = time.perf_counter()
+
+    def _set(self, method, value) -> None:
+        if not self.future.done():
+            method(value)
+
+    def resolve(self, response: str) -> None:
+        self.loop.call_soon_threadsafe(self._set, self.future.set_result, response)
+
+    def fail(self, error: Exception) -> None:
+        self.loop.call_soon_threadsafe(self._set, self.future.set_exception, error)
+
+class Scheduler:
+    """
+    Continuous-batching decode loop on a background thread. Requests wait
+    in a bounded queue and join the running batch between steps while it
+    has fewer than `max_batch` rows.
+
+    A step that raises fails every request in the batch and the loop
+    carries on with a fresh DecodeBatch (its cache may be half-updated);
+    health() reports these restarts, the last error and how long ago the
+    loop last went round.
+    """
+
+    def __init__(self, model, tokenizer, max_batch: int = 16, max_queue: int = 256,
+                 budgets: Optional[Dict[str, int]] = None, structured_json: bool = True,
+                 max_prompt_length: int = 200, draft_tokens: int = 0):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_batch = max_batch
+        self.budgets = {**MAX_NEW_TOKENS, **(budgets or {})}
+        self.structured_json = structured_json
+        self.max_prompt_length = max_prompt_length
+        self.eos_ids = eos_token_ids(tokenizer)
+        self.pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+        self.draft_tokens = draft_tokens
+
+        self.pending: "queue.Queue[Request]" = queue.Queue(maxsize=max_queue)
+        self.stats = {"completed": 0, "rejected": 0, "cancelled": 0, "failed": 0, "restarts": 0}
+        self.batch = self._new_batch()
+        self.owners: Dict[int, Request] = {}
+        self.last_error: Optional[str] = None
+        self.heartbeat = time.monotonic()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="decode-scheduler", daemon=True)
+
+    def _new_batch(self) -> DecodeBatch:
+        return DecodeBatch(self.model, self.pad_token_id, self.stats, self.draft_tokens)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def submit(self, request: Request) -> None:
+        """Queue a request; raises queue.Full when the server is saturated."""
+        try:
+            self.pending.put_nowait(request)
+        except queue.Full:
+            self.stats["rejected"] += 1
+            raise
+
+    def alive(self) -> bool:
+        return self._thread.is_alive()
+
+    def health(self) -> dict:
+        return {"alive": self.alive(), "heartbeat_age": round(time.monotonic() - self.heartbeat, 3),
+                "last_error": self.last_error, "queued": self.pending.qsize(), "active": len(self.batch),
+                "max_batch": self.max_batch, **self.stats}
+
+    def _admit(self) -> None:
+        """Move queued requests into the batch, waiting briefly when idle."""
+        admitted: List[Request] = []
+        while len(self.batch) + len(admitted) < self.max_batch:
+            try:
+                block = not self.batch and not admitted
+                request = self.pending.get(timeout=0.05) if block else self.pending.get_nowait()
+            except queue.Empty:
+                break
+            if request.cancelled:
+                self.stats["cancelled"] += 1
+                continue
+            admitted.append(request)
+        if not admitted:
+            return
+        pairs = [(request.instruction, request.input_text) for request in admitted]
+        prompt_ids = tokenize_prompts(self.tokenizer, pairs, self.max_prompt_length)
+        rows = [make_row(self.tokenizer, request.instruction, request.input_text, self.budgets,
+                         None, self.structured_json, self.eos_ids) for request in admitted]
+        for row, request in zip(rows, admitted):
+            self.owners[id(row)] = request
+        self.batch.add(rows, prompt_ids)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self.heartbeat = time.monotonic()
+            try:
+                self._admit()
+                cancelled = [row for row in self.batch.rows if self.owners[id(row)].cancelled]
+                if cancelled:
+                    self.batch.drop(cancelled)
+                    for row in cancelled:
+                        del self.owners[id(row)]
+                    self.stats["cancelled"] += len(cancelled)
+                if not self.batch:
+                    continue
+                for row in self.batch.step():
+                    self.owners.pop(id(row)).resolve(row.response())
+                    self.stats["completed"] += 1
+            except Exception as error:  # A failed step fails every request in it
+                failed = list(self.owners.values())
+                self.owners.clear()
+                self.batch = self._new_batch()
+                self.stats["failed"] += len(failed)
+                self.stats["restarts"] += 1
+                self.last_error = f"{type(error).__name__}: {error}"
+                for request in failed:
+                    request.fail(error)
+
+class InferenceServer:
+    """Minimal HTTP/1.1 front end (one request per connection) over a Scheduler."""
+
+    def __init__(self, scheduler: Scheduler, timeout: float = 30.0, index: Optional[InstructionIndex] = None):
+        self.scheduler = scheduler
+        self.timeout = timeout
+        self.index = index
+
+    async def generate(self, instruction: str, input_text: str, timeout: Optional[float] = None) -> str:
+        if self.index is not None:
+            response = self.index.lookup(instruction, input_text)
+            if response is not None:
+                return response
+        request = Request(instruction, input_text, asyncio.get_running_loop())
+        self.scheduler.submit(request)
+        try:
+            return await asyncio.wait_for(asyncio.shield(request.future), timeout or self.timeout)
+        except asyncio.TimeoutError:
+            request.cancelled = True
+            raise
+
+    async def route(self, method: str, path: str, body):
+        if method == "GET" and path == "/health":
+            health = self.scheduler.health()
+            if self.index is not None:
+                health["index"] = self.index.stats()
+            return (200 if health["alive"] else 503), health
+        if method != "POST":
+            return 404, {"error": f"no route for {method} {path}"}
+        if not isinstance(body, dict):
+            return 400, {"error": "request body must be a JSON object"}
+        timeout = body.get("timeout")
+
+        if path == "/v1/command":
+            input_text = body.get("input")
+            if input_text is None:
+                os_name = str(body.get("os", "linux")).lower()
+                if os_name not in OS_INPUTS:
+                    return 400, {"error": f"os must be one of {sorted(OS_INPUTS)}"}
+                input_text = OS_INPUTS[os_name]
+            return 200, {"command": await self.generate(body["instruction"], input_text, timeout)}
+
+        if path == "/v1/all":
+            response = await self.generate(body["instruction"], JSON_INPUT, timeout)
+            try:
+                return 200, {"commands": json.loads(response)}
+            except ValueError:
+                return 200, {"commands": None, "raw": response}
+
+        if path == "/v1/batch":
+            items = body.get("requests", [])
+            if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+                return 400, {"error": "requests must be a list of JSON objects"}
+            responses = await asyncio.gather(*[
+                self.generate(item["instruction"], item.get("input", ""), timeout) for item in items
+            ])
+            return 200, {"responses": responses}
+        return 404, {"error": f"no route for {method} {path}"}
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        status, payload, headers = 500, {"error": "internal error"}, {}
+        try:
+            request_line = (await reader.readline()).decode("latin-1").split()
+            length = 0
+            while True:
+                line = (await reader.readline()).decode("latin-1").strip()
+                if not line:
+                    break
+                name, _, value = line.partition(":")
+                if name.strip().lower() == "content-length":
+                    length = int(value.strip())
+            if len(request_line) < 2:
+                status, payload = 400, {"error": "malformed request line"}
+            elif length > MAX_BODY_BYTES:
+                status, payload = 413, {"error": "request body too large"}
+            else:
+                body = json.loads(await reader.readexactly(length)) if length else {}
+                status, payload = await self.route(request_line[0], urlparse(request_line[1]).path, body)
+        except queue.Full:
+            status, payload, headers = 503, {"error": "server busy"}, {"Retry-After": "1"}
+        except asyncio.TimeoutError:
+            status, payload = 504, {"error": "generation timed out"}
+        except (KeyError, ValueError) as error:
+            status, payload = 400, {"error": f"bad request: {error}"}
+        except Exception as error:
+            status, payload = 500, {"error": str(error)}
+
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        head = [f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}",
+                "Content-Type: application/json", f"Content-Length: {len(data)}", "Connection: close"]
+        head += [f"{name}: {value}" for name, value in headers.items()]
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + data)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+async def serve(args) -> None:
+    configure_threads(args.threads)
+    model, tokenizer = load_cpu_model(args.model, args.base_model, args.precision)
+    if args.pruned_head:
+        enable_pruned_head(model, load_token_set(tokenizer, args.pruned_head))
+    scheduler = Scheduler(model, tokenizer, max_batch=args.max_batch, max_queue=args.max_queue,
+                          structured_json=not args.free_json, draft_tokens=args.draft_tokens)
+    scheduler.start()
+    index = InstructionIndex.load(args.index, args.index_min_confidence) if args.index else None
+    server = InferenceServer(scheduler, timeout=args.timeout, index=index)
+    listener = await asyncio.start_server(server.handle, args.host, args.port)
+    print(f"✅ Serving {args.model} ({model.cpu_precision}) on http://{args.host}:{args.port}")
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        scheduler.stop()
+
+async def _post(host: str, port: int, path: str, payload: dict):
+    reader, writer = await asyncio.open_connection(host, port)
+    data = json.dumps(payload).encode("utf-8")
+    writer.write(f"POST {path} HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+                 f"Content-Length: {len(data)}\r\n\r\n".encode("latin-1") + data)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    status = int(response.split(b" ", 2)[1])
+    return status, json.loads(response.split(b"\r\n\r\n", 1)[1] or b"{}")
+
+async def load_test(args) -> dict:
+    """Send test-split prompts at a fixed concurrency; report throughput and latency percentiles."""
+    url = urlparse(args.url)
+    with open(args.data, 'r', encoding='utf-8') as f:
+        records = json.load(f)[:args.requests]
+    work: "asyncio.Queue[dict]" = asyncio.Queue()
+    for record in records:
+        work.put_nowait(record)
+    latencies, statuses = [], {}
+
+    async def worker():
+        while not work.empty():
+            record = work.get_nowait()
+            start = time.perf_counter()
+            status, _ = await _post(url.hostname, url.port, "/v1/command",
+                                    {"instruction": record["instruction"], "input": record["input"]})
+            latencies.append(time.perf_counter() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(args.concurrency)])
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    pick = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] if latencies else 0.0
+    report = {
+        "requests": len(latencies),
+        "concurrency": args.concurrency,
+        "seconds": round(elapsed, 2),
+        "requests_per_second": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "latency_p50": round(pick(0.5), 3),
+        "latency_p95": round(pick(0.95), 3),
+        "statuses": statuses,
+    }
+    print(json.dumps(report, indent=2))
+    return report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local inference server with continuous batching.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = commands.add_parser("serve", help="Run the server")
+    serve_parser.add_argument("--model", required=True, help="Local model or LoRA adapter directory")
+    serve_parser.add_argument("--base-model", default=None, help="Base model for an adapter directory")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8000)
+    serve_parser.add_argument("--max-batch", type=int, default=16)
+    serve_parser.add_argument("--max-queue", type=int, default=256)
+    serve_parser.add_argument("--timeout", type=float, default=30.0, help="Default per-request timeout (s)")
+    serve_parser.add_argument("--precision", default="auto", choices=PRECISIONS)
+    serve_parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads (default: physical cores)")
+    serve_parser.add_argument("--free-json", action="store_true", help="Decode JSON answers without the forced scaffold")
+    serve_parser.add_argument("--draft-tokens", type=int, default=0, help="Prompt-lookup draft tokens per step (0 = off)")
+    serve_parser.add_argument("--index", default=None, help="Instruction index answering known instructions")
+    serve_parser.add_argument("--index-min-confidence", type=float, default=1.0)
+    serve_parser.add_argument("--pruned-head", default=None, help="Token set from pruned_head.py build (default: full head)")
+
+    test_parser = commands.add_parser("loadtest", help="Load-test a running server")
+    test_parser.add_argument("--url", default="http://127.0.0.1:8000")
+    test_parser.add_argument("--data", default="../dataset/generated/processed/test.json")
+    test_parser.add_argument("--requests", type=int, default=500)
+    test_parser.add_argument("--concurrency", type=int, default=32)
+
+    args = parser.parse_args(argv)
+    asyncio.run(serve(args) if args.command == "serve" else load_test(args))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+speculative_bench.py
+Measure prompt-lookup speculative decoding on the test split.
+
+Runs generate_batch once per draft length (0 = plain greedy) and reports
+sequential forward passes, decoded tokens per second, the draft
+acceptance rate, exact match, and how many responses are identical to
+plain greedy decoding.
+
+Usage:
+    python speculative_bench.py --model ../outputs/lora_adapters --draft-tokens 0 4 8
+"""
+
+import argparse
+import json
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Sequence
+
+import torch
+
+from cpu_inference import PRECISIONS, configure_threads, exact_match, load_cpu_model
+from generation import generate_batch
+
+def _synchronize(model) -> None:
+    if next(model.parameters()).is_cuda:
+        torch.cuda.synchronize()
+
+def compare_speculative(model, tokenizer, samples: Sequence[dict], draft_settings: Sequence[int] = (0, 4, 8),
+                        batch_size: int = 16, structured_json: bool = False) -> Dict[int, dict]:
+    """
+    {draft_tokens: report} for each setting in `draft_settings`. The first
+    setting is the reference for "identical_to_reference" and
+    "forward_pass_ratio".
+    """
+    pairs = [(sample["instruction"], sample["input"]) for sample in samples]
+    report, reference = {}, None
+    for draft_tokens in draft_settings:
+        stats = {}
+        _synchronize(model)
+        start = time.perf_counter()
+        preds = generate_batch(model, tokenizer, pairs, batch_size=batch_size, structured_json=structured_json,
+                               stats=stats, draft_tokens=draft_tokens, progress=True)
+        _synchronize(model)
+        seconds = time.perf_counter() - start
+        if reference is None:
+            reference = (preds, stats["forward_passes"])
+
+        matches = sum(exact_match(pred, sample["output"]) for pred, sample in zip(preds, samples))
+        report[draft_tokens] = {
+            "samples": len(samples),
+            "seconds": round(seconds, 2),
+            "forward_passes": stats["forward_passes"],
+            "forward_pass_ratio": round(stats["forward_passes"] / max(reference[1], 1), 3),
+            "decode_tokens": stats["decode_tokens"],
+            "tokens_per_second": round(stats["decode_tokens"] / max(seconds, 1e-9), 1),
+            "acceptance_rate": (round(stats["accepted_tokens"] / stats["draft_tokens"], 4)
+                                if stats.get("draft_tokens") else None),
+            "exact_match": round(matches / max(len(samples), 1), 4),
+            "identical_to_reference": sum(a == b for a, b in zip(preds, reference[0])),
+        }
+        print(f"draft={draft_tokens}: {report[draft_tokens]}")
+    return report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark prompt-lookup speculative decoding.")
+    parser.add_argument("--model", default="../outputs/lora_adapters", help="Adapter or model directory / repo")
+    parser.add_argument("--base-model", default=None)
+    parser.add_argument("--precision", default="fp32", choices=PRECISIONS)
+    parser.add_argument("--test-data", default="../dataset/generated/processed/test.json")
+    parser.add_argument("--draft-tokens", nargs="+", type=int, default=[0, 4, 8])
+    parser.add_argument("--limit", type=int, default=None, help="Evaluate only the first N samples")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--structured-json", action="store_true")
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--output", default="../outputs/eval_results")
+    args = parser.parse_args(argv)
+
+    configure_threads(args.threads)
+    model, tokenizer = load_cpu_model(args.model, args.base_model, args.precision)
+    with open(args.test_data, 'r', encoding='utf-8') as f:
+        samples = json.load(f)[:args.limit]
+
+    report = compare_speculative(model, tokenizer, samples, args.draft_tokens, args.batch_size,
+                                 args.structured_json)
+    output = Path(args.output) / f"speculative_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump({"model": args.model, "precision": model.cpu_precision, "batch_size": args.batch_size,
+                   "results": report}, f, indent=2)
+    print(f"\n✅ Benchmark saved to: {output}")
+
+if __name__ == "__main__":
+    main()
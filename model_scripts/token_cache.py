@@ -0,0 +1,234 @@
+"""
+token_cache.py
+Persistent pre-tokenized dataset cache backed by memory-mapped arrays.
+
+A cache entry holds every example's tokens back to back in flat arrays
+(input ids, attention mask, label mask) plus an offsets array, so example i
+is the slice offsets[i]:offsets[i + 1]. Entries are keyed by the tokenizer
+fingerprint, the prompt template, the data file hash and the tokenization
+settings; a run with the same inputs maps the arrays straight from disk
+instead of re-tokenizing.
+
+Usage (from a notebook):
+    sys.path.append("../model_scripts")
+    from token_cache import load_or_build
+    train_tokens = load_or_build(CONFIG["train_data"], tokenizer, max_length=CONFIG["max_seq_length"])
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import sys
+from pathlib import Path
+from typing import Iterable, List, Optional, Union
+
+import numpy as np
+
+from prompts import build_prompt, format_instruction, template_fingerprint
+
+PREPROCESSING_SCRIPTS_DIR = Path(__file__).resolve().parent.parent / "dataset_preprocessing_scripts"
+sys.path.append(str(PREPROCESSING_SCRIPTS_DIR))
+from utils import file_sha256
+
+CACHE_VERSION = 1
+DEFAULT_CACHE_DIR = "../outputs/token_cache"
+MODES = ("train", "prompt")
+
+ARRAYS = {
+    "input_ids": np.int32,
+    "attention_mask": np.uint8,
+    "label_mask": np.uint8,
+}
+
+def tokenizer_fingerprint(tokenizer) -> str:
+    """
+    Hash of everything that decides how text becomes ids: the full
+    tokenizer definition for fast tokenizers (vocab, merges, normalizer,
+    post-processor), else the vocabulary, plus the special tokens.
+    """
+    digest = hashlib.sha256()
+    digest.update(type(tokenizer).__name__.encode())
+    backend = getattr(tokenizer, "backend_tokenizer", None)
+    if backend is not None:
+        # Truncation/padding are per-call state that tokenizing mutates
+        definition = json.loads(backend.to_str())
+        definition.pop("truncation", None)
+        definition.pop("padding", None)
+        digest.update(json.dumps(definition, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+    else:
+        vocab = sorted(tokenizer.get_vocab().items())
+        digest.update(json.dumps(vocab, ensure_ascii=False).encode("utf-8"))
+    digest.update(json.dumps(tokenizer.special_tokens_map, sort_keys=True, default=str).encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+def cache_key(tokenizer, data_path: Union[str, Path], max_length: int, mode: str = "train") -> dict:
+    """The inputs an entry depends on; any change means a rebuild."""
+    return {
+        "version": CACHE_VERSION,
+        "tokenizer": tokenizer_fingerprint(tokenizer),
+        "template": template_fingerprint(),
+        "data": file_sha256(data_path),
+        "max_length": max_length,
+        "mode": mode,
+    }
+
+def _key_digest(key: dict) -> str:
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+class TokenizedCache:
+    """
+    Read-only view over a cache entry. Arrays are memory-mapped, so opening
+    costs a few syscalls regardless of dataset size and pages are shared
+    between processes (e.g. dataloader workers).
+    """
+
+    def __init__(self, directory: Union[str, Path], mask_prompt: bool = False):
+        self.directory = Path(directory)
+        with open(self.directory / "meta.json", 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        self.offsets = np.load(self.directory / "offsets.npy", mmap_mode="r")
+        total = int(self.offsets[-1])
+        self.arrays = {
+            name: (np.memmap(self.directory / f"{name}.bin", dtype=dtype, mode="r", shape=(total,))
+                   if total else np.zeros(0, dtype=dtype))
+            for name, dtype in ARRAYS.items()
+        }
+        # Off by default to train exactly as before: on the full sequence
+        self.mask_prompt = mask_prompt
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    @property
+    def lengths(self) -> np.ndarray:
+        """Token count of every example."""
+        return np.diff(self.offsets)
+
+    def views(self, index: int) -> dict:
+        """Zero-copy array slices for one example."""
+        start, end = int(self.offsets[index]), int(self.offsets[index + 1])
+        return {name: array[start:end] for name, array in self.arrays.items()}
+
+    def __getitem__(self, index: int) -> dict:
+        """One example as a feature dict for transformers' collators."""
+        if index < 0:
+            index += len(self)
+        views = self.views(index)
+        input_ids = views["input_ids"].tolist()
+        if self.mask_prompt:
+            labels = np.where(views["label_mask"] == 1, views["input_ids"], -100).tolist()
+        else:
+            labels = list(input_ids)
+        return {
+            "input_ids": input_ids,
+            "attention_mask": views["attention_mask"].tolist(),
+            "labels": labels,
+        }
+
+def _texts(records: List[dict], tokenizer, mode: str):
+    """Texts to tokenize and, per text, where the target output starts (in characters)."""
+    if mode == "prompt":
+        prompts = [build_prompt(r["instruction"], r.get("input", "")) for r in records]
+        return prompts, [len(p) for p in prompts]
+    texts = [format_instruction(r, tokenizer.eos_token) for r in records]
+    starts = [len(build_prompt(r["instruction"], r.get("input", ""))) for r in records]
+    return texts, starts
+
+def build_cache(records: Iterable[dict], tokenizer, directory: Union[str, Path], key: dict,
+                batch_size: int = 1024) -> int:
+    """
+    Tokenize records into a new cache entry at `directory`.
+
+    Tokens are appended to the flat files batch by batch, so memory use is
+    one batch. The entry is built in a temporary directory and renamed into
+    place, so a crash never leaves a half-written entry behind. Returns the
+    number of examples.
+    """
+    directory = Path(directory)
+    tmp_dir = directory.with_name(directory.name + ".tmp")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+
+    mode = key["mode"]
+    use_offsets = getattr(tokenizer, "is_fast", False)
+    offsets = [0]
+    files = {name: open(tmp_dir / f"{name}.bin", 'wb') for name in ARRAYS}
+
+    def flush(batch):
+        texts, starts = _texts(batch, tokenizer, mode)
+        encoded = tokenizer(
+            texts,
+            truncation=True,
+            max_length=key["max_length"],
+            return_offsets_mapping=use_offsets,
+        )
+        for i, ids in enumerate(encoded["input_ids"]):
+            if mode == "prompt":
+                label_mask = np.zeros(len(ids), dtype=np.uint8)
+            elif use_offsets:
+                # A token belongs to the target once it starts at or after the output text
+                label_mask = np.array([start >= starts[i] and end > start
+                                       for start, end in encoded["offset_mapping"][i]], dtype=np.uint8)
+            else:
+                prompt_len = len(tokenizer(texts[i][:starts[i]])["input_ids"])
+                label_mask = (np.arange(len(ids)) >= prompt_len).astype(np.uint8)
+            files["input_ids"].write(np.asarray(ids, dtype=np.int32).tobytes())
+            files["attention_mask"].write(np.asarray(encoded["attention_mask"][i], dtype=np.uint8).tobytes())
+            files["label_mask"].write(label_mask.tobytes())
+            offsets.append(offsets[-1] + len(ids))
+
+    try:
+        batch = []
+        for record in records:
+            batch.append(record)
+            if len(batch) == batch_size:
+                flush(batch)
+                batch = []
+        if batch:
+            flush(batch)
+    finally:
+        for f in files.values():
+            f.close()
+
+    np.save(tmp_dir / "offsets.npy", np.asarray(offsets, dtype=np.int64))
+    with open(tmp_dir / "meta.json", 'w', encoding='utf-8') as f:
+        json.dump({**key, "examples": len(offsets) - 1, "tokens": offsets[-1]}, f, indent=2)
+
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(tmp_dir, directory)
+    return len(offsets) - 1
+
+def load_or_build(data_path: Union[str, Path], tokenizer, max_length: int = 256, mode: str = "train",
+                  cache_dir: Union[str, Path] = DEFAULT_CACHE_DIR, mask_prompt: bool = False,
+                  records: Optional[Iterable[dict]] = None) -> TokenizedCache:
+    """
+    Open the cache entry for this data file, building it first if any of
+    its inputs changed. Older entries for the same file and mode are removed.
+
+    `records` may be passed when the caller already holds the file's
+    records; otherwise they are read from `data_path`.
+    """
+    if mode not in MODES:
+        raise ValueError(f"mode must be one of {MODES}, got {mode!r}")
+
+    key = cache_key(tokenizer, data_path, max_length, mode)
+    prefix = f"{Path(data_path).stem}-{mode}-"
+    directory = Path(cache_dir) / (prefix + _key_digest(key))
+
+    if (directory / "meta.json").exists():
+        print(f"✅ Token cache hit: {directory}")
+        return TokenizedCache(directory, mask_prompt=mask_prompt)
+
+    print(f"Building token cache: {directory}")
+    if records is None:
+        with open(data_path, 'r', encoding='utf-8') as f:
+            records = json.load(f)
+    count = build_cache(records, tokenizer, directory, key)
+
+    for stale in Path(cache_dir).glob(prefix + "*"):
+        if stale != directory and stale.is_dir():
+            shutil.rmtree(stale, ignore_errors=True)
+
+    print(f"✅ Cached {count} examples")
+    return TokenizedCache(directory, mask_prompt=mask_prompt)
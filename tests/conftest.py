@@ -0,0 +1,6 @@
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+for scripts_dir in ("dataset_preprocessing_scripts", "model_scripts"):
+    sys.path.insert(0, str(ROOT / scripts_dir))
@@ -0,0 +1,23 @@
+from convert_to_alpaca import main
+from utils import write_records
+
+def _entries(prefix: str, count: int):
+    return [{"id": f"{prefix}_{i}", "instruction": f"Remove {prefix}_{i}.log",
+             "linux": f"rm {prefix}_{i}.log", "windows_cmd": f"del {prefix}_{i}.log", "mac": f"rm {prefix}_{i}.log"}
+            for i in range(count)]
+
+def test_conversion_is_identical_for_any_worker_count_and_file_order(tmp_path):
+    first, second = tmp_path / "first", tmp_path / "second"
+    write_records(_entries("a", 40), first / "01_a.json")
+    write_records(_entries("b", 30), first / "02_b.jsonl")
+    # Same entries, split across files the other way round
+    write_records(_entries("b", 30), second / "01_b.json")
+    write_records(_entries("a", 40), second / "02_a.json")
+
+    outputs = []
+    for input_dir, workers in [(first, 1), (first, 2), (second, 1)]:
+        output_dir = tmp_path / f"out_{input_dir.name}_{workers}"
+        main(["--input-dir", str(input_dir), "--output-dir", str(output_dir), "--workers", str(workers)])
+        assert [path.name for path in output_dir.iterdir()] == ["full_dataset.json"]
+        outputs.append((output_dir / "full_dataset.json").read_bytes())
+    assert outputs[0] == outputs[1] == outputs[2]
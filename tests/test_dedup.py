@@ -0,0 +1,34 @@
+from dedup import DedupIndex, dedup_files
+from utils import iter_records, write_records
+
+def _entry(entry_id: str, instruction: str, linux: str = "ls -la", category: str = "file_operations") -> dict:
+    return {"id": entry_id, "category": category, "instruction": instruction,
+            "linux": linux, "windows_cmd": linux.replace("ls -la", "dir /a"), "mac": linux}
+
+def test_exact_and_near_duplicates_across_files(tmp_path):
+    raw, out = tmp_path / "raw", tmp_path / "out"
+    write_records([
+        _entry("a", "List all files in the current directory"),
+        _entry("b", "  list ALL files in the current   directory."),   # exact after normalization
+        _entry("c", "Show disk usage", linux="du -sh ."),
+    ], raw / "01_file.json")
+    write_records([
+        _entry("d", "List all the files in the current directory", category="other"),  # near
+        _entry("e", "List all files in the current directory", linux="ls -l", category="other"),
+    ], raw / "02_other.jsonl")
+
+    removed = tmp_path / "removed.jsonl"
+    report = dedup_files(sorted(raw.iterdir()), out, removed, DedupIndex())
+
+    assert [entry["id"] for entry in iter_records(out / "01_file.json")] == ["a", "c"]
+    assert [entry["id"] for entry in iter_records(out / "02_other.jsonl")] == ["e"]
+    assert [(row["id"], row["kind"], row["duplicate_of"]) for row in iter_records(removed)] == [
+        ("b", "exact", "a"), ("d", "near", "a")]
+    assert report["file_operations"] == {"total": 3, "kept": 2, "exact": 1}
+    assert report["other"] == {"total": 2, "kept": 1, "near": 1}
+
+def test_exact_only_keeps_paraphrases():
+    index = DedupIndex(near_duplicates=False)
+    assert index.check(_entry("a", "List all files in the current directory")) is None
+    assert index.check(_entry("b", "List all the files in the current directory")) is None
+    assert index.check(_entry("c", "list all files in the current directory!")) == ("exact", "a", 1.0)
@@ -0,0 +1,90 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from generation import eos_token_ids, generate_batch, generate_fanout, make_row, stop_index, tokenize_prompts
+from prompts import OS_TAGS, windows_prompt
+
+def test_windows_trailing_backslash_stops_at_newline():
+    response = "move notes.md Pictures\\"
+    posix = not windows_prompt("Move notes.md into Pictures", "[WINDOWS]")
+    assert stop_index(response + "\nmove", "single", posix) == len(response)
+
+def test_posix_backslash_escapes_newline():
+    response = "echo one \\\ntwo"
+    assert stop_index(response + "\nls", "single", posix=True) == len(response)
+
+@pytest.mark.parametrize("response, instruction, input_text", [
+    ("echo NTFS doesn't use inodes in the same way.", "Show inode usage", "[WINDOWS]"),
+    ("echo Chocolatey doesn't track orphans natively.", "Remove orphaned packages", "[WINDOWS]"),
+    ("awk -F',' '{print $2}' data.csv", "Print the second column of data.csv", "[LINUX]"),
+    ("echo 'Package: node\nPin: version 14*\nPin-Priority: 1001' | sudo tee /etc/apt/preferences.d/node",
+     "Pin the node package version", "[LINUX]"),
+])
+def test_dataset_outputs_stop_at_their_newline(response, instruction, input_text):
+    posix = not windows_prompt(instruction, input_text)
+    assert all(stop_index(response[:end], "single", posix) is None for end in range(1, len(response)))
+    assert stop_index(response + "\nrm -rf build", "single", posix) == len(response)
+
+def test_unterminated_single_quote_ends_at_newline_once_decoding_stops():
+    text = "echo 'unterminated\nrm -rf build"
+    assert stop_index(text, "single", posix=True) is None
+    assert stop_index(text, "single", posix=True, final=True) == text.index("\n")
+    assert stop_index(text + "\n### Instruction", "single", posix=True) == text.index("\n")
+
+def _tiny_qwen3():
+    """A randomly initialised two-layer Qwen3 and a byte-level tokenizer (no downloads)."""
+    transformers = pytest.importorskip("transformers")
+    from tokenizers import Tokenizer, decoders, models, pre_tokenizers
+
+    byte_chars = sorted(pre_tokenizers.ByteLevel.alphabet())
+    vocab = {char: i for i, char in enumerate(byte_chars)}
+    vocab["<|endoftext|>"] = len(vocab)
+    backend = Tokenizer(models.BPE(vocab=vocab, merges=[]))
+    backend.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    backend.decoder = decoders.ByteLevel()
+    tokenizer = transformers.PreTrainedTokenizerFast(tokenizer_object=backend, eos_token="<|endoftext|>",
+                                                     pad_token="<|endoftext|>")
+
+    torch.manual_seed(0)
+    config = transformers.Qwen3Config(vocab_size=len(vocab), hidden_size=64, intermediate_size=128,
+                                      num_hidden_layers=2, num_attention_heads=4, num_key_value_heads=2,
+                                      head_dim=16, max_position_embeddings=512,
+                                      eos_token_id=tokenizer.eos_token_id, pad_token_id=tokenizer.pad_token_id)
+    model = transformers.Qwen3ForCausalLM(config).eval()
+    return model, tokenizer
+
+def _reference_response(model, tokenizer, instruction, input_text, budgets):
+    """One-prompt greedy model.generate, cut by the same row logic as the batch."""
+    row = make_row(tokenizer, instruction, input_text, budgets, None, False, eos_token_ids(tokenizer))
+    ids = tokenize_prompts(tokenizer, [(instruction, input_text)])[0]
+    output = model.generate(torch.tensor([ids]), attention_mask=torch.ones((1, len(ids)), dtype=torch.long),
+                            max_new_tokens=row.budget, do_sample=False, pad_token_id=tokenizer.pad_token_id)
+    for token in output[0, len(ids):].tolist():
+        if row.step(token) is None:
+            break
+    return row.response()
+
+@pytest.mark.parametrize("draft_tokens", [0, 3])
+def test_generate_batch_matches_per_sample_generate(draft_tokens):
+    model, tokenizer = _tiny_qwen3()
+    # Rows leave at different steps; the JSON prompt is the longest and leaves
+    # first, so its leading cache columns get trimmed
+    budgets = {"single": 9, "implicit": 12, "json": 4}
+    pairs = [
+        ("List files", "[LINUX]"),
+        ("Show the current directory in a long format with hidden files", "[WINDOWS]"),
+        ("Count lines in notes.txt", ""),
+        ("Remove the build directory", "Return the command for all operating systems as JSON"),
+        ("Print the date", "[MAC]"),
+    ]
+    expected = [_reference_response(model, tokenizer, *pair, budgets) for pair in pairs]
+    assert generate_batch(model, tokenizer, pairs, batch_size=3, budgets=budgets,
+                          draft_tokens=draft_tokens) == expected
+
+def test_generate_fanout_matches_per_sample_generate():
+    model, tokenizer = _tiny_qwen3()
+    budgets = {"single": 7, "implicit": 7, "json": 7}
+    responses = generate_fanout(model, tokenizer, "Show disk usage", budgets=budgets)
+    assert responses == {tag: _reference_response(model, tokenizer, "Show disk usage", tag, budgets)
+                         for tag in OS_TAGS}
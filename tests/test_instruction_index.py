@@ -0,0 +1,18 @@
+import json
+
+from instruction_index import InstructionIndex, build_index
+
+ENTRY = {"instruction": "Show disk usage", "linux": "df -h", "windows_cmd": "wmic logicaldisk get size,freespace",
+         "mac": "df -h"}
+
+def test_build_index_skips_validation_cache(tmp_path):
+    (tmp_path / "basic.json").write_text(json.dumps([ENTRY]), encoding="utf-8")
+    (tmp_path / "basic_issues.json").write_text(json.dumps([{**ENTRY, "linux": "du"}]), encoding="utf-8")
+    (tmp_path / ".validation_cache.json").write_text(json.dumps({"basic.json": {"sha256": "0" * 64}}),
+                                                     encoding="utf-8")
+
+    entries = build_index(tmp_path)
+
+    assert list(entries) == ["show disk usage"]
+    assert entries["show disk usage"]["confidence"] == 1.0
+    assert InstructionIndex(entries).lookup("Show disk usage.", "[MAC]") == "df -h"
@@ -0,0 +1,39 @@
+import pytest
+
+from merge_complicated import append_records, merge_category, merge_complicated_files
+from utils import save_json
+
+def _entry(entry_id: str, instruction: str) -> dict:
+    return {"id": entry_id, "instruction": instruction, "linux": f"echo {entry_id}",
+            "windows_cmd": f"echo {entry_id}", "mac": f"echo {entry_id}", "tags": ["é", {"nested": [1, 2]}]}
+
+@pytest.mark.parametrize("existing", [[], [_entry("a", "First"), _entry("b", "Second")]])
+def test_append_records_matches_save_json(tmp_path, existing):
+    appended, saved = tmp_path / "appended.json", tmp_path / "saved.json"
+    new = [_entry("c", "Third"), _entry("d", "Fourth")]
+    save_json(existing, appended)
+    append_records(appended, new)
+    save_json(existing + new, saved)
+    assert appended.read_bytes() == saved.read_bytes()
+
+def test_incremental_merge_is_byte_identical_to_save_json(tmp_path):
+    main_file, comp_file = tmp_path / "01_file.json", tmp_path / "01_file_complicated.json"
+    existing = [_entry("a", "First"), _entry("b", "Second")]
+    save_json(existing, main_file)
+    duplicate_content = {**_entry("a", "First"), "id": "a2"}
+    save_json([_entry("c", "Third"), _entry("a", "Other"), duplicate_content], comp_file)
+
+    merge_complicated_files(tmp_path, workers=1)
+    expected = tmp_path / "expected.json"
+    save_json(existing + [_entry("c", "Third")], expected)
+    assert main_file.read_bytes() == expected.read_bytes()
+
+    # A later run only appends what the changed complicated file adds
+    save_json([_entry("c", "Third"), _entry("d", "Fourth")], comp_file)
+    result = merge_category(main_file, comp_file, tmp_path / ".merge_index")
+    assert result["added"] == 1 and result["duplicate_id"] == 1 and not result["index_rebuilt"]
+    save_json(existing + [_entry("c", "Third"), _entry("d", "Fourth")], expected)
+    assert main_file.read_bytes() == expected.read_bytes()
+
+    assert merge_category(main_file, comp_file, tmp_path / ".merge_index")["skipped_unchanged"]
+    assert main_file.read_bytes() == expected.read_bytes()
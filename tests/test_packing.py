@@ -0,0 +1,21 @@
+import random
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from packing import pack_bins
+
+@pytest.mark.parametrize("count", [0, 1, 7, 2000])
+def test_pack_bins_places_every_index_once_within_max_length(count):
+    rng = random.Random(count)
+    lengths = [rng.randint(1, 300) for _ in range(count)]
+
+    bins = pack_bins(lengths, 256)
+
+    assert sorted(index for row in bins for index in row) == list(range(count))
+    assert all(sum(min(lengths[i], 256) for i in row) <= 256 for row in bins)
+
+def test_pack_bins_is_first_fit_decreasing():
+    assert pack_bins([5, 3, 4, 2, 6], 8) == [[4, 3], [0, 1], [2]]
@@ -0,0 +1,24 @@
+import itertools
+import json
+import random
+
+from procedural_generate import CATEGORIES, build_entry, main
+from utils import iter_records
+
+def _content(entry: dict) -> str:
+    """An entry without its random id."""
+    return json.dumps({key: value for key, value in entry.items() if key != "id"}, sort_keys=True)
+
+def _every_combination(filename: str):
+    spec, rng = CATEGORIES[filename], random.Random(0)
+    return sorted(_content(build_entry(spec, template, values, rng))
+                  for template in spec.templates for values in itertools.product(*template.slots))
+
+def test_exhaustive_enumeration_is_unique_and_complete(tmp_path):
+    names = ["05_system_information", "09_compression", "10_environment_variables"]
+    main(["--mode", "enumerate", "--exhaustive", "--categories", *names, "--shard-size", "8",
+          "--workers", "1", "--output-dir", str(tmp_path)])
+    for name in names:
+        entries = [_content(entry) for entry in iter_records(tmp_path / f"{name}.json")]
+        assert len(set(entries)) == len(entries)
+        assert sorted(entries) == _every_combination(f"{name}.json")
@@ -0,0 +1,8 @@
+from prompts import windows_prompt
+
+def test_windows_prompt_from_tag_or_instruction():
+    assert windows_prompt("List files", "[WINDOWS]")
+    assert not windows_prompt("List files", "[LINUX]")
+    assert windows_prompt("List files in Windows CMD")
+    assert not windows_prompt("Copy the windows folder on macOS")
+    assert not windows_prompt("List files", "Provide commands for all OS in JSON format")
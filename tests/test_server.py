@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from server import InferenceServer, Request, Scheduler
+
+class FailingModel(torch.nn.Module):
+    """Every forward pass raises, as a step that breaks mid-way would."""
+
+    def __init__(self):
+        super().__init__()
+        self.weight = torch.nn.Parameter(torch.zeros(1))
+
+    def forward(self, **kwargs):
+        raise RuntimeError("step failed")
+
+class StubTokenizer:
+    pad_token_id = 0
+    eos_token_id = 1
+
+    def __call__(self, texts, **kwargs):
+        return {"input_ids": [[2, 3, 4] for _ in texts]}
+
+def test_failed_step_fails_requests_and_resets_the_batch():
+    scheduler = Scheduler(FailingModel(), StubTokenizer())
+    first_batch = scheduler.batch
+    scheduler.start()
+
+    async def submit():
+        request = Request("List files", "[LINUX]", asyncio.get_running_loop())
+        scheduler.submit(request)
+        return await asyncio.wait_for(request.future, 10)
+
+    try:
+        with pytest.raises(RuntimeError, match="step failed"):
+            asyncio.run(submit())
+        health = scheduler.health()
+    finally:
+        scheduler.stop()
+    assert health["alive"] and health["restarts"] == 1 and health["failed"] == 1
+    assert health["last_error"] == "RuntimeError: step failed"
+    assert scheduler.batch is not first_batch and len(scheduler.batch) == 0 and not scheduler.owners
+
+class StubScheduler:
+    def __init__(self, alive: bool = True):
+        self._alive = alive
+
+    def health(self) -> dict:
+        return {"alive": self._alive}
+
+@pytest.mark.parametrize("path, body", [
+    ("/v1/command", ["List files"]),
+    ("/v1/all", "List files"),
+    ("/v1/batch", None),
+    ("/v1/batch", {"requests": ["List files"]}),
+])
+def test_non_object_bodies_are_rejected(path, body):
+    status, payload = asyncio.run(InferenceServer(StubScheduler()).route("POST", path, body))
+    assert status == 400 and "error" in payload
+
+def test_health_is_503_when_the_scheduler_died():
+    server = InferenceServer(StubScheduler(alive=False))
+    assert asyncio.run(server.route("GET", "/health", {}))[0] == 503
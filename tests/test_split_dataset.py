@@ -0,0 +1,41 @@
+import json
+
+from convert_to_alpaca import iter_alpaca_examples
+from split_dataset import SPLIT_NAMES, group_key, hash_split
+from utils import iter_records, write_records
+
+def _entries(count: int, start: int = 0):
+    return [{"id": f"file_{i}", "instruction": f"Show the first lines of report_{i}.txt",
+             "linux": f"head report_{i}.txt", "windows_cmd": f"more report_{i}.txt", "mac": f"head report_{i}.txt"}
+            for i in range(start, start + count)]
+
+def _split(tmp_path, entries, name: str):
+    source = {}
+    examples = []
+    for entry in entries:
+        for example in iter_alpaca_examples([entry], seed=42):
+            source[json.dumps(example, sort_keys=True)] = entry["id"]
+            examples.append(example)
+    write_records(examples, tmp_path / f"{name}.json")
+    paths = {split: tmp_path / name / f"{split}.json" for split in SPLIT_NAMES}
+    hash_split(tmp_path / f"{name}.json", paths)
+    splits = {split: list(iter_records(path)) for split, path in paths.items()}
+    return examples, splits, source
+
+def test_hash_split_keeps_every_group_in_one_split(tmp_path):
+    examples, splits, source = _split(tmp_path, _entries(300), "full")
+
+    assert sorted(map(json.dumps, examples)) == sorted(json.dumps(r) for rows in splits.values() for r in rows)
+    assert all(splits.values())
+    seen_keys, seen_entries = {}, {}
+    for split, rows in splits.items():
+        for row in rows:
+            assert seen_keys.setdefault(group_key(row), split) == split
+            assert seen_entries.setdefault(source[json.dumps(row, sort_keys=True)], split) == split
+
+def test_adding_records_does_not_move_existing_ones(tmp_path):
+    _, before, _ = _split(tmp_path, _entries(100), "before")
+    _, after, _ = _split(tmp_path, _entries(150), "after")
+    for split in SPLIT_NAMES:
+        moved = [row for row in before[split] if row not in after[split]]
+        assert not moved
@@ -0,0 +1,55 @@
+import pytest
+
+from utils import RecordWriter, iter_records, keyed_shuffle, save_json, write_records
+
+RECORDS = [
+    {"instruction": "List files", "linux": "ls -la", "windows_cmd": "dir /a", "mac": "ls -la"},
+    {"instruction": "Brackets ] and commas , inside strings", "tags": [], "nested": {"a": [1, {"b": None}]}},
+    {"instruction": "Non-ASCII: café — 日本語", "count": 12345678901234567890, "ratio": -1.5e-7},
+    12,
+    "a bare string",
+    [True, False],
+]
+
+def test_jsonl_records_that_are_arrays(tmp_path):
+    path = tmp_path / "rows.jsonl"
+    path.write_text('[1, 2]\n["a"]\n', encoding="utf-8")
+    assert list(iter_records(path)) == [[1, 2], ["a"]]
+
+def test_json_array_of_arrays(tmp_path):
+    path = tmp_path / "rows.json"
+    with RecordWriter(path) as writer:
+        writer.write_all([[1, 2], ["a"]])
+    assert list(iter_records(path)) == [[1, 2], ["a"]]
+
+@pytest.mark.parametrize("suffix", [".json", ".jsonl"])
+@pytest.mark.parametrize("chunk_size", [1, 7, 1 << 16])
+@pytest.mark.parametrize("records", [RECORDS, []])
+def test_streaming_round_trip(tmp_path, suffix, chunk_size, records):
+    path = tmp_path / f"records{suffix}"
+    assert write_records(records, path) == len(records)
+    assert list(iter_records(path, chunk_size=chunk_size)) == records
+
+@pytest.mark.parametrize("indent", [2, None])
+@pytest.mark.parametrize("records", [RECORDS, []])
+def test_record_writer_matches_save_json(tmp_path, indent, records):
+    streamed, saved = tmp_path / "streamed.json", tmp_path / "saved.json"
+    write_records(records, streamed, indent=indent)
+    save_json(records, saved, indent=indent)
+    assert streamed.read_bytes() == saved.read_bytes()
+    assert list(iter_records(saved, chunk_size=5)) == records
+
+def test_keyed_shuffle_ignores_input_order(tmp_path):
+    records = [{"id": i, "text": f"record {i % 50}"} for i in range(500)] + [{"id": 0, "text": "record 0"}]
+    forward, backward = tmp_path / "forward.json", tmp_path / "backward.json"
+    assert keyed_shuffle(records, forward, num_buckets=8) == len(records)
+    keyed_shuffle(reversed(records), backward, num_buckets=8)
+    assert forward.read_bytes() == backward.read_bytes()
+
+    shuffled = list(iter_records(forward))
+    assert shuffled != records
+    assert sorted(shuffled, key=repr) == sorted(records, key=repr)
+
+    reseeded = tmp_path / "reseeded.json"
+    keyed_shuffle(records, reseeded, seed=7, num_buckets=8)
+    assert list(iter_records(reseeded)) != shuffled